@@ -0,0 +1,5 @@
+"""Reproducible benchmarks for the BookSpace backend.
+
+Every script generates its own synthetic data, so runs are comparable
+between machines and over time.
+"""
@@ -0,0 +1,61 @@
+"""Time the content neighbour build and check it against exact cosine on a sample.
+
+    python -m benchmarks.content_similarity --books 2000000 --workers 8
+"""
+import argparse
+import os
+import random
+import resource
+import time
+
+import numpy as np
+
+from benchmarks import synthetic
+from bookspace.applications.books import content
+
+
+def _exact(matrix, row, top_k):
+    """Positions of the ``top_k`` rows with the highest cosine with ``row``, itself left out."""
+    scores = (matrix[row] @ matrix.T).toarray().ravel()
+    scores[row] = -1
+    best = np.argpartition(-scores, top_k)[:top_k]
+    return best[np.lexsort((best, -scores[best]))], scores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=200000)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--candidates', type=int, default=500, help='See content.top_neighbours.')
+    parser.add_argument('--block-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--sample', type=int, default=200, help='Books checked against exact cosine.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    ids, matrix = content.vectorize(row[:4] for row in synthetic.catalog(args.books, args.seed))
+    print(f'vectorized {len(ids)} books, {matrix.shape[1]} features, {matrix.nnz} non-zeros '
+          f'in {time.perf_counter() - start:.1f}s')
+
+    start = time.perf_counter()
+    positions, scores = content.top_neighbours(matrix, args.top_k, args.candidates, args.block_size, args.workers)
+    elapsed = time.perf_counter() - start
+    print(f'neighbours with {args.workers} worker(s) in {elapsed:.1f}s, '
+          f'{len(ids) / elapsed:.0f} books/s, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MiB')
+
+    rng = random.Random(args.seed)
+    sample = rng.sample(range(len(ids)), min(args.sample, len(ids)))
+    recall = lost = 0.0
+    for row in sample:
+        best, exact = _exact(matrix, row, args.top_k)
+        found = scores[row][positions[row] >= 0]
+        # ties with the last of the exact neighbours count as found
+        recall += (found >= exact[best[-1]] - 1e-6).sum() / args.top_k
+        lost += exact[best].sum() - found.sum()
+    print(f'recall@{args.top_k} against exact cosine {recall / len(sample):.3f}, '
+          f'score lost per book {lost / len(sample):.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Seed the application database with a synthetic catalog and its readers."""
+import itertools
+import os
+import random
+from collections import Counter, defaultdict
+
+from flask import current_app
+from flask_migrate import upgrade
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
+
+from benchmarks import synthetic
+from bookspace.applications.users.avatars import default_avatar
+from bookspace.core.app import db
+from bookspace.models import Books, User, Stats, Tokens, UsersBooks, Reviews, Notes, \
+    ReadingRollup, ListChoices, RolesChoices
+
+PASSWORD = 'benchmark'
+TOKEN_TTL = 7 * 24 * 3600
+
+_MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+_CHUNK = 10000
+# the app's own repair and build commands fill every aggregate the seed leaves out
+_COMMANDS = (['check-ratings', '--fix'], ['check-shelves', '--fix'], ['build-similar'], ['build-suggest'],
+             ['build-fuzzy'])
+
+
+def _insert(model, rows):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, _CHUNK))
+        if not chunk:
+            return
+        db.session.execute(model.__table__.insert(), chunk)
+
+
+def seed(users, books, per_user=40, idle=0, seed=0):
+    """Migrate the current app's database and fill it; it must be empty.
+
+    The first ``idle`` users have no token, so they can log in; every user
+    has the password ``PASSWORD``. Rating aggregates, shelf counters, the
+    similar books and the suggest snapshot are left to the app's commands.
+    """
+    upgrade(directory=_MIGRATIONS)
+    if db.session.query(User.id).first() is not None:
+        raise ValueError('the database already has users')
+    rng = random.Random(seed)
+    catalog = {row[0]: row for row in synthetic.catalog(books, seed)}
+    entries = list(synthetic.shelves(users, books, per_user, seed=seed))
+
+    reviews, notes = [], []
+    reviews_count = Counter()
+    rollup = defaultdict(lambda: [0, 0])
+    for user_id, book_id, shelf, rate, added in entries:
+        _, _, author, genre, pages, _ = catalog[book_id]
+        if rate and rng.random() < 0.15:
+            reviews.append({'user_id': user_id, 'books_id': book_id,
+                            'text': synthetic.sentence(rng, 10, 60), 'data_added': added})
+            reviews_count[book_id] += 1
+        if shelf != 'WR' and rng.random() < 0.1:
+            for _ in range(rng.randint(1, 3)):
+                notes.append({'user_id': user_id, 'books_id': book_id,
+                              'title': synthetic.sentence(rng, 1, 4)[:64],
+                              'text': synthetic.sentence(rng, 5, 40), 'data_added': added})
+        if shelf == 'DN':
+            totals = rollup[user_id, added.date(), author, genre]
+            totals[0] += 1
+            totals[1] += pages
+
+    avatar = default_avatar()
+    password = generate_password_hash(PASSWORD)
+    _insert(Books, ({'id': book_id, 'title': title, 'author': author, 'genre': genre,
+                     'pages': pages, 'rate': 0, 'reviews_count': reviews_count[book_id]}
+                    for book_id, title, author, genre, pages, _ in catalog.values()))
+    _insert(User, ({'id': user_id, 'email': email(user_id), 'username': f'reader{user_id}',
+                    'password': password, 'image_hash': avatar, 'role': RolesChoices.user}
+                   for user_id in range(1, users + 1)))
+    _insert(Stats, ({'user_id': user_id, 'week': rng.randint(0, 3), 'month': rng.randint(0, 10),
+                     'year': rng.randint(0, 100)} for user_id in range(1, users + 1)))
+    _insert(Tokens, ({'user_id': user_id, 'token': _token(user_id)} for user_id in range(idle + 1, users + 1)))
+    _insert(UsersBooks, ({'user_id': user_id, 'books_id': book_id, 'list': ListChoices[shelf],
+                          'rate': rate, 'data_added': added}
+                         for user_id, book_id, shelf, rate, added in entries))
+    _insert(Reviews, reviews)
+    _insert(Notes, notes)
+    _insert(ReadingRollup, ({'user_id': user_id, 'day': day, 'author': author, 'genre': genre,
+                             'books': count, 'pages': pages}
+                            for (user_id, day, author, genre), (count, pages) in rollup.items()))
+    db.session.commit()
+
+    runner = current_app.test_cli_runner()
+    for command in _COMMANDS:
+        result = runner.invoke(args=command)
+        if result.exit_code:
+            raise RuntimeError(f'{" ".join(command)} failed: {result.output}') from result.exception
+    return len(entries)
+
+
+def email(user_id):
+    return f'reader{user_id}@example.com'
+
+
+def _token(user_id):
+    user = User(email(user_id), f'reader{user_id}')
+    user.id = user_id
+    return user.generate_auth_token(expiration=TOKEN_TTL).decode('ascii')
+
+
+class Dataset(object):
+    """What the benchmark needs to know about a seeded database to build requests.
+
+    Everything is read back from the database, so a database seeded by an
+    earlier run can be reused. The last ``spare`` users holding a token are
+    kept apart for requests that use the token up, like logging out.
+    """
+
+    def __init__(self, spare=0, seed=0):
+        self.rng = random.Random(seed)
+        tokens = db.session.query(User.id, User.email, Tokens.token). \
+            join(Tokens, Tokens.user_id == User.id). \
+            order_by(User.id).all()
+        self.readers = tokens[:len(tokens) - spare]
+        self.spare = [token for _, _, token in tokens[len(self.readers):]]
+        self.idle = [row.email for row in db.session.query(User.email).
+                     outerjoin(Tokens, Tokens.user_id == User.id).
+                     filter(Tokens.id.is_(None)).
+                     order_by(User.id)]
+        reader_tokens = {user_id: token for user_id, _, token in self.readers}
+        self.entries = [(reader_tokens[user_id], book_id) for user_id, book_id in
+                        db.session.query(UsersBooks.user_id, UsersBooks.books_id).order_by(UsersBooks.id)
+                        if user_id in reader_tokens]
+        self.notes = [(reader_tokens[user_id], note_id) for note_id, user_id in
+                      db.session.query(Notes.id, Notes.user_id).order_by(Notes.id)
+                      if user_id in reader_tokens]
+        readers = func.count(UsersBooks.id)
+        popular = db.session.query(Books.id, Books.title, Books.author, Books.genre, readers). \
+            join(UsersBooks, UsersBooks.books_id == Books.id). \
+            group_by(Books.id, Books.title, Books.author, Books.genre). \
+            order_by(readers.desc(), Books.id).all()
+        self.books = [row[:4] for row in popular]
+        self.popularity = list(itertools.accumulate(row[4] for row in popular))
+        self.rng.shuffle(self.entries)
+        self.rng.shuffle(self.notes)
+
+    def reader(self):
+        """(user_id, email, token) of a random reader."""
+        return self.rng.choice(self.readers)
+
+    def book(self):
+        """(id, title, author, genre) of a book picked as often as readers shelve it."""
+        return self.rng.choices(self.books, cum_weights=self.popularity)[0]
+
+    def note(self):
+        return self.rng.choice(self.notes)
+
+    def take_note(self):
+        return self.notes.pop()
+
+    def take_entry(self):
+        """(token, book_id) of a shelved book; it is not handed out again."""
+        return self.entries.pop()
+
+    def take_idle(self):
+        """Email of a user without a token; it is not handed out again."""
+        return self.idle.pop()
+
+    def take_spare(self):
+        return self.spare.pop()
@@ -0,0 +1,305 @@
+"""Drive every users and books route against a seeded database.
+
+    python -m benchmarks.endpoints --users 2000 --books 20000 --save-baseline
+    python -m benchmarks.endpoints --users 2000 --books 20000
+
+The first run records ``benchmarks/baseline.json``; later runs compare
+against it and exit with status 1 when an endpoint got slower than the
+tolerance allows, runs more queries or fails more often. Requests go
+through the Flask test client, or to a running server with ``--url``
+(start it on the same ``--database`` with ``--reuse``; queries are read
+from the X-DB-Queries header, which debug mode adds).
+"""
+import argparse
+import base64
+import datetime
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from PIL import Image
+
+from benchmarks import synthetic
+from benchmarks.dataset import Dataset, PASSWORD, seed
+from bookspace.core import querystats
+from bookspace.core.app import create_app, db
+
+_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+_DATABASE = os.path.join(tempfile.gettempdir(), 'bookspace-bench.db')
+
+
+def _avatar():
+    image = Image.new('RGB', (256, 256))
+    image.putdata([(x, y, (x + y) // 2) for y in range(256) for x in range(256)])
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _reader(method, path, payload=None):
+    """Request a random reader makes; ``path`` and ``payload`` may be callables of (dataset, book)."""
+    def build(ds, i):
+        book = ds.book()
+        return (method, path(ds, book) if callable(path) else path, ds.reader()[2],
+                payload(ds, book) if callable(payload) else payload)
+    return build
+
+
+def _search_word(ds, book):
+    return book[2].split()[-1].lower()
+
+
+def _edit_note(ds, i):
+    token, note_id = ds.note()
+    return 'PUT', f'/books/notes/{note_id}', token, {'text': synthetic.sentence(ds.rng, 5, 40)}
+
+
+def _delete_note(ds, i):
+    token, note_id = ds.take_note()
+    return 'DELETE', f'/books/notes/{note_id}', token, None
+
+
+def _delete_entry(ds, i):
+    token, book_id = ds.take_entry()
+    return 'DELETE', f'/books/{book_id}', token, None
+
+
+# name -> build(dataset, i) returning (method, path, token, json payload)
+SCENARIOS = [
+    ('POST /register', lambda ds, i: ('POST', '/register', None,
+                                      {'email': f'new{ds.stamp}-{i}@example.com', 'password': PASSWORD})),
+    ('POST /google/register', lambda ds, i: ('POST', '/google/register', None,
+                                             {'email': f'google{ds.stamp}-{i}@example.com',
+                                              'password': PASSWORD})),
+    ('POST /login', lambda ds, i: ('POST', '/login', None, {'email': ds.take_idle(), 'password': PASSWORD})),
+    ('POST /google/login', lambda ds, i: ('POST', '/google/login', None, {'email': ds.take_idle()})),
+    ('POST /login/restore', lambda ds, i: ('POST', '/login/restore', None, {'email': ds.reader()[1]})),
+    ('GET /profile', _reader('GET', '/profile')),
+    ('PUT /profile', _reader('PUT', '/profile', lambda ds, book: {'quote': synthetic.sentence(ds.rng, 2, 8)})),
+    ('GET /profile/image', _reader('GET', '/profile/image?size=128')),
+    ('GET /profile/image/raw', _reader('GET', '/profile/image/raw?size=128')),
+    ('POST /profile/image', _reader('POST', '/profile/image', lambda ds, book: {'image': ds.avatar})),
+    ('GET /stats', _reader('GET', '/stats?range=year')),
+    ('POST /stats', _reader('POST', '/stats', {'range': 'month'})),
+    ('PUT /stats', _reader('PUT', '/stats', lambda ds, book: {'week': str(ds.rng.randint(1, 3)),
+                                                              'month': str(ds.rng.randint(1, 10)),
+                                                              'year': str(ds.rng.randint(1, 100))})),
+    ('GET /stats/timeline', _reader('GET', lambda ds, book: '/stats/timeline?unit=week&from=' +
+                                    (datetime.date.today() - datetime.timedelta(days=365)).isoformat())),
+    ('GET /books/read', _reader('GET', '/books/read')),
+    ('GET /books/progress', _reader('GET', '/books/progress')),
+    ('GET /books/future', _reader('GET', '/books/future?total=1')),
+    ('GET /books/recent', _reader('GET', '/books/recent')),
+    ('POST /books/search', _reader('POST', '/books/search', lambda ds, book: {'search': _search_word(ds, book)})),
+    ('POST /books/search fuzzy', _reader('POST', '/books/search', lambda ds, book: {
+        'search': synthetic.misspell(ds.rng, _search_word(ds, book)), 'mode': 'fuzzy'})),
+    ('GET /books/suggest', _reader('GET', lambda ds, book: f'/books/suggest?q={book[1][:3]}')),
+    ('GET /home/top', _reader('GET', '/home/top')),
+    ('GET /home/top genre', _reader('GET', lambda ds, book: f'/home/top?genre={book[3]}')),
+    ('GET /home/rec', _reader('GET', '/home/rec')),
+    ('GET /books/<id>', _reader('GET', lambda ds, book: f'/books/{book[0]}')),
+    ('POST /books/<id>', _reader('POST', lambda ds, book: f'/books/{book[0]}',
+                                 lambda ds, book: {'rate': str(ds.rng.randint(1, 5))})),
+    ('PUT /books/<id>', _reader('PUT', lambda ds, book: f'/books/{book[0]}',
+                                lambda ds, book: {'status': ds.rng.choice(('DN', 'IP', 'WR'))})),
+    ('GET /books/<id>/reviews', _reader('GET', lambda ds, book: f'/books/{book[0]}/reviews')),
+    ('POST /books/<id>/reviews', _reader('POST', lambda ds, book: f'/books/{book[0]}/reviews',
+                                         lambda ds, book: {'text': synthetic.sentence(ds.rng, 10, 60)})),
+    ('GET /books/<id>/notes', _reader('GET', lambda ds, book: f'/books/{book[0]}/notes')),
+    ('POST /books/<id>/notes', _reader('POST', lambda ds, book: f'/books/{book[0]}/notes',
+                                       lambda ds, book: {'title': synthetic.sentence(ds.rng, 1, 3),
+                                                         'text': synthetic.sentence(ds.rng, 5, 40)})),
+    ('PUT /books/notes/<id>', _edit_note),
+    ('DELETE /books/notes/<id>', _delete_note),
+    ('DELETE /books/<id>', _delete_entry),
+    ('GET /index', lambda ds, i: ('GET', '/index', None, None)),
+    ('POST /index', lambda ds, i: ('POST', '/index', None, None)),
+    ('POST /logout', lambda ds, i: ('POST', '/logout', ds.take_spare(), None)),
+]
+
+# every request of these uses up a user without a token / a spare token
+_TAKES_IDLE = ('POST /login', 'POST /google/login')
+_TAKES_SPARE = ('POST /logout',)
+
+
+def _status(code, body):
+    """The status a client sees: the one in the JSON body when there is one, as this API answers 200."""
+    if isinstance(body, dict) and 'status' in body:
+        try:
+            return int(body['status'])
+        except (TypeError, ValueError):
+            pass
+    return code
+
+
+class AppClient(object):
+    """Requests through the Flask test client; queries come from ``querystats``."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, token, payload):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        with querystats.recording() as seen:
+            response = self.client.open(path, method=method, headers=headers, json=payload)
+        return _status(response.status_code, response.get_json(silent=True)), \
+            sum(stats.count for _, _, stats in seen)
+
+
+class HttpClient(object):
+    """Requests to a running server; queries are None unless it runs in debug mode."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, token, payload):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request) as response:
+                code, body, response_headers = response.status, response.read(), response.headers
+        except urllib.error.HTTPError as error:
+            code, body, response_headers = error.code, error.read(), error.headers
+        try:
+            body = json.loads(body)
+        except ValueError:
+            body = None
+        queries = response_headers.get('X-DB-Queries')
+        return _status(code, body), int(queries) if queries is not None else None
+
+
+def run(client, dataset, build, requests, warmup):
+    """Time ``requests`` calls of one scenario after ``warmup`` unmeasured ones."""
+    latencies, queries, errors = [], [], 0
+    for i in range(warmup + requests):
+        call = build(dataset, i)
+        start = time.perf_counter()
+        status, count = client.request(*call)
+        elapsed = (time.perf_counter() - start) * 1000
+        if i < warmup:
+            continue
+        latencies.append(elapsed)
+        if count is not None:
+            queries.append(count)
+        errors += status >= 400
+    return {
+        'requests': requests,
+        'rps': round(requests * 1000 / sum(latencies), 1),
+        'p50': round(synthetic.percentile(latencies, 50), 2),
+        'p95': round(synthetic.percentile(latencies, 95), 2),
+        'p99': round(synthetic.percentile(latencies, 99), 2),
+        'queries': round(sum(queries) / len(queries), 2) if queries else None,
+        'errors': errors,
+    }
+
+
+def compare(results, baseline, tolerance, noise):
+    """Describe every way ``results`` are worse than ``baseline``.
+
+    Latency only counts when p95 grew by more than ``tolerance`` (a
+    fraction) and by more than ``noise`` milliseconds; any growth of the
+    mean query count or of the failed requests counts.
+    """
+    regressions = []
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if now['p95'] > before['p95'] * (1 + tolerance) and now['p95'] - before['p95'] > noise:
+            regressions.append(f'{name}: p95 {before["p95"]} -> {now["p95"]} ms')
+        if now['queries'] is not None and before['queries'] is not None and \
+                now['queries'] > before['queries'] + 0.5:
+            regressions.append(f'{name}: {before["queries"]} -> {now["queries"]} queries per request')
+        if now['errors'] > before['errors']:
+            regressions.append(f'{name}: {before["errors"]} -> {now["errors"]} failed requests')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--per-user', type=int, default=40, help='Average shelf size.')
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', default=f'sqlite:///{_DATABASE}')
+    parser.add_argument('--reuse', action='store_true', help='Use the database seeded by an earlier run.')
+    parser.add_argument('--url', help='Base URL of a running server to send the requests to.')
+    parser.add_argument('--only', help='Run the endpoints whose name contains this text.')
+    parser.add_argument('--baseline', default=_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 growth, as a fraction.')
+    parser.add_argument('--noise', type=float, default=1.0, help='p95 growth in ms that is never a regression.')
+    args = parser.parse_args(argv)
+
+    scenarios = [(name, build) for name, build in SCENARIOS if not args.only or args.only in name]
+    runs = args.requests + args.warmup
+    idle = runs * sum(name in _TAKES_IDLE for name, _ in scenarios)
+    spare = runs * sum(name in _TAKES_SPARE for name, _ in scenarios)
+    if args.users < 2 * (idle + spare):
+        parser.error(f'--users must be at least {2 * (idle + spare)} for {runs} requests per endpoint')
+
+    workdir = tempfile.gettempdir()
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': args.database,
+        'SUGGEST_SNAPSHOT': os.path.join(workdir, 'bookspace-bench-suggest.idx'),
+        'LEADERBOARD_VERSION_FILE': os.path.join(workdir, 'bookspace-bench-leaderboard'),
+    })
+    if not args.reuse and args.database == f'sqlite:///{_DATABASE}' and os.path.exists(_DATABASE):
+        os.remove(_DATABASE)
+    with app.app_context():
+        if not args.reuse:
+            start = time.perf_counter()
+            entries = seed(args.users, args.books, args.per_user, idle, args.seed)
+            print(f'seeded {args.users} users, {args.books} books, {entries} shelved books '
+                  f'in {time.perf_counter() - start:.1f}s')
+        dataset = Dataset(spare, args.seed)
+        db.session.remove()
+    dataset.stamp = int(time.time())
+    dataset.avatar = _avatar()
+    if len(dataset.idle) < idle or len(dataset.spare) < spare or \
+            min(len(dataset.entries), len(dataset.notes)) < runs:
+        sys.exit('the database has too few users, shelved books or notes left, seed it again')
+
+    client = HttpClient(args.url) if args.url else AppClient(app)
+    results = {}
+    print(f'{"endpoint":28} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"errors":>7}')
+    for name, build in scenarios:
+        result = results[name] = run(client, dataset, build, args.requests, args.warmup)
+        queries = '-' if result['queries'] is None else f'{result["queries"]:.1f}'
+        print(f'{name:28} {result["rps"]:8.1f} {result["p50"]:8.2f} {result["p95"]:8.2f} '
+              f'{result["p99"]:8.2f} {queries:>8} {result["errors"]:7}')
+
+    dataset_args = {key: getattr(args, key) for key in ('users', 'books', 'per_user', 'requests', 'seed')}
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({'dataset': dataset_args, 'endpoints': results}, file, indent=2, sort_keys=True)
+        print(f'baseline saved to {args.baseline}')
+        return
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, run with --save-baseline to record one')
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['dataset'] != dataset_args:
+        print(f'warning: the baseline was recorded with {baseline["dataset"]}')
+    regressions = compare(results, baseline['endpoints'], args.tolerance, args.noise)
+    if regressions:
+        print(f'\n{len(regressions)} REGRESSION(S) against {args.baseline}:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+    print(f'no regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
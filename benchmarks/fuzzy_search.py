@@ -0,0 +1,72 @@
+"""Compare the trigram fuzzy search with the ILIKE search on misspelled authors.
+
+    python -m benchmarks.fuzzy_search --books 1000000
+"""
+import argparse
+import random
+import sqlite3
+import time
+
+from benchmarks import synthetic
+from bookspace.core.trigram import TrigramIndex
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--books', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, author TEXT, '
+                       'genre TEXT, pages INTEGER, rate REAL)')
+    connection.executemany('INSERT INTO books VALUES (?, ?, ?, ?, ?, ?)',
+                           synthetic.catalog(args.books, args.seed))
+
+    index = TrigramIndex()
+    start = time.perf_counter()
+    for row in connection.execute('SELECT id, rate, title, author FROM books'):
+        index.add(*row)
+    print(f'indexed {len(index)} books, {len(index.postings)} trigrams '
+          f'in {time.perf_counter() - start:.1f}s')
+
+    rng = random.Random(args.seed)
+    authors = {}
+    targets = []
+    for book_id in rng.sample(range(1, args.books + 1), args.queries):
+        author = connection.execute('SELECT author FROM books WHERE id = ?', (book_id,)).fetchone()[0]
+        targets.append((author, synthetic.misspell(rng, author.split()[-1].lower())))
+        authors[author] = {row[0] for row in connection.execute(
+            'SELECT id FROM books WHERE author = ?', (author,))}
+
+    def ilike(query):
+        pattern = f'%{query}%'
+        return [row[0] for row in connection.execute(
+            'SELECT id FROM books WHERE genre LIKE ? OR title LIKE ? OR author LIKE ? LIMIT ?',
+            (pattern, pattern, pattern, args.limit))]
+
+    def fuzzy(query):
+        return [book_id for book_id, _ in index.search(query, args.limit)]
+
+    print(f'{"path":8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"recall":>8}')
+    for name, search in (('ilike', ilike), ('fuzzy', fuzzy)):
+        latencies, found = [], 0
+        for author, query in targets:
+            ids, elapsed = _timed(search, query)
+            latencies.append(elapsed)
+            found += bool(authors[author].intersection(ids))
+        print(f'{name:8} {synthetic.percentile(latencies, 50):9.2f} '
+              f'{synthetic.percentile(latencies, 95):9.2f} '
+              f'{synthetic.percentile(latencies, 99):9.2f} {found / len(targets):8.1%}')
+
+
+if __name__ == '__main__':
+    main()
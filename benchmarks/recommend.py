@@ -0,0 +1,128 @@
+"""Precision@k of the /home/rec recommenders on held out synthetic shelves.
+
+    python -m benchmarks.recommend --users 5000 --books 20000 --k 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from benchmarks import synthetic
+from bookspace.applications.books import recommend
+from bookspace.core import neighbours
+
+
+def _split(entries, holdout, min_books, rng):
+    """Per user: the entries to train on and the held out book ids to find."""
+    by_user = defaultdict(list)
+    for entry in entries:
+        by_user[entry[0]].append(entry)
+    train, test = [], {}
+    for user_id, shelf in by_user.items():
+        if len(shelf) < min_books:
+            train += shelf
+            continue
+        rng.shuffle(shelf)
+        cut = max(1, int(len(shelf) * holdout))
+        test[user_id] = {entry[1] for entry in shelf[:cut]}
+        train += shelf[cut:]
+    return train, test
+
+
+def _author_genre(catalog, train, k):
+    """The logic /home/rec falls back on: best rated books of the favourite author or genre."""
+    ratings = defaultdict(list)
+    for _, book_id, _, rate, _ in train:
+        if rate:
+            ratings[book_id].append(rate)
+    rate = {book_id: sum(rates) / len(rates) for book_id, rates in ratings.items()}
+    ranked = sorted(catalog, key=lambda row: (-rate.get(row[0], 0), row[0]))
+    position = {row[0]: i for i, row in enumerate(ranked)}
+    by_author, by_genre = defaultdict(list), defaultdict(list)
+    for book_id, _, author, genre, _, _ in ranked:
+        by_author[author].append(book_id)
+        by_genre[genre].append(book_id)
+    books = {row[0]: row for row in catalog}
+
+    def recommend_for(owned):
+        author = Counter(books[book_id][2] for book_id in owned).most_common(1)[0][0]
+        genre = Counter(books[book_id][3] for book_id in owned).most_common(1)[0][0]
+        found = []
+        for book_id in sorted(set(by_author[author][:k + len(owned)]) | set(by_genre[genre][:k + len(owned)]),
+                              key=position.get):
+            if book_id not in owned:
+                found.append(book_id)
+        return found[:k]
+    return recommend_for
+
+
+def _popular(train, k):
+    counts = Counter(entry[1] for entry in train)
+    ranked = [book_id for book_id, _ in counts.most_common()]
+
+    def recommend_for(owned):
+        return [book_id for book_id in ranked[:k + len(owned)] if book_id not in owned][:k]
+    return recommend_for
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--per-user', type=int, default=40)
+    parser.add_argument('--holdout', type=float, default=0.2, help='Share of every shelf held out.')
+    parser.add_argument('--min-books', type=int, default=5, help='Users with fewer books only train.')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--top-k', type=int, default=50, help='Neighbours kept per book.')
+    parser.add_argument('--alpha', type=float, default=0.2, help='See recommend.build_model.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    catalog = list(synthetic.catalog(args.books, args.seed))
+    entries = list(synthetic.shelves(args.users, args.books, args.per_user, seed=args.seed))
+    train, test = _split(entries, args.holdout, args.min_books, rng)
+    print(f'{len(entries)} shelved books, {len(test)} users with held out books')
+
+    start = time.perf_counter()
+    ids, result, scores = recommend.build_model([e[0] for e in train], [e[1] for e in train],
+                                                [recommend.weight(e[2], e[3]) for e in train],
+                                                args.top_k, args.alpha)
+    path = os.path.join(tempfile.gettempdir(), f'bookspace-rec-eval-{os.getpid()}.nbr')
+    neighbours.write(path, ids, result, scores)
+    model = neighbours.load(path)
+    print(f'built neighbours of {len(model)} books in {time.perf_counter() - start:.1f}s, '
+          f'{os.path.getsize(path) / 2 ** 20:.1f} MiB')
+
+    owned = defaultdict(dict)
+    for user_id, book_id, shelf, rate, _ in train:
+        owned[user_id][book_id] = recommend.weight(shelf, rate)
+
+    def item_item(books):
+        return [book_id for book_id, _ in recommend.score(model, list(books), list(books.values()), args.k)]
+
+    methods = [('item-item', item_item),
+               ('author/genre', _author_genre(catalog, train, args.k)),
+               ('popular', _popular(train, args.k))]
+    print(f'{"method":14} {"precision@" + str(args.k):>13} {"recall@" + str(args.k):>10} '
+          f'{"coverage":>9} {"ms/user":>8}')
+    for name, recommend_for in methods:
+        precision = recall = 0.0
+        shown = set()
+        start = time.perf_counter()
+        for user_id, held_out in test.items():
+            found = recommend_for(owned[user_id])
+            hits = len(held_out.intersection(found))
+            precision += hits / args.k
+            recall += hits / len(held_out)
+            shown.update(found)
+        elapsed = (time.perf_counter() - start) * 1000 / len(test)
+        print(f'{name:14} {precision / len(test):13.4f} {recall / len(test):10.4f} '
+              f'{len(shown) / args.books:9.1%} {elapsed:8.2f}')
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import itertools
+import math
+import random
+from datetime import datetime, timedelta
+
+_SYLLABLES = [onset + vowel + coda
+              for onset in ['', 'b', 'br', 'ch', 'd', 'f', 'g', 'gr', 'h', 'k', 'l', 'm',
+                            'n', 'p', 'r', 's', 'sh', 'st', 't', 'tr', 'v', 'w', 'z']
+              for vowel in ['a', 'e', 'i', 'o', 'u', 'y', 'ea', 'ou']
+              for coda in ['', '', '', 'n', 'r', 'l', 's', 'k', 'th']]
+
+GENRES = ['fantasy', 'science fiction', 'detective', 'romance', 'classics',
+          'thriller', 'history', 'biography', 'poetry', 'horror', 'adventure',
+          'philosophy', 'psychology', 'business', 'children', 'drama']
+
+
+def _word(rng, low=2, high=4):
+    return ''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(low, high)))
+
+
+def _zipf_weights(size, exponent=1.1):
+    """Cumulative weights where the n-th item is about n ** -exponent as likely."""
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, size + 1)))
+
+
+def catalog(count, seed=0):
+    """Yield ``count`` (id, title, author, genre, pages, rate) rows.
+
+    Authors and genres follow a Zipf distribution, so a few are very common
+    and most appear only a handful of times, like in the real catalog.
+    """
+    rng = random.Random(seed)
+    vocabulary = [_word(rng) for _ in range(5000)]
+    authors = [f'{_word(rng, 1, 2).title()} {_word(rng).title()}' for _ in range(max(1, count // 20))]
+    vocabulary_weights = _zipf_weights(len(vocabulary))
+    author_weights = _zipf_weights(len(authors))
+    genre_weights = _zipf_weights(len(GENRES), 0.8)
+    for book_id in range(1, count + 1):
+        title = ' '.join(rng.choices(vocabulary, cum_weights=vocabulary_weights,
+                                     k=rng.randint(1, 4))).capitalize()
+        author = rng.choices(authors, cum_weights=author_weights)[0]
+        genre = rng.choices(GENRES, cum_weights=genre_weights)[0]
+        yield book_id, title, author, genre, rng.randint(60, 900), round(rng.uniform(1, 5), 2)
+
+
+def sentence(rng, low=4, high=12):
+    return ' '.join(_word(rng) for _ in range(rng.randint(low, high))).capitalize() + '.'
+
+
+def shelves(users, books, per_user=40, days=730, seed=0):
+    """Yield (user_id, book_id, list, rate, added) rows of the users' shelves.
+
+    Shelf sizes are log-normal around ``per_user``: most readers keep a few
+    dozen books and a handful keep hundreds. Books have a Zipf popularity
+    that doesn't follow the id order, and readers have taste: half of their
+    picks come from one or two favourite genres and a quarter are more books
+    by an author they already picked, the rest is the popular books.
+    ``list`` is the ``ListChoices`` name and ``rate`` is 0 for books that
+    were not rated. The catalog is ``catalog(books, seed)``.
+    """
+    rng = random.Random(seed)
+    popular = list(range(1, books + 1))
+    rng.shuffle(popular)
+    popularity = _zipf_weights(books, 0.9)
+    weights = [after - before for before, after in zip([0] + popularity, popularity)]
+    by_genre, by_author = {}, {}
+    genre_of = {}
+    for book_id, _, author, genre, _, _ in catalog(books, seed):
+        genre_of[book_id] = genre
+        by_author.setdefault(author, []).append(book_id)
+    author_of = {book_id: author for author, ids in by_author.items() for book_id in ids}
+    for book_id, weight in zip(popular, weights):
+        by_genre.setdefault(genre_of[book_id], ([], []))
+        ids, cumulative = by_genre[genre_of[book_id]]
+        ids.append(book_id)
+        cumulative.append((cumulative[-1] if cumulative else 0) + weight)
+
+    now = datetime.utcnow().replace(microsecond=0)
+    for user_id in range(1, users + 1):
+        size = min(books // 2, int(rng.lognormvariate(math.log(per_user) - 0.5, 1.0)))
+        favourites = rng.sample(sorted(by_genre), rng.randint(1, 2))
+        picked, order = set(), []
+        while len(picked) < size:
+            roll = rng.random()
+            if order and roll < 0.25:
+                book_id = rng.choice(by_author[author_of[rng.choice(order)]])
+            elif roll < 0.75:
+                ids, cumulative = by_genre[rng.choice(favourites)]
+                book_id = rng.choices(ids, cum_weights=cumulative)[0]
+            else:
+                book_id = rng.choices(popular, cum_weights=popularity)[0]
+            if book_id not in picked:
+                picked.add(book_id)
+                order.append(book_id)
+        for book_id in sorted(picked):
+            shelf = rng.choices(('DN', 'IP', 'WR'), weights=(6, 1, 3))[0]
+            rate = 0
+            if shelf == 'DN' and rng.random() < 0.7:
+                rate = rng.choices((1, 2, 3, 4, 5), weights=(1, 2, 5, 8, 6))[0]
+            added = now - timedelta(seconds=rng.randrange(days * 86400))
+            yield user_id, book_id, shelf, rate, added
+
+
+def misspell(rng, word):
+    """``word`` with one typo: a swapped, dropped, doubled or replaced letter."""
+    if len(word) < 3:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.randrange(4)
+    if kind == 0:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if kind == 1:
+        return word[:i] + word[i + 1:]
+    if kind == 2:
+        return word[:i] + word[i] + word[i:]
+    return word[:i] + rng.choice('aeiouy') + word[i + 1:]
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from flask import current_app
+from scipy import sparse
+
+from bookspace.applications.books import similar
+from bookspace.core import neighbours
+from bookspace.core.app import db
+from bookspace.core.text import normalize
+from bookspace.models import Books
+
+# the author counts twice as much as a title word or the genre
+_FIELD_WEIGHTS = {'t': 1.0, 'a': 2.0, 'g': 1.0}
+_ARRAYS = ('data', 'indices', 'indptr')
+
+# matrices a worker process maps from the build directory
+_shared = {}
+
+
+def features(title, author, genre):
+    """Feature names of a book: its title words, its author and its genre, prefixed by field."""
+    result = [f't:{word}' for word in normalize(title).split() if len(word) > 1]
+    if normalize(author):
+        result.append(f'a:{normalize(author)}')
+    if normalize(genre):
+        result.append(f'g:{normalize(genre)}')
+    return result
+
+
+def vectorize(books):
+    """(ids, L2 normalized TF-IDF rows) of (id, title, author, genre) books, in the order given."""
+    vocabulary = {}
+    ids, columns, counts, indptr = array('i'), array('i'), array('f'), array('q', [0])
+    for book_id, title, author, genre in books:
+        ids.append(book_id)
+        row = {}
+        for name in features(title, author, genre):
+            column = vocabulary.setdefault(name, len(vocabulary))
+            row[column] = row.get(column, 0) + _FIELD_WEIGHTS[name[0]]
+        columns.extend(row.keys())
+        counts.extend(row.values())
+        indptr.append(len(columns))
+    matrix = sparse.csr_matrix((np.frombuffer(counts, np.float32), np.frombuffer(columns, np.int32),
+                                np.frombuffer(indptr, np.int64)), shape=(len(ids), len(vocabulary)))
+    frequencies = np.bincount(matrix.indices, minlength=len(vocabulary))
+    idf = np.log((1 + len(ids)) / (1 + frequencies)).astype(np.float32) + 1
+    matrix = (matrix @ sparse.diags(idf)).tocsr()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return np.frombuffer(ids, np.int32), (sparse.diags(1 / norms) @ matrix).tocsr()
+
+
+def _save(directory, name, matrix):
+    for part in _ARRAYS:
+        np.save(os.path.join(directory, f'{name}.{part}.npy'), getattr(matrix, part))
+
+
+def _load(directory, name, shape):
+    parts = [np.load(os.path.join(directory, f'{name}.{part}.npy'), mmap_mode='r') for part in _ARRAYS]
+    return sparse.csr_matrix(tuple(parts), shape=shape, copy=False)
+
+
+def _init(directory, rows, columns):
+    """Map the matrices of a build, shared through the page cache by every worker."""
+    _shared['matrix'] = _load(directory, 'matrix', (rows, columns))
+    _shared['postings'] = _load(directory, 'postings', (columns, rows))
+
+
+def _top_block(start, stop, top_k):
+    """Neighbours of rows [start, stop) as (start, row positions, scores).
+
+    Candidates are the rows in a posting list of one of the row's
+    features; they are then scored with the exact cosine.
+    """
+    matrix, postings = _shared['matrix'], _shared['postings']
+    candidates = (matrix[start:stop] @ postings).tocsr()
+    rows = np.repeat(np.arange(start, stop), np.diff(candidates.indptr))
+    similarities = np.asarray(matrix[rows].multiply(matrix[candidates.indices]).sum(axis=1), np.float32).ravel()
+    result = np.full((stop - start, top_k), -1, np.int64)
+    values = np.zeros((stop - start, top_k), np.float32)
+    for i in range(stop - start):
+        found = candidates.indices[candidates.indptr[i]:candidates.indptr[i + 1]]
+        scores = similarities[candidates.indptr[i]:candidates.indptr[i + 1]]
+        keep = found != start + i
+        found, scores = found[keep], scores[keep]
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+            found, scores = found[best], scores[best]
+        order = np.lexsort((found, -scores))
+        result[i, :len(order)] = found[order]
+        values[i, :len(order)] = scores[order]
+    return start, result, values
+
+
+def _postings(matrix, candidates):
+    """Feature x row matrix of the rows each feature brings up as candidates.
+
+    A feature of more than ``candidates`` rows only keeps those it weighs
+    most in: the rows with the fewest other features, which are also the
+    best matches of the rows sharing nothing else.
+    """
+    columns = matrix.tocsc()
+    for column in np.flatnonzero(np.diff(columns.indptr) > candidates):
+        data = columns.data[columns.indptr[column]:columns.indptr[column + 1]]
+        data[np.argsort(-data, kind='stable')[candidates:]] = 0
+    columns.eliminate_zeros()
+    return columns.T.tocsr()
+
+
+def top_neighbours(matrix, top_k, candidates, block_size=256, workers=1):
+    """Approximate top ``top_k`` cosine neighbours of every row of ``matrix``.
+
+    Rather than with every row it shares a feature with, every row of a
+    genre shared by half the catalog, a row is only compared with at most
+    ``candidates`` rows per feature (see ``_postings``), so the work grows
+    linearly with the catalog. Blocks of ``block_size`` rows are spread
+    over ``workers`` processes, which map the matrices from a temporary
+    directory instead of getting a copy. Returns (row positions, scores)
+    with one row of ``top_k`` per row, padded with -1.
+    """
+    rows, columns = matrix.shape
+    result = np.full((rows, top_k), -1, np.int64)
+    scores = np.zeros((rows, top_k), np.float32)
+    directory = tempfile.mkdtemp(prefix='bookspace-content-')
+    try:
+        _save(directory, 'matrix', matrix)
+        _save(directory, 'postings', _postings(matrix, candidates))
+        starts = range(0, rows, block_size)
+        stops = [min(start + block_size, rows) for start in starts]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init,
+                                     initargs=(directory, rows, columns)) as executor:
+                blocks = executor.map(_top_block, starts, stops, [top_k] * len(starts))
+                for start, block, values in blocks:
+                    result[start:start + len(block)], scores[start:start + len(block)] = block, values
+        else:
+            _init(directory, rows, columns)
+            for start, stop in zip(starts, stops):
+                _, block, values = _top_block(start, stop, top_k)
+                result[start:stop], scores[start:stop] = block, values
+            _shared.clear()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return result, scores
+
+
+def build(path=None, workers=None):
+    """Write the content neighbours of the whole catalog to ``path``; returns the number of books."""
+    config = current_app.config
+    path = path or config['CONTENT_NEIGHBOURS_FILE']
+    books = db.session.query(Books.id, Books.title, Books.author, Books.genre). \
+        order_by(Books.id).yield_per(10000)
+    ids, matrix = vectorize(books)
+    top_k = config['CONTENT_TOP_K']
+    if not len(ids):
+        return neighbours.write(path, ids, np.zeros((0, top_k)), np.zeros((0, top_k)))
+    positions, scores = top_neighbours(matrix, top_k, config['CONTENT_CANDIDATES'], config['CONTENT_BLOCK_SIZE'],
+                                       workers or os.cpu_count() or 1)
+    result = np.where(positions >= 0, ids[np.maximum(positions, 0)], 0)
+    return neighbours.write(path, ids, result, scores, stamp=int(ids.max()))
+
+
+def similar_books(book):
+    """Books most like ``book`` by title, author and genre, from the neighbour file.
+
+    Books the last build hasn't seen fall back on the stored best rated
+    books of the same author or genre.
+    """
+    config = current_app.config
+    index = neighbours.load(config['CONTENT_NEIGHBOURS_FILE'])
+    ids = [book_id for book_id, _ in index.of(book.id)][:config['SIMILAR_BOOKS_TOP']] if index else []
+    if not ids:
+        return similar.similar_books(book)
+    rows = db.session.query(Books.id, Books.title, Books.author, Books.genre,
+                            Books.pages, Books.rate). \
+        filter(Books.id.in_(ids)).all()
+    found = {row.id: row for row in rows}
+    return [found[book_id] for book_id in ids if book_id in found]
@@ -0,0 +1,61 @@
+import mmap
+import os
+import threading
+
+from flask import current_app
+
+from bookspace.core.app import db
+from bookspace.core.trigram import TrigramIndex, MappedTrigramIndex
+from bookspace.models import Books
+
+_state = {'mtime': None, 'index': None, 'warned': False}
+_lock = threading.Lock()
+
+
+def build_index(path=None):
+    """Write the trigram index of every title and author to ``path``; returns the number of books."""
+    path = path or current_app.config['FUZZY_INDEX_FILE']
+    index = TrigramIndex()
+    rows = db.session.query(Books.id, Books.rate, Books.title, Books.author). \
+        order_by(Books.id).yield_per(10000)
+    for book_id, rate, title, author in rows:
+        index.add(book_id, rate, title, author)
+    return index.write(path)
+
+
+def _index():
+    """The index ``flask build-fuzzy`` wrote, remapped whenever it is replaced; None until then."""
+    path = current_app.config['FUZZY_INDEX_FILE']
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime == _state['mtime']:
+        return _state['index']
+    with _lock:
+        if mtime != _state['mtime']:
+            index = None
+            if mtime is not None:
+                with open(path, 'rb') as file:
+                    buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    index = MappedTrigramIndex(buffer)
+                except ValueError:
+                    pass
+            if index is None and not _state['warned']:
+                current_app.logger.warning('fuzzy search: no index at %s, run flask build-fuzzy', path)
+                _state['warned'] = True
+            _state['index'], _state['mtime'] = index, mtime
+    return _state['index']
+
+
+def find_books_fuzzy(search, limit):
+    """Books whose title or author is close to ``search``, closest first."""
+    index = _index()
+    matches = index.search(search, limit) if index is not None else []
+    if not matches:
+        return []
+    books = {book.id: book for book in db.session.query(
+        Books.id, Books.title, Books.author, Books.genre, Books.rate).
+        filter(Books.id.in_([book_id for book_id, _ in matches]))}
+    return [books[book_id] for book_id, _ in matches if book_id in books]
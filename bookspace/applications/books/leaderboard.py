@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import desc, func
+
+from bookspace.core.app import db
+from bookspace.models import Books
+
+_FIELDS = (Books.id, Books.title, Books.author, Books.genre, Books.rate)
+
+# boards: {None: global top, genre: genre top}, payloads: {(genre, limit): (body, etag)}
+_state = {'version': None, 'built': 0, 'boards': {}, 'payloads': {}}
+_lock = threading.Lock()
+
+
+def _version():
+    """Shared version stamp: the mtime of a file every worker can see."""
+    try:
+        return os.stat(current_app.config['LEADERBOARD_VERSION_FILE']).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump():
+    """Make every worker rebuild its boards on the next request."""
+    path = current_app.config['LEADERBOARD_VERSION_FILE']
+    with open(path, 'a'):
+        os.utime(path, None)
+
+
+def _build(version):
+    size = current_app.config['LEADERBOARD_SIZE']
+    boards = {None: db.session.query(*_FIELDS).
+              order_by(desc(Books.rate), Books.id).limit(size).all()}
+    rank = func.row_number().over(partition_by=Books.genre,
+                                  order_by=(desc(Books.rate), Books.id)).label('rank')
+    ranked = db.session.query(*_FIELDS, rank).filter(Books.genre.isnot(None)).subquery()
+    for row in db.session.query(ranked).filter(ranked.c.rank <= size). \
+            order_by(ranked.c.genre, ranked.c.rank):
+        boards.setdefault(row.genre, []).append(row)
+    return {'version': version, 'built': time.time(), 'boards': boards, 'payloads': {}}
+
+
+def _current():
+    global _state
+    version = _version()
+    state = _state
+    if state['version'] != version or \
+            time.time() - state['built'] > current_app.config['LEADERBOARD_MAX_AGE']:
+        with _lock:
+            if _state is state:
+                _state = _build(version)
+            state = _state
+    return state
+
+
+def payload(genre=None, limit=None):
+    """Serialized ``/home/top`` response and its ETag."""
+    size = current_app.config['LEADERBOARD_SIZE']
+    limit = size if limit is None else max(1, min(limit, size))
+    state = _current()
+    key = (genre, limit)
+    cached = state['payloads'].get(key)
+    if cached is None:
+        books = [{'id': row.id,
+                  'title': row.title,
+                  'author': row.author,
+                  'genre': row.genre,
+                  'rate': row.rate} for row in state['boards'].get(genre, [])[:limit]]
+        body = json.dumps({'books': books, 'version': state['version'], 'status': 200}).encode('utf-8')
+        cached = body, hashlib.md5(body).hexdigest()
+        # the genre comes from the client; only the ones with a board may grow the cache
+        if genre in state['boards']:
+            state['payloads'][key] = cached
+    return cached
+
+
+def rating_changed(book_id):
+    """Invalidate the boards if the new rate of ``book_id`` can reorder them."""
+    book = db.session.query(Books.genre, Books.rate).filter_by(id=book_id).first()
+    if book is None:
+        return
+    size = current_app.config['LEADERBOARD_SIZE']
+    boards = _state['boards']
+    for key in (None, book.genre):
+        rows = boards.get(key)
+        if rows is None or len(rows) < size or \
+                any(row.id == book_id for row in rows) or (book.rate or 0) >= (rows[-1].rate or 0):
+            bump()
+            return
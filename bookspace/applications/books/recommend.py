@@ -0,0 +1,146 @@
+import numpy as np
+from flask import current_app
+from scipy import sparse
+
+from bookspace.core import neighbours
+from bookspace.core.app import db
+from bookspace.models import UsersBooks, ListChoices
+
+# how much a shelf says about the reader's taste; a rating scales it by rate / 3
+_SHELF_WEIGHTS = {'DN': 1.0, 'IP': 0.7, 'WR': 0.4}
+
+
+def weight(shelf, rate):
+    """Strength of one user_books entry; ``shelf`` is a ``ListChoices``, its name or None."""
+    if isinstance(shelf, ListChoices):
+        shelf = shelf.name
+    return _SHELF_WEIGHTS.get(shelf, 0.7) * (rate / 3 if rate else 1.0)
+
+
+def build_model(users, books, values, top_k, alpha=0.5, only=None, block_size=1024):
+    """Top ``top_k`` item-to-item neighbours from (user, book, weight) triples.
+
+    The books are the columns of a sparse user x book matrix and the
+    similarity of book i to book j is their dot product over
+    ``|i| ** (2 - 2 * alpha) * |j| ** (2 * alpha)``: the cosine for an
+    ``alpha`` of 0.5, lower values letting popular neighbours rank higher.
+    A block of rows of the scaled transpose times the scaled matrix gives
+    the similarities of those books with every other one; only
+    ``block_size`` books are multiplied at a time, so memory stays bounded.
+    ``only`` limits the rows computed to those book ids. Returns (book ids,
+    neighbour ids, scores), the last two with one row of ``top_k`` per book,
+    padded with id 0.
+    """
+    item_ids, columns = np.unique(np.asarray(books, np.int32), return_inverse=True)
+    _, rows = np.unique(np.asarray(users), return_inverse=True)
+    matrix = sparse.csr_matrix((np.asarray(values, np.float32), (rows, columns)),
+                               shape=(rows.max() + 1 if len(rows) else 0, len(item_ids)))
+    squares = np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel()
+    squares[squares == 0] = 1
+    transposed = (matrix @ sparse.diags(squares ** (alpha - 1))).T.tocsr()
+    matrix = (matrix @ sparse.diags(squares ** -alpha)).tocsr()
+
+    targets = np.arange(len(item_ids)) if only is None else \
+        np.flatnonzero(np.isin(item_ids, np.asarray(list(only), np.int32)))
+    result = np.zeros((len(targets), top_k), np.int32)
+    scores = np.zeros((len(targets), top_k), np.float32)
+    for start in range(0, len(targets), block_size):
+        block = targets[start:start + block_size]
+        similar = (transposed[block] @ matrix).tocsr()
+        for i, column in enumerate(block):
+            candidates = similar.indices[similar.indptr[i]:similar.indptr[i + 1]]
+            similarities = similar.data[similar.indptr[i]:similar.indptr[i + 1]]
+            keep = candidates != column
+            candidates, similarities = candidates[keep], similarities[keep]
+            if len(similarities) > top_k:
+                best = np.argpartition(-similarities, top_k)[:top_k]
+                candidates, similarities = candidates[best], similarities[best]
+            order = np.lexsort((item_ids[candidates], -similarities))
+            result[start + i, :len(order)] = item_ids[candidates[order]]
+            scores[start + i, :len(order)] = similarities[order]
+    return item_ids[targets], result, scores
+
+
+def score(model, book_ids, values, limit):
+    """[(book id, score)] of the best books the user doesn't have, best first.
+
+    A candidate scores the sum of its similarity to each of the user's
+    books, weighted by the user's entry for that book.
+    """
+    book_ids = np.asarray(book_ids, np.int32)
+    positions, rows = model.rows(book_ids)
+    if not len(rows):
+        return []
+    candidates = model.neighbours[rows]
+    weighted = model.scores[rows] * np.asarray(values, np.float32)[positions][:, None]
+    keep = (candidates != 0) & ~np.isin(candidates, book_ids)
+    unique, inverse = np.unique(candidates[keep], return_inverse=True)
+    if not len(unique):
+        return []
+    totals = np.bincount(inverse, weights=weighted[keep])
+    best = np.lexsort((unique, -totals))[:limit]
+    return [(int(unique[i]), float(totals[i])) for i in best]
+
+
+def recommend(entries, limit):
+    """Score the user's (books_id, list, rate) entries against the built model.
+
+    Empty when there is no model yet or none of the user's books have
+    neighbours, which is the cold-start case the caller falls back on.
+    """
+    model = neighbours.load(current_app.config['REC_NEIGHBOURS_FILE'])
+    if model is None or not entries:
+        return []
+    return score(model, [entry[0] for entry in entries],
+                 [weight(entry[1], entry[2]) for entry in entries], limit)
+
+
+def _interactions():
+    users, books, values = [], [], []
+    last_id = 0
+    rows = db.session.query(UsersBooks.id, UsersBooks.user_id, UsersBooks.books_id,
+                            UsersBooks.list, UsersBooks.rate). \
+        filter(UsersBooks.user_id.isnot(None), UsersBooks.books_id.isnot(None)). \
+        yield_per(10000)
+    for entry_id, user_id, book_id, shelf, rate in rows:
+        users.append(user_id)
+        books.append(book_id)
+        values.append(weight(shelf, rate))
+        last_id = max(last_id, entry_id)
+    return users, books, values, last_id
+
+
+def build(path=None):
+    """Write the neighbours of every shelved book to ``path``; returns the number of books."""
+    config = current_app.config
+    path = path or config['REC_NEIGHBOURS_FILE']
+    users, books, values, last_id = _interactions()
+    ids, result, scores = build_model(users, books, values, config['REC_TOP_K'], config['REC_ALPHA'],
+                                      block_size=config['REC_BLOCK_SIZE'])
+    return neighbours.write(path, ids, result, scores, stamp=last_id)
+
+
+def refresh(path=None):
+    """Recompute the rows most changed by entries added since the last build or refresh.
+
+    A new entry changes the similarity of its book with every other book
+    of the same user, so the rows of all the books of those users are
+    rebuilt. The smaller shifts elsewhere, ratings changed in place and
+    removed entries wait for the next full build. Returns the number of
+    rows rewritten.
+    """
+    config = current_app.config
+    path = path or config['REC_NEIGHBOURS_FILE']
+    current = neighbours.load(path)
+    if current is None:
+        return build(path)
+    changed = db.session.query(UsersBooks.user_id).filter(UsersBooks.id > current.stamp)
+    affected = {row[0] for row in db.session.query(UsersBooks.books_id).
+                filter(UsersBooks.user_id.in_(changed.subquery())).distinct()}
+    if not affected:
+        return 0
+    users, books, values, last_id = _interactions()
+    ids, result, scores = build_model(users, books, values, config['REC_TOP_K'], config['REC_ALPHA'],
+                                      only=affected, block_size=config['REC_BLOCK_SIZE'])
+    neighbours.write(path, *neighbours.merge(current, ids, result, scores), stamp=last_id)
+    return len(ids)
@@ -1,9 +1,15 @@
 from sqlalchemy.exc import SQLAlchemyError
 
+from flask import g, current_app
+
 from bookspace.core.app import db, api
-from flask_restful import Resource, reqparse
+from bookspace.core.auth import AuthResource
+from bookspace.core.pagination import add_page_arguments, decode_keyset, encode_keyset, \
+    keyset_filter, page_limit
+from flask_restful import reqparse
 from sqlalchemy import func, desc, and_, or_
 from bookspace import models
+from bookspace.applications.books import content, leaderboard, similar, suggest
 
 _BAD_REQUEST = {'message': 'unvalid data', 'status': 400}
 _GOOD_REQUEST = {'message': 'ok', 'status': 200}
@@ -11,34 +17,20 @@ _GOOD_REQUEST = {'message': 'ok', 'status': 200}
 session = db.session
 
 
-class Books(Resource):
+class Books(AuthResource):
 
     def __init__(self):
         self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
         self.parser.add_argument('rate')
         self.parser.add_argument('status')
 
     def get(self, book_id):
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if models.User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = models.User.verify_auth_token(token)['user_id']
-        user = models.User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        user = g.user
         book = models.Books.query.filter_by(id=book_id).first()
         if book is None:
             return {'message': 'Book not found', 'status': 404}
         else:
-            similar_books = models.Books.query.filter(or_(models.Books.author == book.author,
-                                                          models.Books.genre == book.genre)). \
-                filter(models.Books.id != book.id). \
-                order_by(desc('rate')). \
-                limit(5).all()
+            similar_books = content.similar_books(book)
             recs = []
             user_book = models.UsersBooks.query.filter_by(user_id=user.id).filter_by(books_id=book.id).first()
 
@@ -69,53 +61,33 @@ class Books(Resource):
 
     def post(self, book_id):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
         rate = args['rate']
-        user_id = models.User.verify_auth_token(token)['user_id']
-        user = models.User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        user = g.user
 
         book = models.Books.query.filter_by(id=book_id).first()
         if book is None:
             return {'message': 'Book not found', 'status': 404}
+        if rate is None or not rate.isdigit() or not 1 <= int(rate) <= 5:
+            return _BAD_REQUEST
         user_book = models.UsersBooks.query.filter_by(user_id=user.id).filter_by(books_id=book_id).first()
-        print(user_book)
         if user_book is None:
-            user_book = models.UsersBooks(user_id=user.id, books_id=book_id)
-            session.add(user_book)
-        if rate is not None:
-            user_book.rate = rate
-            books_list = models.UsersBooks.query.filter_by(books_id=book_id).all()
-            rate, amount = 0, 0
-            for elem in books_list:
-                rate += float(elem.rate)
-                amount += 1
-            if amount > 0:
-                average_rate = round(rate/amount, 2)
-                book.rate = average_rate
-                session.add(book)
+            user_book = models.UsersBooks(user_id=user.id, books_id=book_id, rate=0)
             session.add(user_book)
-            try:
-                session.commit()
-            except SQLAlchemyError:
-                session.rollback()
-            return _GOOD_REQUEST
-        else:
-            return _BAD_REQUEST
+        old_rate = user_book.rate
+        user_book.rate = int(rate)
+        models.Books.apply_rating(book_id, old_rate, user_book.rate)
+        similar.changed(book_id)
+        try:
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+        leaderboard.rating_changed(book_id)
+        return _GOOD_REQUEST
 
     def put(self, book_id):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
         status = args['status']
-        user_id = models.User.verify_auth_token(token)['user_id']
-        user = models.User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        user = g.user
         book = models.Books.query.filter_by(id=book_id).first()
         if book is None:
             return _BAD_REQUEST
@@ -128,7 +100,11 @@ class Books(Resource):
                                         books_id=book_id,
                                         list=status)
                 session.add(new)
+                models.Stats.move_shelf(user.id, None, status, book.pages)
+                models.ReadingRollup.record(user.id, None, book, None, status)
             else:
+                models.Stats.move_shelf(user.id, user_book.list, status, book.pages)
+                models.ReadingRollup.record(user.id, user_book.data_added, book, user_book.list, status)
                 user_book.list = status
                 session.add(user_book)
             try:
@@ -141,22 +117,24 @@ class Books(Resource):
             return _BAD_REQUEST
 
     def delete(self, book_id):
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        user_id = models.User.verify_auth_token(token)['user_id']
-        user = models.User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        user = g.user
         user_book = models.UsersBooks.query.filter_by(
             user_id=user.id).filter_by(books_id=book_id).first()
         if user_book is not None:
+            models.Books.apply_rating(book_id, user_book.rate, 0)
+            book = session.query(models.Books.pages, models.Books.author, models.Books.genre). \
+                filter_by(id=book_id).first()
+            models.Stats.move_shelf(user.id, user_book.list, None, book.pages)
+            models.ReadingRollup.record(user.id, user_book.data_added, book, user_book.list, None)
             session.delete(user_book)
+            if user_book.rate:
+                similar.changed(book_id)
             try:
                 session.commit()
             except SQLAlchemyError:
                 session.rollback()
+            if user_book.rate:
+                leaderboard.rating_changed(book_id)
             return _GOOD_REQUEST
         else:
             return _BAD_REQUEST
@@ -165,53 +143,58 @@ class Books(Resource):
 api.add_resource(Books, '/books/<int:book_id>')
 
 
-class Notes(Resource):
+class Notes(AuthResource):
 
     def __init__(self):
         self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
         self.parser.add_argument('title')
         self.parser.add_argument('text')
+        add_page_arguments(self.parser)
 
     def get(self, book_id):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        user_id = models.User.verify_auth_token(token)['user_id']
-        user = models.User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        user = g.user
+        after = None
+        if args['cursor']:
+            after = decode_keyset(args['cursor'])
+            if after is None:
+                return _BAD_REQUEST
+        limit = page_limit(args['limit'])
         book = models.Books.query.filter_by(id=book_id).first()
         if book is None:
             return _BAD_REQUEST
-        notes = models.Notes.query.filter_by(books_id=book_id, user_id=user.id).all()
+        notes = models.Notes.query.filter_by(books_id=book_id, user_id=user.id)
+        if after is not None:
+            notes = notes.filter(keyset_filter(models.Notes.data_added, models.Notes.id, after))
+        notes = notes.order_by(desc(models.Notes.data_added), desc(models.Notes.id)). \
+            limit(limit).all()
 
+        # only the caller's own notes are listed
         response = []
         for note in notes:
-            username = models.User.query.filter_by(id=note.user_id).first().username
             elem = {
                 'id': note.id,
                 'title': note.title,
                 'text': note.text,
-                'author': username,
+                'author': user.username,
                 'created': note.data_added.strftime(format='%d/%m/%Y')
             }
             response.append(elem)
 
-        return {'notes': response, 'status': 200}
+        next_cursor = None
+        if len(notes) == limit:
+            next_cursor = encode_keyset(notes[-1].data_added, notes[-1].id)
+        result = {'notes': response, 'next': next_cursor, 'status': 200}
+        if args['total']:
+            # (books_id, user_id) is the leading part of the index, a small range scan
+            result['total'] = models.Notes.query.filter_by(books_id=book_id, user_id=user.id).count()
+        return result
 
     def post(self, book_id):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
         text = args['text']
         title = args['title']
-        user_id = models.User.verify_auth_token(token)['user_id']
-        user = models.User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        user = g.user
         book = models.Books.query.filter_by(id=book_id).first()
         if book is None:
             return _BAD_REQUEST
@@ -230,24 +213,17 @@ class Notes(Resource):
 api.add_resource(Notes, '/books/<int:book_id>/notes')
 
 
-class OneNote(Resource):
+class OneNote(AuthResource):
     def __init__(self):
         self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
         self.parser.add_argument('title')
         self.parser.add_argument('text')
 
     def put(self, note_id):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
         text = args['text']
         title = args['title']
-        user_id = models.User.verify_auth_token(token)['user_id']
-        user = models.User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        user = g.user
         new_note = models.Notes.query.filter_by(id=note_id).first()
         if new_note is None:
             return _BAD_REQUEST
@@ -267,15 +243,9 @@ class OneNote(Resource):
 
     def delete(self, note_id):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
         text = args['text']
         title = args['title']
-        user_id = models.User.verify_auth_token(token)['user_id']
-        user = models.User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        user = g.user
         note = models.Notes.query.filter_by(id=note_id).first()
         if note is None:
             return _BAD_REQUEST
@@ -291,3 +261,27 @@ class OneNote(Resource):
 
 
 api.add_resource(OneNote, '/books/notes/<int:note_id>')
+
+
+class Suggest(AuthResource):
+    def __init__(self):
+        self.parser = reqparse.RequestParser()
+        self.parser.add_argument('q', location='args')
+        self.parser.add_argument('limit', type=int, location='args')
+
+    def get(self):
+        args = self.parser.parse_args()
+        if not args['q']:
+            return _BAD_REQUEST
+        limit = args['limit'] or current_app.config['SUGGEST_LIMIT']
+        limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+        suggestions = []
+        for book_id, text, field, rate in suggest.suggest(args['q'], limit):
+            suggestions.append({'id': book_id,
+                                'text': text,
+                                'field': field,
+                                'rate': rate})
+        return {'suggestions': suggestions, 'status': 200}
+
+
+api.add_resource(Suggest, '/books/suggest')
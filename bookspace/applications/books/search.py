@@ -0,0 +1,98 @@
+import re
+
+from flask import current_app
+from sqlalchemy import text
+
+from bookspace.core.app import db
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+# every backend yields (id, title, author, genre, rate, score) for the best :candidates
+# matches by score, the same order the pages are cut in
+_RANKED = {
+    'postgresql': """
+        SELECT books.id, books.title, books.author, books.genre, books.rate,
+               ts_rank(books.search_vector, query) * (1 + COALESCE(books.rate, 0) / 5) AS score
+        FROM books, to_tsquery('simple', :query) query
+        WHERE books.search_vector @@ query
+        ORDER BY score DESC, books.id LIMIT :candidates
+    """,
+    # bm25 is negative, lower is better
+    'sqlite': """
+        SELECT books.id, books.title, books.author, books.genre, books.rate,
+               -bm25(books_fts, 10.0, 5.0, 1.0) * (1 + COALESCE(books.rate, 0) / 5.0) AS score
+        FROM books_fts JOIN books ON books.id = books_fts.rowid
+        WHERE books_fts MATCH :query
+        ORDER BY score DESC, books.id LIMIT :candidates
+    """,
+    # rate order, so the walk down ix_books_rate_id stops after :candidates matches
+    None: """
+        SELECT books.id, books.title, books.author, books.genre, books.rate,
+               COALESCE(books.rate, 0) AS score
+        FROM books
+        WHERE lower(title) LIKE :query OR lower(author) LIKE :query OR lower(genre) LIKE :query
+        ORDER BY books.rate DESC, books.id LIMIT :candidates
+    """,
+}
+
+_COUNT = {
+    'postgresql': """
+        EXPLAIN (FORMAT JSON)
+        SELECT 1 FROM books WHERE search_vector @@ to_tsquery('simple', :query)
+    """,
+    'sqlite': """
+        SELECT count(*) FROM (SELECT 1 FROM books_fts WHERE books_fts MATCH :query LIMIT :cap)
+    """,
+    None: """
+        SELECT count(*) FROM (SELECT 1 FROM books
+            WHERE lower(title) LIKE :query OR lower(author) LIKE :query OR lower(genre) LIKE :query
+            LIMIT :cap) AS matched
+    """,
+}
+
+
+def _query(dialect, terms, min_prefix):
+    """Backend query string; the last term matches as a prefix once it has ``min_prefix`` characters."""
+    prefix = len(terms[-1]) >= min_prefix
+    if dialect == 'postgresql':
+        return ' & '.join(terms[:-1] + [terms[-1] + (':*' if prefix else '')])
+    if dialect == 'sqlite':
+        return ' '.join(f'"{term}"' for term in terms) + ('*' if prefix else '')
+    return '%' + ' '.join(terms) + '%'
+
+
+def _estimate(dialect, query):
+    params = {'query': query, 'cap': current_app.config['SEARCH_COUNT_CAP']}
+    result = db.session.execute(text(_COUNT.get(dialect, _COUNT[None])), params).scalar()
+    if dialect == 'postgresql':
+        # the planner's row estimate, so short prefixes don't count millions of matches
+        return int(result[0]['Plan']['Plan Rows'])
+    return result
+
+
+def find_books(search, limit, after=None):
+    """One page of catalog matches for ``search``, best first.
+
+    Every match is scored, by text relevance weighted with the book's
+    rate, and the best SEARCH_CANDIDATES are kept for paging; pages stop
+    after them. Returns ``(rows, total)`` where ``total`` is an estimate of
+    all matches, computed for the first page only. ``after`` is the
+    ``(score, id)`` of the last row of the previous page.
+    """
+    terms = _TERM.findall(search.lower())
+    if not terms:
+        return [], 0
+    dialect = db.engine.dialect.name
+    if dialect not in _RANKED:
+        dialect = None
+    config = current_app.config
+    query = _query(dialect, terms, config['SEARCH_MIN_PREFIX'])
+
+    sql = f'SELECT * FROM ({_RANKED[dialect]}) AS ranked'
+    params = {'query': query, 'limit': limit, 'candidates': config['SEARCH_CANDIDATES']}
+    if after is not None:
+        sql += ' WHERE score < :score OR (score = :score AND id > :id)'
+        params['score'], params['id'] = after
+    sql += ' ORDER BY score DESC, id LIMIT :limit'
+    rows = db.session.execute(text(sql), params).fetchall()
+    return rows, _estimate(dialect, query) if after is None else None
@@ -0,0 +1,174 @@
+from flask import current_app
+from sqlalchemy import desc, event, func, inspect
+from sqlalchemy.orm import aliased
+
+from bookspace.core.app import db
+from bookspace.models import Books, BookSimilar, BookSimilarChanges
+
+_FIELDS = (Books.id, Books.author, Books.genre, Books.rate)
+_COLUMNS = (Books.id, Books.title, Books.author, Books.genre, Books.pages, Books.rate)
+
+
+def _group_tops(column, values, top):
+    """Top ``top`` books by rate for each of the given authors or genres."""
+    tops = {value: [] for value in values}
+    if not values:
+        return tops
+    rank = func.row_number().over(partition_by=column,
+                                  order_by=(desc(Books.rate), Books.id)).label('rank')
+    ranked = db.session.query(*_FIELDS, rank).filter(column.in_(values)).subquery()
+    for row in db.session.query(ranked).filter(ranked.c.rank <= top).order_by(ranked.c.rank):
+        tops[getattr(row, column.key)].append(row)
+    return tops
+
+
+def _neighbours(book, by_author, by_genre, top):
+    seen, candidates = set(), []
+    for row in by_author.get(book.author, []) + by_genre.get(book.genre, []):
+        if row.id != book.id and row.id not in seen:
+            seen.add(row.id)
+            candidates.append(row)
+    candidates.sort(key=lambda row: (-(row.rate or 0), row.id))
+    return [row.id for row in candidates[:top]]
+
+
+def rebuild(books, genre_tops=None):
+    """Recompute and store the neighbours of ``books`` (id, author, genre, rate rows).
+
+    A book's neighbours are the best rated books sharing its author or genre,
+    so they are merged from the per-author and per-genre top lists instead of
+    scanning the catalog for every book.
+    """
+    top = current_app.config['SIMILAR_BOOKS_TOP']
+    by_author = _group_tops(Books.author, {b.author for b in books if b.author}, top + 1)
+    if genre_tops is None:
+        genre_tops = {}
+    missing = {b.genre for b in books if b.genre and b.genre not in genre_tops}
+    genre_tops.update(_group_tops(Books.genre, missing, top + 1))
+
+    BookSimilar.query.filter(BookSimilar.book_id.in_([b.id for b in books])). \
+        delete(synchronize_session=False)
+    rows = []
+    for book in books:
+        for position, similar_id in enumerate(_neighbours(book, by_author, genre_tops, top)):
+            rows.append({'book_id': book.id, 'position': position, 'similar_id': similar_id})
+    if rows:
+        db.session.execute(BookSimilar.__table__.insert(), rows)
+    return rows
+
+
+def build_all(batch_size=1000):
+    """Rebuild the whole table in id order, yielding the size of every batch.
+
+    Changes recorded before the build started are covered by it and dropped.
+    """
+    last_change = db.session.query(func.max(BookSimilarChanges.id)).scalar()
+    genre_tops = {}
+    last_id = 0
+    while True:
+        books = db.session.query(*_FIELDS).filter(Books.id > last_id). \
+            order_by(Books.id).limit(batch_size).all()
+        if not books:
+            break
+        rebuild(books, genre_tops)
+        db.session.commit()
+        last_id = books[-1].id
+        yield len(books)
+    if last_change is not None:
+        BookSimilarChanges.query.filter(BookSimilarChanges.id <= last_change).delete(synchronize_session=False)
+        db.session.commit()
+
+
+def changed(book_id):
+    """Have the next ``flask build-similar --refresh`` update the lists a change of ``book_id`` affects.
+
+    Stored with the caller's next commit.
+    """
+    db.session.add(BookSimilarChanges(book_id=book_id))
+
+
+@event.listens_for(Books, 'after_insert')
+def _book_added(mapper, connection, book):
+    connection.execute(BookSimilarChanges.__table__.insert(), {'book_id': book.id})
+
+
+@event.listens_for(Books, 'after_update')
+def _book_updated(mapper, connection, book):
+    attrs = inspect(book).attrs
+    if any(attrs[key].history.has_changes() for key in ('rate', 'author', 'genre')):
+        connection.execute(BookSimilarChanges.__table__.insert(), {'book_id': book.id})
+
+
+def _affected(book):
+    """Ids of the stored lists a change of ``book`` can affect.
+
+    That is the book itself, the lists already containing it, books by the same
+    author and same-genre lists whose weakest neighbour now rates below it.
+    """
+    top = current_app.config['SIMILAR_BOOKS_TOP']
+    owner, neighbour = aliased(Books), aliased(Books)
+    containing = db.session.query(BookSimilar.book_id).filter(BookSimilar.similar_id == book.id)
+    same_author = db.session.query(Books.id).filter(Books.author == book.author). \
+        filter(Books.author.isnot(None))
+    outranked = db.session.query(BookSimilar.book_id). \
+        join(owner, owner.id == BookSimilar.book_id). \
+        join(neighbour, neighbour.id == BookSimilar.similar_id). \
+        filter(owner.genre == book.genre). \
+        filter(BookSimilar.position == top - 1). \
+        filter(neighbour.rate < book.rate)
+    return {row[0] for row in containing.union(same_author, outranked)} | {book.id}
+
+
+def refresh(batch_size=1000):
+    """Rebuild the lists the recorded changes affect; returns the number of lists rebuilt.
+
+    Only changes up to the newest id seen are handled and dropped, so
+    changes written meanwhile are left for the next run.
+    """
+    last_id = db.session.query(func.max(BookSimilarChanges.id)).scalar()
+    if last_id is None:
+        return 0
+    pending = BookSimilarChanges.query.filter(BookSimilarChanges.id <= last_id)
+    changed = sorted({row[0] for row in pending.with_entities(BookSimilarChanges.book_id)})
+    affected = set()
+    for start in range(0, len(changed), batch_size):
+        for book in db.session.query(*_FIELDS).filter(Books.id.in_(changed[start:start + batch_size])):
+            affected |= _affected(book)
+
+    genre_tops = {}
+    ids = sorted(affected)
+    for start in range(0, len(ids), batch_size):
+        books = db.session.query(*_FIELDS).filter(Books.id.in_(ids[start:start + batch_size])).all()
+        rebuild(books, genre_tops)
+        db.session.commit()
+    pending.delete(synchronize_session=False)
+    db.session.commit()
+    return len(ids)
+
+
+def _fallback(book, top):
+    """The list ``rebuild`` would store for ``book``, read off the author and genre rate indexes."""
+    def best(column, value):
+        if value is None:
+            return []
+        return db.session.query(*_COLUMNS).filter(column == value). \
+            order_by(desc(Books.rate), Books.id).limit(top + 1).all()
+
+    by_author = {book.author: best(Books.author, book.author)}
+    by_genre = {book.genre: best(Books.genre, book.genre)}
+    rows = {row.id: row for row in by_author[book.author] + by_genre[book.genre]}
+    return [rows[book_id] for book_id in _neighbours(book, by_author, by_genre, top)]
+
+
+def similar_books(book):
+    """Stored neighbours of ``book`` in order.
+
+    Never writes: a book ``flask build-similar`` hasn't seen yet gets the
+    same list computed on the fly until the next build or refresh stores it.
+    """
+    rows = db.session.query(*_COLUMNS). \
+        join(BookSimilar, BookSimilar.similar_id == Books.id). \
+        filter(BookSimilar.book_id == book.id). \
+        order_by(BookSimilar.position). \
+        all()
+    return rows or _fallback(book, current_app.config['SIMILAR_BOOKS_TOP'])
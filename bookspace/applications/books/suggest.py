@@ -0,0 +1,246 @@
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import threading
+from array import array
+from operator import itemgetter
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import event
+
+from bookspace.core.app import db
+from bookspace.core.cache import LRUCache
+from bookspace.core.text import normalize
+from bookspace.models import Books
+
+_FIELDS = ('title', 'author')
+
+# magic, entries, size of the key blob, size of the text blob
+_HEADER = struct.Struct('<4sIII')
+_MAGIC = b'BSG2'
+
+_state = {'mtime': None, 'snapshot': None, 'warned': False}
+_delta_keys, _delta_items = [], []
+_results = LRUCache(maxsize=10000)
+_lock = threading.Lock()
+
+
+def _entries(book_id, title, author, rate):
+    """One entry per word of the title and author, so inner words complete too."""
+    for kind, text in enumerate((title, author)):
+        words = normalize(text).split()
+        for start in range(len(words)):
+            key = ' '.join(words[start:]).encode('utf-8')
+            yield key, text, book_id, rate or 0, kind
+
+
+def _leaves(count):
+    return 1 << max(0, (count - 1).bit_length())
+
+
+def _max_tree(rates):
+    """Inner nodes of a max segment tree over ``rates``: node ``j`` holds the entry of
+    the best rate under it, the lowest index on ties; leaf ``i`` is node ``leaves + i``.
+    """
+    leaves = _leaves(len(rates))
+    padded = np.append(np.asarray(rates, np.float32), np.float32('-inf'))
+    tree = np.full(leaves, -1, np.int32)
+    level = np.arange(leaves, dtype=np.int32)
+    level[len(rates):] = -1
+    while len(level) > 1:
+        left, right = level[0::2], level[1::2]
+        level = np.where(padded[right] > padded[left], right, left)
+        tree[len(level):2 * len(level)] = level
+    return tree
+
+
+class _Snapshot(object):
+    """Sorted entries laid out as flat arrays over a (memory mapped) buffer.
+
+    Indexing returns the normalized key, so ``bisect`` works on it directly.
+    """
+
+    def __init__(self, buffer):
+        magic, count, key_size, text_size = _HEADER.unpack_from(buffer)
+        if magic != _MAGIC:
+            raise ValueError('not a suggest snapshot')
+        view = memoryview(buffer)
+        pos = _HEADER.size
+
+        def take(size, fmt=None):
+            nonlocal pos
+            part = view[pos:pos + size]
+            pos += size
+            return part.cast(fmt) if fmt else part
+
+        self.count = count
+        self.leaves = _leaves(count)
+        self.key_offsets = take(4 * (count + 1), 'I')
+        self.text_offsets = take(4 * (count + 1), 'I')
+        self.ids = take(4 * count, 'i')
+        self.rates = take(4 * count, 'f')
+        self.tree = take(4 * self.leaves, 'i')
+        self.kinds = take(count, 'B')
+        self.keys = take(key_size)
+        self.texts = take(text_size)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return bytes(self.keys[self.key_offsets[i]:self.key_offsets[i + 1]])
+
+    def text(self, i):
+        return bytes(self.texts[self.text_offsets[i]:self.text_offsets[i + 1]]).decode('utf-8')
+
+    def best(self, lo, hi):
+        """Index of the best rated entry in [lo, hi), the lowest on ties; O(log n)."""
+        rates, tree, leaves = self.rates, self.tree, self.leaves
+        found = []
+        lo, hi = lo + leaves, hi + leaves
+        while lo < hi:
+            if lo & 1:
+                found.append(lo - leaves if lo >= leaves else tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                found.append(hi - leaves if hi >= leaves else tree[hi])
+            lo, hi = lo >> 1, hi >> 1
+        return min(found, key=lambda i: (-rates[i], i))
+
+
+def build_snapshot(path=None):
+    """Write the prefix index of the whole catalog to ``path``; returns its size."""
+    path = path or current_app.config['SUGGEST_SNAPSHOT']
+    entries = []
+    rows = db.session.query(Books.id, Books.title, Books.author, Books.rate).yield_per(10000)
+    for row in rows:
+        entries.extend(_entries(*row))
+    entries.sort(key=lambda entry: entry[0])
+
+    key_offsets, text_offsets = array('I', [0]), array('I', [0])
+    ids, rates, kinds = array('i'), array('f'), array('B')
+    keys, texts = bytearray(), bytearray()
+    for key, text, book_id, rate, kind in entries:
+        keys += key
+        texts += (text or '').encode('utf-8')
+        key_offsets.append(len(keys))
+        text_offsets.append(len(texts))
+        ids.append(book_id)
+        rates.append(rate)
+        kinds.append(kind)
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(_HEADER.pack(_MAGIC, len(entries), len(keys), len(texts)))
+        for part in (key_offsets, text_offsets, ids, rates):
+            part.tofile(file)
+        file.write(_max_tree(rates).tobytes())
+        kinds.tofile(file)
+        file.write(keys)
+        file.write(texts)
+    os.replace(tmp, path)
+    return len(entries)
+
+
+def _snapshot():
+    """The current snapshot, remapped whenever another process replaced the file.
+
+    None until ``flask build-suggest`` has written one.
+    """
+    path = current_app.config['SUGGEST_SNAPSHOT']
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime == _state['mtime']:
+        return _state['snapshot']
+    with _lock:
+        if mtime != _state['mtime']:
+            snapshot = None
+            if mtime is not None:
+                with open(path, 'rb') as file:
+                    buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    snapshot = _Snapshot(buffer)
+                except ValueError:
+                    pass
+            if snapshot is None and not _state['warned']:
+                current_app.logger.warning('suggest: no snapshot at %s, run flask build-suggest', path)
+                _state['warned'] = True
+            _state['snapshot'], _state['mtime'] = snapshot, mtime
+            del _delta_keys[:], _delta_items[:]
+            _results.clear()
+    return _state['snapshot']
+
+
+def _candidates(snapshot, prefix):
+    """Entries starting with ``prefix``, best rated first, found lazily.
+
+    Taking the best entry of a range splits it in two; the best of the
+    pieces wait in a heap, so ``limit`` results cost ``limit`` lookups in
+    the tree however many entries share the prefix.
+    """
+    heap = []
+
+    def push(lo, hi):
+        if lo < hi:
+            i = snapshot.best(lo, hi)
+            heapq.heappush(heap, (-snapshot.rates[i], i, lo, hi))
+
+    lo = bisect.bisect_left(snapshot, prefix)
+    push(lo, bisect.bisect_left(snapshot, prefix + b'\xff', lo))
+    while heap:
+        _, i, lo, hi = heapq.heappop(heap)
+        yield snapshot.rates[i], snapshot.ids[i], snapshot.kinds[i], snapshot.text(i)
+        push(lo, i)
+        push(i + 1, hi)
+
+
+def suggest(query, limit):
+    """Best rated completions of ``query`` as (id, text, field, rate) tuples."""
+    prefix = normalize(query).encode('utf-8')
+    if not prefix:
+        return []
+    snapshot = _snapshot()
+    if snapshot is None:
+        return []
+    key = (prefix, limit)
+    result = _results.get(key)
+    if result is not None:
+        return result
+
+    lo = bisect.bisect_left(_delta_keys, prefix)
+    hi = bisect.bisect_left(_delta_keys, prefix + b'\xff', lo)
+    recent = sorted(((rate, book_id, kind, text)
+                     for text, book_id, rate, kind in _delta_items[lo:hi]),
+                    key=itemgetter(0), reverse=True)
+    ranked = heapq.merge(_candidates(snapshot, prefix), recent,
+                         key=itemgetter(0), reverse=True)
+
+    seen, result = set(), []
+    for rate, book_id, kind, text in ranked:
+        if (kind, text) in seen:
+            continue
+        seen.add((kind, text))
+        result.append((book_id, text, _FIELDS[kind], round(rate, 2)))
+        if len(result) == limit:
+            break
+    _results.set(key, result)
+    return result
+
+
+@event.listens_for(Books, 'after_insert')
+def _book_added(mapper, connection, book):
+    """Make new books suggestible in this process before the next snapshot."""
+    if _state['snapshot'] is None:
+        return
+    with _lock:
+        for key, text, book_id, rate, kind in _entries(book.id, book.title, book.author, book.rate):
+            i = bisect.bisect_left(_delta_keys, key)
+            _delta_keys.insert(i, key)
+            _delta_items.insert(i, (text, book_id, rate, kind))
+        _results.clear()
@@ -0,0 +1,118 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from sqlalchemy import event, func, and_
+from sqlalchemy.exc import SQLAlchemyError
+
+from bookspace.core.app import db
+from bookspace.core.imaging import render_variants, content_type
+from bookspace.models import Images, ImageVariants, User
+
+_DEFAULT_AVATAR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                               'static', 'images', 'avatar.png')
+_default = {}
+_pool = {'pid': None, 'executor': None}
+_pool_lock = threading.Lock()
+
+
+def default_avatar():
+    """Hash of the default avatar, stored the first time it is needed.
+
+    The hash is only remembered once the session that stored the image commits,
+    so a rolled back registration never leaves a hash without its image.
+    """
+    if 'hash' in _default:
+        return _default['hash']
+    with open(_DEFAULT_AVATAR, 'rb') as file:
+        digest = Images.store(file.read(), 'image/png')
+    db.session.info['default_avatar'] = digest
+    return digest
+
+
+@event.listens_for(db.session, 'after_commit')
+def _default_committed(session):
+    digest = session.info.pop('default_avatar', None)
+    if digest is not None:
+        _default['hash'] = digest
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _default_rolled_back(session, previous_transaction):
+    session.info.pop('default_avatar', None)
+
+
+def _avatar(user_id, size, *columns):
+    """The user's avatar in ``size``, falling back to the stored image when there is no such variant."""
+    return db.session.query(*columns). \
+        select_from(User). \
+        outerjoin(ImageVariants, and_(ImageVariants.image_hash == User.image_hash,
+                                      ImageVariants.size == size)). \
+        join(Images, Images.hash == func.coalesce(ImageVariants.variant_hash, User.image_hash)). \
+        filter(User.id == user_id). \
+        first()
+
+
+def user_avatar(user_id, size=None):
+    """(data, content_type, hash) of the user's avatar, or None."""
+    return _avatar(user_id, size, Images.data, Images.content_type, Images.hash)
+
+
+def avatar_info(user_id, size=None):
+    """(hash, content_type) of the user's avatar without loading its bytes, or None."""
+    return _avatar(user_id, size, Images.hash, Images.content_type)
+
+
+def image_data(digest):
+    return db.session.query(Images.data).filter(Images.hash == digest).scalar()
+
+
+def _executor(broken=None):
+    """Per process pool; a forked worker never reuses the pool of its parent.
+
+    Passing the ``broken`` pool replaces it, unless another thread did already.
+    """
+    with _pool_lock:
+        if _pool['pid'] != os.getpid() or (broken is not None and _pool['executor'] is broken):
+            if broken is not None:
+                broken.shutdown(wait=False)
+            _pool['executor'] = ProcessPoolExecutor(max_workers=current_app.config['AVATAR_WORKERS'])
+            _pool['pid'] = os.getpid()
+        return _pool['executor']
+
+
+def _store_variants(app, user_id, future):
+    try:
+        variants = future.result()
+    except Exception:
+        app.logger.exception('could not render avatar of user %s', user_id)
+        return
+    image_type = content_type(app.config['AVATAR_FORMAT'])
+    with app.app_context():
+        hashes = {size: Images.store(data, image_type) for size, data in variants}
+        image_hash = hashes[max(hashes)]
+        for size, variant_hash in hashes.items():
+            db.session.merge(ImageVariants(image_hash=image_hash, size=size, variant_hash=variant_hash))
+        User.query.filter_by(id=user_id).update({User.image_hash: image_hash})
+        try:
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception('could not store avatar of user %s', user_id)
+
+
+def process_avatar(user_id, data):
+    """Resize and re-encode ``data`` in the worker pool; the user's avatar switches once it is stored."""
+    app = current_app._get_current_object()
+    args = render_variants, data, app.config['AVATAR_SIZES'], app.config['AVATAR_FORMAT']
+    executor = _executor()
+    try:
+        future = executor.submit(*args)
+    except BrokenProcessPool:
+        # a worker died, e.g. killed by the OOM killer; the pool refuses all work from then on
+        app.logger.warning('avatar pool is broken, starting a new one')
+        future = _executor(broken=executor).submit(*args)
+    future.add_done_callback(lambda done: _store_variants(app, user_id, done))
+    return future
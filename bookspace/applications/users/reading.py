@@ -0,0 +1,133 @@
+from collections import Counter
+from datetime import timedelta
+
+from sqlalchemy import func, and_, or_, cast, Date
+
+from bookspace.core.app import db
+from bookspace.models import ReadingRollup
+
+_KEY = (ReadingRollup.user_id, ReadingRollup.day, ReadingRollup.author, ReadingRollup.genre)
+
+UNITS = ('day', 'week', 'month')
+
+
+def reading_summary(user_id, date_from, date_to):
+    """Books and pages finished between two dates (inclusive) with the favourite author and genre."""
+    rows = db.session.query(ReadingRollup.author, ReadingRollup.genre,
+                            func.sum(ReadingRollup.books), func.sum(ReadingRollup.pages)). \
+        filter(ReadingRollup.user_id == user_id,
+               ReadingRollup.day >= date_from,
+               ReadingRollup.day <= date_to). \
+        group_by(ReadingRollup.author, ReadingRollup.genre). \
+        all()
+    authors, genres = Counter(), Counter()
+    count = pages = 0
+    for author, genre, books, book_pages in rows:
+        count += books
+        pages += book_pages
+        authors[author] += books
+        genres[genre] += books
+
+    def favourite(counter):
+        counter = {key: value for key, value in counter.items() if value > 0 and key}
+        return max(counter, key=lambda key: (counter[key], key)) if counter else '-'
+
+    return {'count': count, 'pages': pages,
+            'fav_author': favourite(authors), 'fav_genre': favourite(genres)}
+
+
+def bucket_start(day, unit):
+    """First day of the bucket ``day`` falls in; weeks start on Monday."""
+    if unit == 'week':
+        return day - timedelta(days=day.weekday())
+    if unit == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_bucket(day, unit):
+    if unit == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=7 if unit == 'week' else 1)
+
+
+def buckets(date_from, date_to, unit):
+    """Start dates of every bucket between two dates (inclusive)."""
+    day = bucket_start(date_from, unit)
+    while day <= date_to:
+        yield day
+        day = _next_bucket(day, unit)
+
+
+def bucket_count(date_from, date_to, unit):
+    """Number of buckets ``buckets`` yields between two dates, without walking them."""
+    if unit == 'month':
+        return (date_to.year - date_from.year) * 12 + date_to.month - date_from.month + 1
+    days = (bucket_start(date_to, unit) - bucket_start(date_from, unit)).days
+    return days // (7 if unit == 'week' else 1) + 1
+
+
+def _bucket_column(dialect, unit):
+    if dialect == 'sqlite':
+        modifiers = {'week': ('weekday 0', '-6 days'), 'month': ('start of month',)}.get(unit, ())
+        return func.date(ReadingRollup.day, *modifiers)
+    if unit == 'day':
+        return ReadingRollup.day
+    return cast(func.date_trunc(unit, ReadingRollup.day), Date)
+
+
+def timeline(user_id, date_from, date_to, unit):
+    """Books and pages finished per ``unit`` between two dates as parallel lists.
+
+    Every bucket of the window is present, oldest first, so the lists can
+    be plotted as they are.
+    """
+    bucket = _bucket_column(db.engine.dialect.name, unit).label('bucket')
+    rows = db.session.query(bucket, func.sum(ReadingRollup.books), func.sum(ReadingRollup.pages)). \
+        filter(ReadingRollup.user_id == user_id,
+               ReadingRollup.day >= date_from,
+               ReadingRollup.day <= date_to). \
+        group_by(bucket). \
+        all()
+    # sqlite hands dates back as text
+    totals = {day if isinstance(day, str) else day.isoformat(): (books, pages)
+              for day, books, pages in rows}
+    result = {'buckets': [], 'books': [], 'pages': []}
+    for day in buckets(date_from, date_to, unit):
+        books, pages = totals.get(day.isoformat(), (0, 0))
+        result['buckets'].append(day.isoformat())
+        result['books'].append(books)
+        result['pages'].append(pages)
+    return result
+
+
+def compact(batch_size=1000):
+    """Fold the rows of every (user, day, author, genre) into one and drop the empty ones.
+
+    Only rows up to the newest id seen are folded, so deltas written
+    meanwhile are left for the next run. Returns the number of keys folded.
+    """
+    folded = 0
+    while True:
+        groups = db.session.query(*_KEY, func.sum(ReadingRollup.books), func.sum(ReadingRollup.pages),
+                                  func.max(ReadingRollup.id)). \
+            group_by(*_KEY). \
+            having(or_(func.count(ReadingRollup.id) > 1, func.sum(ReadingRollup.books) == 0)). \
+            limit(batch_size). \
+            all()
+        if not groups:
+            return folded
+        for user_id, day, author, genre, books, pages, last_id in groups:
+            rows = ReadingRollup.query.filter(and_(ReadingRollup.user_id == user_id,
+                                                   ReadingRollup.day == day,
+                                                   ReadingRollup.author == author,
+                                                   ReadingRollup.genre == genre,
+                                                   ReadingRollup.id <= last_id))
+            if books:
+                rows.filter(ReadingRollup.id < last_id).delete(synchronize_session=False)
+                ReadingRollup.query.filter_by(id=last_id). \
+                    update({'books': books, 'pages': pages}, synchronize_session=False)
+            else:
+                rows.delete(synchronize_session=False)
+        db.session.commit()
+        folded += len(groups)
@@ -1,18 +1,30 @@
 import base64
-import io
 import random
 import string
 
-from PIL import Image
-from flask import render_template, make_response, send_file, abort
-from flask_mail import Message
+from flask import render_template, make_response, send_file, abort, g, request, Response, \
+    redirect, current_app
 from sqlalchemy.exc import SQLAlchemyError
 
-from bookspace.core.app import db, api, mail
+from bookspace.applications.books import leaderboard, recommend
+from bookspace.applications.books.fuzzy import find_books_fuzzy
+from bookspace.applications.books.search import find_books
+from bookspace.core.app import db, api
+from bookspace.core.auth import AuthResource, get_token, invalidate_token, invalidate_user
+from bookspace.core.imaging import decode_base64, probe, ImageTooLarge
+from bookspace.core.outbox import enqueue
+from bookspace.core.pagination import page_limit, encode_cursor, decode_cursor, \
+    add_page_arguments, encode_keyset, decode_keyset, keyset_filter
 from flask_restful import Resource, reqparse
 
-from bookspace.models import User, UsersBooks, Stats, Books, Reviews, Tokens
-from sqlalchemy import func, desc, and_, or_
+from bookspace.applications.users.avatars import default_avatar, user_avatar, avatar_info, image_data, \
+    process_avatar
+from bookspace.applications.users import reading
+from bookspace.applications.users.reading import reading_summary
+from bookspace.applications.users.shelves import load_shelf, parse_lists
+from bookspace.applications.users.usernames import usernames, invalidate_username
+from bookspace.models import User, UsersBooks, Stats, Books, Reviews, Tokens, ListChoices
+from sqlalchemy import func, desc, or_
 import datetime
 
 _BAD_REQUEST = {'message': 'unvalid data', 'status': 400}
@@ -82,11 +94,7 @@ class Register(Resource):
                 username=username,
             )
             user.set_password(password)
-            with Image.open('bookspace/static/images/avatar.png') as img:
-                output = io.BytesIO()
-                img.save(output, format='png')
-                image_data = output.getvalue()
-                user.image = image_data
+            user.image_hash = default_avatar()
             session.add(user)
             try:
                 session.commit()
@@ -108,45 +116,34 @@ class Register(Resource):
 api.add_resource(Register, '/register')
 
 
-class UserProfile(Resource):
+_PROFILE_KEYS = ('week', 'year', 'month', 'done', 'progress', 'future', 'pages_read')
+_PROFILE_COUNTERS = (Stats.week, Stats.year, Stats.month,
+                     Stats.done_count, Stats.progress_count, Stats.future_count, Stats.pages_read)
+
+
+class UserProfile(AuthResource):
     def __init__(self):
         self.parser = reqparse.RequestParser()
         self.parser.add_argument('password')
         self.parser.add_argument('username')
         self.parser.add_argument('quote')
-        self.parser.add_argument('Authorization', location='headers')
 
     def get(self):
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        if user is None:
+        profile = session.query(User.username, User.email, User.role, User.quote,
+                                *[func.coalesce(column, 0) for column in _PROFILE_COUNTERS]). \
+            outerjoin(Stats, Stats.user_id == User.id). \
+            filter(User.id == g.user.id). \
+            first()
+        if profile is None:
             return _BAD_REQUEST
-        else:
-            user_stats = Stats.query.filter_by(user_id=user.id).first()
-            done = UsersBooks.query.filter_by(user_id=user.id).filter_by(
-                list='DN').count()
-            progress = UsersBooks.query.filter_by(user_id=user.id).filter_by(
-                list='IP').count()
-            future = UsersBooks.query.filter_by(user_id=user.id).filter_by(
-                list='WR').count()
-            user_profile = {
-                "username": user.username,
-                "email": user.email,
-                "week": user_stats.week,
-                "year": user_stats.year,
-                "month": user_stats.month,
-                "done": done,
-                "progress": progress,
-                "future": future,
-                "role": user.role.value,
-                "quote": user.quote
-            }
+        username, email, role, quote, *counters = profile
+        user_profile = {
+            "username": username,
+            "email": email,
+            "role": role.value,
+            "quote": quote
+        }
+        user_profile.update(zip(_PROFILE_KEYS, counters))
         return {'user': user_profile, 'status': 200}
 
     def put(self):
@@ -155,13 +152,7 @@ class UserProfile(Resource):
         password = args.get('password')
         quote = args.get('quote')
 
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
+        user = User.query.get(g.user.id)
         if user is None:
             return _BAD_REQUEST
         else:
@@ -175,147 +166,131 @@ class UserProfile(Resource):
                 session.commit()
             except SQLAlchemyError:
                 session.rollback()
+            invalidate_user(user.id)
+            invalidate_username(user.id)
             return {'message': 'successfully updated', 'status': 200}
 
 
 api.add_resource(UserProfile, '/profile')
 
 
-class UserProfilePhoto(Resource):
+def avatar_size():
+    """The ``size`` query argument, one of ``AVATAR_SIZES``; None means the largest."""
+    size = request.args.get('size', type=int)
+    if size is not None and size not in current_app.config['AVATAR_SIZES']:
+        abort(400, 'Unsupported image size')
+    return size
+
+
+class UserProfilePhoto(AuthResource):
     def __init__(self):
         self.parser = reqparse.RequestParser()
         self.parser.add_argument('image')
-        self.parser.add_argument('Authorization', location='headers')
 
     def get(self):
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-
-        token = args.get('Authorization').split(' ')[1]
-        if not token or not User.verify_auth_token(token):
-            abort(401, 'Unauthorized')
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
+        avatar = user_avatar(g.user.id, avatar_size())
+        if avatar is not None:
+            image = f'data:{avatar.content_type};base64,' + base64.b64encode(avatar.data).decode("utf-8")
         else:
-            if user.image:
-                image = 'data:image/png;base64,' + base64.b64encode(user.image).decode("utf-8")
-            else:
-                image = user.avatar()
-            return {'image': image}
+            user = User.query.get(g.user.id)
+            if user is None:
+                return _BAD_REQUEST
+            image = user.avatar()
+        return {'image': image}
 
     def post(self):
         args = self.parser.parse_args()
         photo = args.get('image')
-        token = args.get('Authorization').split(' ')[1]
-
-        if not token or not User.verify_auth_token(token):
-            abort(401, 'Unauthorized')
         if not photo:
             abort(400, 'Photo was not provided')
 
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
+        config = current_app.config
         try:
-            b64photo = photo.split('base64,')[1]
-            photo_data = base64.b64decode(b64photo)
-            user.image = photo_data
-            db.session.add(user)
-            try:
-                db.session.commit()
-            except SQLAlchemyError:
-                db.session.rollback()
-            return {'message': 'Image was uploaded', 'status': 201}
-        except IOError as e:
+            b64photo = photo.split('base64,')[-1]
+            photo_data = decode_base64(b64photo, config['AVATAR_MAX_BYTES'])
+            probe(photo_data, config['AVATAR_MAX_PIXELS'])
+        except ImageTooLarge:
+            abort(413, 'Image is too large')
+        except ValueError:
             abort(400, 'Could not process given image')
-        except SQLAlchemyError as e:
-            abort(400, f'Could not save image due to {e}')
-        except Exception as e:
-            abort(400, f'An error occurred')
+        process_avatar(g.user.id, photo_data)
+        return {'message': 'Image is being processed', 'status': 202}
 
 
 api.add_resource(UserProfilePhoto, '/profile/image')
 
 
-class Statistics(Resource):
+class UserProfilePhotoRaw(AuthResource):
+
+    def get(self):
+        avatar = avatar_info(g.user.id, avatar_size())
+        if avatar is None:
+            user = User.query.get(g.user.id)
+            if user is None:
+                return _BAD_REQUEST
+            return redirect(user.avatar())
+
+        # the content hash is a strong validator: answer revalidations before loading the bytes
+        if request.if_none_match.contains(avatar.hash):
+            response = Response(status=304)
+            response.set_etag(avatar.hash)
+        else:
+            data = image_data(avatar.hash)
+            response = Response(data, mimetype=avatar.content_type)
+            # the etag has to be there for If-Range to match it
+            response.set_etag(avatar.hash)
+            response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+        response.cache_control.private = True
+        response.cache_control.max_age = current_app.config['AVATAR_MAX_AGE']
+        response.cache_control.must_revalidate = True
+        return response
+
+
+api.add_resource(UserProfilePhotoRaw, '/profile/image/raw')
+
+
+class Statistics(AuthResource):
+    _RANGES = {'week': 7, 'month': 30, 'year': 365}
+
     def __init__(self):
         self.parser = reqparse.RequestParser()
         self.parser.add_argument('range')
+        self.parser.add_argument('from', dest='date_from')
+        self.parser.add_argument('to', dest='date_to')
         self.parser.add_argument('week')
         self.parser.add_argument('month')
         self.parser.add_argument('year')
 
-        self.parser.add_argument('Authorization', location='headers')
+    def _date_range(self, args):
+        """(from, to) dates of the request, both inclusive; a named range ends today."""
+        today = datetime.date.today()
+        if args['date_from'] or args['date_to']:
+            date_from = datetime.date.fromisoformat(args['date_from']) if args['date_from'] else today
+            date_to = datetime.date.fromisoformat(args['date_to']) if args['date_to'] else today
+            return date_from, date_to
+        return today - datetime.timedelta(days=self._RANGES.get(args['range'], 0)), today
 
     def get(self):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-
-        token = args['Authorization'].split(' ')[1]
         range = args['range']
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        status = Stats.query.filter_by(user_id=user.id).first()
-        range_books = []
-
-        date_to = datetime.date.today()
-        date_from = datetime.date.today()
-        if range == 'week':
-            date_from = datetime.date.today() - datetime.timedelta(days=7)
-        elif range == 'month':
-            date_from = datetime.date.today() - datetime.timedelta(days=30)
-        elif range == 'year':
-            date_from = datetime.date.today() - datetime.timedelta(days=365)
-
-        books = UsersBooks.query.filter_by(user_id=user.id).\
-            filter(and_(func.date(UsersBooks.data_added) >= date_from),
-                   func.date(UsersBooks.data_added) <= date_to).\
-            filter_by(list='DN').all()
-
-        count = len(books)
-        if count == 0:
-            fav_author = '-'
-            fav_genre = '-'
-        else:
-            for book in books:
-                range_books.append(book.books_id)
-
-            fav_author = Books.query.with_entities(Books.author,
-                                                   func.count(Books.author)). \
-                group_by(Books.author). \
-                filter(Books.id.in_(range_books)). \
-                order_by(desc(func.count(Books.author))). \
-                first()[0]
+        try:
+            date_from, date_to = self._date_range(args)
+        except ValueError:
+            return _BAD_REQUEST
+        if date_from > date_to:
+            return _BAD_REQUEST
 
-            fav_genre = Books.query.with_entities(Books.genre,
-                                                  func.count(Books.genre)). \
-                group_by(Books.genre). \
-                filter(Books.id.in_(range_books)).order_by(
-                desc(func.count(Books.genre))). \
-                first()[0]
+        info = reading_summary(g.user.id, date_from, date_to)
+        count = info['count']
 
         divide = 0
-        if range == 'week':
-            divide = status.week
-        elif range == 'month':
-            divide = status.month
-        elif range == 'year':
-            divide = status.year
+        if range in self._RANGES and not (args['date_from'] or args['date_to']):
+            divide = session.query(getattr(Stats, range)).filter_by(user_id=g.user.id).scalar() or 0
 
         if divide > 0:
             percent = f'{round(count * 100 / divide, 2)}%'
         else:
             percent = 'no info provided'
-        info = {
-            "count": count,
-            "fav_author": fav_author,
-            "fav_genre": fav_genre,
-        }
         plan = {
             "plan": divide,
             "count": count,
@@ -325,125 +300,66 @@ class Statistics(Resource):
 
 ##FIXME: figure out what to do with get request that unable to send body
     def post(self):
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-
-        token = args['Authorization'].split(' ')[1]
-        range = args['range']
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        status = Stats.query.filter_by(user_id=user.id).first()
-        range_books = []
-
-        date_to = datetime.date.today()
-        date_from = datetime.date.today()
-        if range == 'week':
-            date_from = datetime.date.today() - datetime.timedelta(days=7)
-        elif range == 'month':
-            date_from = datetime.date.today() - datetime.timedelta(days=30)
-        elif range == 'year':
-            date_from = datetime.date.today() - datetime.timedelta(days=365)
-
-        books = UsersBooks.query.filter_by(user_id=user.id).\
-            filter(and_(func.date(UsersBooks.data_added) >= date_from),
-                   func.date(UsersBooks.data_added) <= date_to).\
-            filter_by(list='DN').all()
-
-        count = len(books)
-        if count == 0:
-            fav_author = '-'
-            fav_genre = '-'
-        else:
-            for book in books:
-                range_books.append(book.books_id)
-
-            fav_author = Books.query.with_entities(Books.author,
-                                                   func.count(Books.author)). \
-                group_by(Books.author). \
-                filter(Books.id.in_(range_books)). \
-                order_by(desc(func.count(Books.author))). \
-                first()[0]
-
-            fav_genre = Books.query.with_entities(Books.genre,
-                                                  func.count(Books.genre)). \
-                group_by(Books.genre). \
-                filter(Books.id.in_(range_books)).order_by(
-                desc(func.count(Books.genre))). \
-                first()[0]
-
-        divide = 0
-        if range == 'week':
-            divide = status.week
-        elif range == 'month':
-            divide = status.month
-        elif range == 'year':
-            divide = status.year
-
-        if divide > 0:
-            percent = f'{round(count * 100 / divide, 2)}%'
-        else:
-            percent = 'no info provided'
-        info = {
-            "count": count,
-            "fav_author": fav_author,
-            "fav_genre": fav_genre,
-        }
-        plan = {
-            "plan": divide,
-            "count": count,
-            "percent": percent
-        }
-        return {"info": info, "plan": plan, 'status': 200}
-
+        return self.get()
 
     def put(self):
         args = self.parser.parse_args()
         week = args['week']
         month = args['month']
         year = args['year']
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
-        else:
-            update_status = Stats.query.filter_by(user_id=user.id).first()
-            if week and week.isdigit():
-                update_status.week = week
-            if month and month.isdigit():
-                update_status.month = month
-            if year and year.isdigit():
-                update_status.year = year
-            try:
-                session.commit()
-            except SQLAlchemyError:
-                session.rollback()
-            return _GOOD_REQUEST
+        update_status = Stats.query.filter_by(user_id=g.user.id).first()
+        if week and week.isdigit():
+            update_status.week = week
+        if month and month.isdigit():
+            update_status.month = month
+        if year and year.isdigit():
+            update_status.year = year
+        try:
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+        return _GOOD_REQUEST
 
 
 api.add_resource(Statistics, '/stats')
 
 
-class LogOut(Resource):
+class Timeline(AuthResource):
     def __init__(self):
         self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
+        self.parser.add_argument('from', dest='date_from', location='args')
+        self.parser.add_argument('to', dest='date_to', location='args')
+        self.parser.add_argument('unit', default='day', choices=reading.UNITS, location='args')
 
-    def post(self):
+    def get(self):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
+        unit = args['unit']
+        today = datetime.date.today()
+        try:
+            date_to = datetime.date.fromisoformat(args['date_to']) if args['date_to'] else today
+            date_from = datetime.date.fromisoformat(args['date_from']) if args['date_from'] \
+                else date_to - datetime.timedelta(days=30)
+        except ValueError:
+            return _BAD_REQUEST
+        if date_from > date_to:
+            return _BAD_REQUEST
+        if reading.bucket_count(date_from, date_to, unit) > current_app.config['TIMELINE_MAX_BUCKETS']:
+            return {'message': 'Window is too large for this unit', 'status': 400}
+
+        result = reading.timeline(g.user.id, date_from, date_to, unit)
+        result.update({'unit': unit, 'from': date_from.isoformat(), 'to': date_to.isoformat(), 'status': 200})
+        return result
+
+
+api.add_resource(Timeline, '/stats/timeline')
+
+
+class LogOut(Resource):
+    def post(self):
+        token = get_token()
+        if token is None:
             return {'message': 'Unauthorized', 'status': 401}
 
-        token = args['Authorization'].split(' ')[1]
         new = Tokens.query.filter_by(token=token).first()
         if new is not None:
             session.delete(new)
@@ -451,6 +367,7 @@ class LogOut(Resource):
                 session.commit()
             except SQLAlchemyError:
                 session.rollback()
+            invalidate_token(token)
 
             return {'message': 'User logged out', 'status': 200}
         else:
@@ -460,167 +377,118 @@ class LogOut(Resource):
 api.add_resource(LogOut, '/logout')
 
 
-class DoneBooks(Resource):
+class _Shelf(AuthResource):
+    shelf = None
+
     def __init__(self):
         self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
+        add_page_arguments(self.parser)
 
     def get(self):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
-        else:
-            done_book = UsersBooks.query.filter_by(user_id=user.id).filter_by(list='DN').all()
-            count = len(done_book)
-            info = []
-            for book in done_book:
-                book_id = book.books_id
-                current_book = Books.query.get(book_id)
-                info_book = {
-                    "id": current_book.id,
-                    "title": current_book.title,
-                    "author": current_book.author,
-                    "genre": current_book.genre,
-                    "rate": book.rate,
-                }
-                info.append(info_book)
-        return {'count': count, 'info': info, 'status': 200}
+        user = g.user
+        after = None
+        if args['cursor']:
+            after = decode_keyset(args['cursor'])
+            if after is None:
+                return _BAD_REQUEST
+        limit = page_limit(args['limit'])
+        books = load_shelf(user.id, lists=[self.shelf], limit=limit, after=after)
+        info = []
+        for book in books:
+            info_book = {
+                "id": book.id,
+                "title": book.title,
+                "author": book.author,
+                "genre": book.genre,
+                "rate": book.rate,
+            }
+            info.append(info_book)
+        next_cursor = None
+        if len(books) == limit:
+            next_cursor = encode_keyset(books[-1].data_added, books[-1].entry_id)
+        result = {'count': len(info), 'info': info, 'next': next_cursor, 'status': 200}
+        if args['total']:
+            result['total'] = session.query(Stats.shelf_column(self.shelf)). \
+                filter(Stats.user_id == user.id).scalar() or 0
+        return result
 
 
-api.add_resource(DoneBooks, '/books/read')
+class DoneBooks(_Shelf):
+    shelf = ListChoices.DN
 
 
-class ProgressBooks(Resource):
-    def __init__(self):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
+api.add_resource(DoneBooks, '/books/read')
 
-    def get(self):
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
-        else:
-            info = []
-            progress_book = UsersBooks.query.filter_by(user_id=user.id).filter_by(list='IP').all()
-            count = len(progress_book)
-            for book in progress_book:
-                book_id = book.books_id
-                current_book = Books.query.get(book_id)
-                info_book = {
-                    "id": current_book.id,
-                    "title": current_book.title,
-                    "author": current_book.author,
-                    "genre": current_book.genre,
-                    "rate": book.rate,
 
-                }
-                info.append(info_book)
-        return {'count': count, 'info': info, 'status': 200}
+class ProgressBooks(_Shelf):
+    shelf = ListChoices.IP
 
 
 api.add_resource(ProgressBooks, '/books/progress')
 
 
-class FutureBooks(Resource):
-    def __init__(self):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
-
-    def get(self):
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
-        else:
-            future_book = UsersBooks.query.filter_by(user_id=user.id).filter_by(list='WR').all()
-            count = len(future_book)
-            info = []
-            for book in future_book:
-                book_id = book.books_id
-                current_book = Books.query.get(book_id)
-                info_book = {
-                    "id": current_book.id,
-                    "title": current_book.title,
-                    "author": current_book.author,
-                    "genre": current_book.genre,
-                    "rate": book.rate,
-                }
-                info.append(info_book)
-        return {'count': count, 'info': info, 'status': 200}
+class FutureBooks(_Shelf):
+    shelf = ListChoices.WR
 
 
 api.add_resource(FutureBooks, '/books/future')
 
 
-class AddReviews(Resource):
+class AddReviews(AuthResource):
     def __init__(self):
         self.parser = reqparse.RequestParser()
         self.parser.add_argument('text')
-        self.parser.add_argument('Authorization', location='headers')
+        add_page_arguments(self.parser)
 
     def get(self, books_id):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        exist_user = Reviews.query.filter_by(user_id=user_id).filter_by(
+        user = g.user
+        after = None
+        if args['cursor']:
+            after = decode_keyset(args['cursor'])
+            if after is None:
+                return _BAD_REQUEST
+        limit = page_limit(args['limit'])
+        exist_user = Reviews.query.filter_by(user_id=user.id).filter_by(
             books_id=books_id).first()
         if exist_user is None:
             can_write = True
         else:
             can_write = False
-        list_reviews = Reviews.query.filter_by(books_id=books_id).all()
+        list_reviews = Reviews.query.filter_by(books_id=books_id)
+        if after is not None:
+            list_reviews = list_reviews.filter(keyset_filter(Reviews.data_added, Reviews.id, after))
+        list_reviews = list_reviews.order_by(desc(Reviews.data_added), desc(Reviews.id)). \
+            limit(limit).all()
         count = len(list_reviews)
         info = []
         if count != 0:
+            authors = usernames(review.user_id for review in list_reviews)
             for review in list_reviews:
-                user_id = review.user_id
-                user = User.query.get(user_id)
                 info_review = {
-                    "username": user.username,
+                    "username": authors.get(review.user_id),
                     "text": review.text,
                     'created': review.data_added.strftime(format='%d/%m/%Y'),
                 }
                 info.append(info_review)
-            return {'count': count, 'info': info, 'can_write': can_write, 'status': 200}
+            next_cursor = None
+            if count == limit:
+                next_cursor = encode_keyset(list_reviews[-1].data_added, list_reviews[-1].id)
+            result = {'count': count, 'info': info, 'next': next_cursor,
+                      'can_write': can_write, 'status': 200}
+            if args['total']:
+                result['total'] = session.query(Books.reviews_count). \
+                    filter(Books.id == books_id).scalar() or 0
+            return result
         else:
             return {'message': 'No reviews about this book', 'status': 200}
 
     def post(self, books_id):
         args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
+        user = g.user
         text = args['text']
-        exist_user = Reviews.query.filter_by(user_id=user_id).filter_by(books_id=books_id).first()
+        exist_user = Reviews.query.filter_by(user_id=user.id).filter_by(books_id=books_id).first()
         if exist_user is not None:
             return {'status': 400,
                     'message': f'User {user.username} already left review on this book'}
@@ -631,6 +499,8 @@ class AddReviews(Resource):
                 text=text
             )
             session.add(review)
+            Books.query.filter_by(id=books_id). \
+                update({Books.reviews_count: Books.reviews_count + 1}, synchronize_session=False)
             try:
                 session.commit()
             except SQLAlchemyError:
@@ -647,65 +517,54 @@ class HomepageTop(Resource):
 
     def __init__(self):
         self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
+        self.parser.add_argument('limit', type=int, location='args')
+        self.parser.add_argument('genre', location='args')
 
     def get(self):
-        books = Books.query.order_by(desc('rate')).limit(20).all()
-        list_books = []
-        for book in books:
-            info = {
-                'id': book.id,
-                'title': book.title,
-                'author': book.author,
-                'genre': book.genre,
-                'rate': book.rate}
-
-            list_books.append(info)
-
-        return {'books': list_books, 'status': 200}
+        args = self.parser.parse_args()
+        body, etag = leaderboard.payload(args['genre'], args['limit'])
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        return response.make_conditional(request)
 
 
 api.add_resource(HomepageTop, '/home/top')
 
 
-class HomepageRec(Resource):
-    def __init__(self):
-        self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
-
+class HomepageRec(AuthResource):
     def get(self):
-        args = self.parser.parse_args()
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
+        user = g.user
         range_books = []
-        books = UsersBooks.query.filter_by(user_id=user.id).all()
-        print(len(books))
+        books = session.query(UsersBooks.books_id, UsersBooks.list, UsersBooks.rate). \
+            filter_by(user_id=user.id).all()
         if len(books) > 0:
             for book in books:
                 range_books.append(book.books_id)
 
-            fav_author = Books.query.with_entities(Books.author,
-                                                   func.count(Books.author)). \
-                group_by(Books.author). \
-                filter(Books.id.in_(range_books)). \
-                order_by(desc(func.count(Books.author))). \
-                first()[0]
-            fav_genre = Books.query.with_entities(Books.genre,
-                                                  func.count(Books.genre)). \
-                group_by(Books.genre). \
-                filter(Books.id.in_(range_books)).order_by(
-                desc(func.count(Books.genre))). \
-                first()[0]
-
-            recs = Books.query.filter(or_(Books.author == fav_author, Books.genre == fav_genre)). \
-                filter(Books.id.notin_(range_books)). \
-                order_by(desc('rate')). \
-                limit(20).all()
+            scored = recommend.recommend(books, current_app.config['REC_LIMIT'])
+            if scored:
+                found = {book.id: book for book in
+                         Books.query.filter(Books.id.in_([book_id for book_id, _ in scored]))}
+                recs = [found[book_id] for book_id, _ in scored if book_id in found]
+            else:
+                # cold start: none of the user's books are in the model yet
+                fav_author = Books.query.with_entities(Books.author,
+                                                       func.count(Books.author)). \
+                    group_by(Books.author). \
+                    filter(Books.id.in_(range_books)). \
+                    order_by(desc(func.count(Books.author))). \
+                    first()[0]
+                fav_genre = Books.query.with_entities(Books.genre,
+                                                      func.count(Books.genre)). \
+                    group_by(Books.genre). \
+                    filter(Books.id.in_(range_books)).order_by(
+                    desc(func.count(Books.genre))). \
+                    first()[0]
+
+                recs = Books.query.filter(or_(Books.author == fav_author, Books.genre == fav_genre)). \
+                    filter(Books.id.notin_(range_books)). \
+                    order_by(desc('rate')). \
+                    limit(current_app.config['REC_LIMIT']).all()
             recommendations = []
 
             for rec in recs:
@@ -779,11 +638,7 @@ class GoogleRegister(Resource):
             email=email,
             username=username)
         user.set_password(password)
-        with Image.open('bookspace/static/images/avatar.png') as img:
-            output = io.BytesIO()
-            img.save(output, format='png')
-            image_data = output.getvalue()
-            user.image = image_data
+        user.image_hash = default_avatar()
         session.add(user)
         try:
             session.commit()
@@ -793,15 +648,12 @@ class GoogleRegister(Resource):
             user_id=user.id)
         session.add(user)
         session.add(status)
+        enqueue(email, "BookSpace register",
+                f"You've been registered! To login, use this password (you have to change it later): {password}")
         try:
             session.commit()
         except SQLAlchemyError:
             session.rollback()
-
-        msg = Message(f"BookSpace register",
-                      recipients=[email])
-        msg.body = f"You've been registered! To login, use this password (you have to change it later): {password}"
-        mail.send(msg)
         return {'message': 'Successfully created', 'status': 201}
 
 
@@ -827,11 +679,9 @@ class RestorePass(Resource):
         user = User.query.filter_by(email=email).first()
         if user is not None:
             user.set_password(password)
-            msg = Message(f"BookSpace password",
-                          recipients=[email])
-            msg.body = f"Your password was successfully changed. " \
-                f"To login, use this password (you have to change it later): {password}"
-            mail.send(msg)
+            enqueue(email, "BookSpace password",
+                    f"Your password was successfully changed. "
+                    f"To login, use this password (you have to change it later): {password}")
             session.add(user)
             try:
                 session.commit()
@@ -845,32 +695,38 @@ class RestorePass(Resource):
 api.add_resource(RestorePass, '/login/restore')
 
 
-class Search(Resource):
+class Search(AuthResource):
     def __init__(self):
         self.parser = reqparse.RequestParser()
         self.parser.add_argument('search')
-        self.parser.add_argument('Authorization', location='headers')
+        self.parser.add_argument('mode')
+        self.parser.add_argument('limit', type=int)
+        self.parser.add_argument('cursor')
 
     def post(self):
         args = self.parser.parse_args()
         search = args['search']
-        if args['Authorization'] is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = args['Authorization'].split(' ')[1]
-        if User.verify_auth_token(token) is None:
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        if user is None:
-            return _BAD_REQUEST
-        elif search is not None:
+        if search is not None and args['mode'] == 'fuzzy':
             info = []
-            research = search.strip()
-            query = f'%{research}%'
-            print(research)
-            result = Books.query.filter(or_(Books.genre.ilike(query), Books.title.ilike(query), Books.author.ilike(query))).all()
-            print(result)
+            for book in find_books_fuzzy(search, page_limit(args['limit'])):
+                info.append({
+                    "id": book.id,
+                    "title": book.title,
+                    "author": book.author,
+                    "genre": book.genre
+                })
+            return {'count': len(info), 'total': len(info), 'next': None,
+                    'books': info, 'status': 200}
+        elif search is not None:
+            after = None
+            if args['cursor']:
+                after = decode_cursor(args['cursor'])
+                if after is None or len(after) != 2:
+                    return _BAD_REQUEST
+            limit = page_limit(args['limit'])
+            result, total = find_books(search.strip(), limit, after)
 
+            info = []
             for book in result:
                 listbook = {
                     "id": book.id,
@@ -879,7 +735,13 @@ class Search(Resource):
                     "genre": book.genre
                 }
                 info.append(listbook)
-            return {'count': len(info), 'books': info, 'status': 200}
+            next_cursor = None
+            if len(result) == limit:
+                next_cursor = encode_cursor(result[-1].score, result[-1].id)
+            # paging stops after the best SEARCH_CANDIDATES matches, however many the total estimates
+            ranked = None if total is None else min(total, current_app.config['SEARCH_CANDIDATES'])
+            return {'count': len(info), 'total': total, 'ranked': ranked, 'next': next_cursor,
+                    'books': info, 'status': 200}
         return _BAD_REQUEST
 
 
@@ -905,32 +767,24 @@ class IndexPage(Resource):
 api.add_resource(IndexPage, '/index')
 
 
-class RecentBooks(Resource):
+class RecentBooks(AuthResource):
     def __init__(self):
         self.parser = reqparse.RequestParser()
-        self.parser.add_argument('Authorization', location='headers')
+        self.parser.add_argument('list', action='append', location='args')
 
     def get(self):
         args = self.parser.parse_args()
-        auth = args.get('Authorization')
-        if not auth:
-            return {'message': 'Unauthorized', 'status': 401}
-        token = auth.split(' ')[1]
-        if not User.verify_auth_token(token):
-            return {'message': 'Unauthorized', 'status': 401}
-        user_id = User.verify_auth_token(token)['user_id']
-        user = User.query.get(user_id)
-        if not user:
+        user = g.user
+        lists = parse_lists(args['list'])
+        if lists is None:
             return _BAD_REQUEST
-        user_books = UsersBooks.query.filter_by(user_id=user.id).order_by(desc(UsersBooks.data_added)).limit(3).all()
         books = []
-        for book in user_books:
-            book_data = Books.query.filter_by(id=book.books_id).first()
+        for book in load_shelf(user.id, lists=lists, limit=3):
             info = {
-                'id': book.id,
-                'list': book.list.value,
-                'title': book_data.title,
-                'author': book_data.author,
+                'id': book.entry_id,
+                'list': book.list.value if book.list else None,
+                'title': book.title,
+                'author': book.author,
                 'rate': book.rate
             }
             books.append(info)
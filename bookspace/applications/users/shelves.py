@@ -0,0 +1,40 @@
+from sqlalchemy import desc
+
+from bookspace.core.app import db
+from bookspace.core.pagination import keyset_filter
+from bookspace.models import Books, UsersBooks, ListChoices
+
+
+def parse_lists(values):
+    """``ListChoices`` for the given names ('DN', 'IP', 'WR'), None if any is unknown."""
+    try:
+        return [ListChoices[value] for value in values or []]
+    except KeyError:
+        return None
+
+
+def load_shelf(user_id, lists=None, limit=None, after=None):
+    """The user's books joined with their catalog data in one query, newest first.
+
+    Rows carry ``entry_id``, ``list``, ``rate`` and ``data_added`` from
+    ``user_books`` and ``id``, ``title``, ``author`` and ``genre`` from ``books``.
+    ``after`` is the (data_added, entry id) keyset of the previous page.
+    """
+    query = db.session.query(UsersBooks.id.label('entry_id'),
+                             UsersBooks.list,
+                             UsersBooks.rate,
+                             UsersBooks.data_added,
+                             Books.id,
+                             Books.title,
+                             Books.author,
+                             Books.genre). \
+        join(Books, Books.id == UsersBooks.books_id). \
+        filter(UsersBooks.user_id == user_id)
+    if lists:
+        query = query.filter(UsersBooks.list.in_(lists))
+    if after is not None:
+        query = query.filter(keyset_filter(UsersBooks.data_added, UsersBooks.id, after))
+    query = query.order_by(desc(UsersBooks.data_added), desc(UsersBooks.id))
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
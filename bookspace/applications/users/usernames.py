@@ -0,0 +1,32 @@
+from bookspace.core.app import db
+from bookspace.core.cache import LRUCache
+from bookspace.models import User
+
+# sized from the config by init_app
+_usernames = LRUCache()
+
+
+def init_app(app):
+    _usernames.maxsize = app.config['USERNAME_CACHE_SIZE']
+    _usernames.ttl = app.config['USERNAME_CACHE_TTL']
+
+
+def usernames(user_ids):
+    """``{user_id: username}`` for the given ids, with one query for the uncached ones."""
+    found, missing = {}, set()
+    for user_id in set(user_ids):
+        username = _usernames.get(user_id)
+        if username is None:
+            missing.add(user_id)
+        else:
+            found[user_id] = username
+    if missing:
+        for user_id, username in db.session.query(User.id, User.username). \
+                filter(User.id.in_(missing)):
+            _usernames.set(user_id, username)
+            found[user_id] = username
+    return found
+
+
+def invalidate_username(user_id):
+    _usernames.pop(user_id)
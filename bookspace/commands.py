@@ -0,0 +1,237 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, case, desc, text
+
+from bookspace.applications.books import content, fuzzy, recommend, similar, suggest
+from bookspace.applications.users import reading
+from bookspace.core import outbox, profiling
+from bookspace.core.app import db
+from bookspace.models import Books, UsersBooks, Stats, ListChoices, Reviews, Notes, Tokens, ReadingRollup, \
+    User, RolesChoices
+
+_RATING_COLUMNS = ('rate_sum', 'rate_count',
+                   'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5')
+_SHELF_COLUMNS = ('done_count', 'progress_count', 'future_count', 'pages_read')
+
+
+@click.command('check-ratings')
+@click.option('--fix', is_flag=True, help='Rewrite aggregates that are out of sync.')
+@with_appcontext
+def check_ratings(fix):
+    """Compare Books rating aggregates with a recount over user_books."""
+    rated = UsersBooks.rate > 0
+    counted = db.session.query(
+        UsersBooks.books_id,
+        func.sum(case([(rated, UsersBooks.rate)], else_=0)),
+        func.sum(case([(rated, 1)], else_=0)),
+        *[func.sum(case([(UsersBooks.rate == star, 1)], else_=0)) for star in range(1, 6)]
+    ).group_by(UsersBooks.books_id).subquery()
+
+    stored = [getattr(Books, column) for column in _RATING_COLUMNS]
+    actual = [func.coalesce(column, 0) for column in list(counted.c)[1:]]
+    mismatched = db.session.query(Books.id, *actual). \
+        outerjoin(counted, counted.c.books_id == Books.id). \
+        filter(db.or_(*[s != a for s, a in zip(stored, actual)])). \
+        yield_per(1000)
+
+    broken = 0
+    for row in mismatched:
+        broken += 1
+        click.echo(f'book {row[0]}: aggregates out of sync')
+        if fix:
+            values = dict(zip(_RATING_COLUMNS, row[1:]))
+            values['rate'] = round(values['rate_sum'] / values['rate_count'], 2) \
+                if values['rate_count'] else 0
+            Books.query.filter_by(id=row[0]).update(values, synchronize_session=False)
+    if fix and broken:
+        db.session.commit()
+    click.echo(f'{broken} book(s) with inconsistent ratings' + (' fixed' if fix and broken else ''))
+
+
+@click.command('check-shelves')
+@click.option('--fix', is_flag=True, help='Rewrite counters that are out of sync.')
+@with_appcontext
+def check_shelves(fix):
+    """Compare Stats shelf counters with one grouped pass over user_books."""
+    counted = db.session.query(
+        UsersBooks.user_id, UsersBooks.list,
+        func.count(UsersBooks.id), func.coalesce(func.sum(Books.pages), 0)
+    ).join(Books, Books.id == UsersBooks.books_id). \
+        filter(UsersBooks.list.isnot(None)). \
+        group_by(UsersBooks.user_id, UsersBooks.list)
+
+    actual = {}
+    for user_id, shelf, count, pages in counted:
+        values = actual.setdefault(user_id, dict.fromkeys(_SHELF_COLUMNS, 0))
+        values[Stats.shelf_column(shelf).key] = count
+        if shelf is ListChoices.DN:
+            values['pages_read'] = pages
+
+    empty = dict.fromkeys(_SHELF_COLUMNS, 0)
+    stored = db.session.query(Stats.user_id, Stats.done_count, Stats.progress_count,
+                              Stats.future_count, Stats.pages_read).yield_per(1000)
+    broken = []
+    for user_id, *counters in stored:
+        values = actual.get(user_id, empty)
+        if counters != [values[key] for key in _SHELF_COLUMNS]:
+            click.echo(f'user {user_id}: shelf counters out of sync')
+            broken.append((user_id, values))
+    if fix:
+        for user_id, values in broken:
+            Stats.query.filter_by(user_id=user_id).update(values, synchronize_session=False)
+        if broken:
+            db.session.commit()
+    click.echo(f'{len(broken)} user(s) with inconsistent shelves' + (' fixed' if fix and broken else ''))
+
+
+@click.command('compact-reading')
+@click.option('--batch-size', default=1000, show_default=True)
+@with_appcontext
+def compact_reading(batch_size):
+    """Fold the reading rollup deltas; run it periodically."""
+    click.echo(f'{reading.compact(batch_size)} reading rollup key(s) compacted')
+
+
+@click.command('build-similar')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--refresh', is_flag=True, help='Only rebuild the lists rate, author or genre changes since '
+                                              'the last run affect; run it periodically.')
+@with_appcontext
+def build_similar(batch_size, refresh):
+    """Rebuild the book_similar table for the whole catalog."""
+    if refresh:
+        click.echo(f'{similar.refresh(batch_size)} list(s) refreshed')
+        return
+    total = Books.query.count()
+    with click.progressbar(length=total, label='Building similar books') as bar:
+        for size in similar.build_all(batch_size):
+            bar.update(size)
+
+
+@click.command('build-content-similar')
+@click.option('--workers', type=int, help='Processes to use; all cores by default.')
+@with_appcontext
+def build_content_similar(workers):
+    """Write the title/author/genre neighbour file /books/<id> reads."""
+    count = content.build(workers=workers)
+    click.echo(f'{count} book(s) written to {current_app.config["CONTENT_NEIGHBOURS_FILE"]}')
+
+
+@click.command('build-suggest')
+@with_appcontext
+def build_suggest():
+    """Write the search-as-you-type snapshot every worker maps."""
+    count = suggest.build_snapshot()
+    click.echo(f'{count} suggest entries written to {current_app.config["SUGGEST_SNAPSHOT"]}')
+
+
+@click.command('build-fuzzy')
+@with_appcontext
+def build_fuzzy():
+    """Write the trigram index typo tolerant search maps."""
+    count = fuzzy.build_index()
+    click.echo(f'{count} book(s) written to {current_app.config["FUZZY_INDEX_FILE"]}')
+
+
+@click.command('build-recommendations')
+@click.option('--refresh', is_flag=True, help='Only recompute what books added since the last run changed.')
+@with_appcontext
+def build_recommendations(refresh):
+    """Write the item-to-item neighbour file /home/rec scores with."""
+    if refresh:
+        click.echo(f'{recommend.refresh()} book(s) refreshed')
+    else:
+        click.echo(f'{recommend.build()} book(s) written to {current_app.config["REC_NEIGHBOURS_FILE"]}')
+
+
+@click.command('send-mail')
+@click.option('--once', is_flag=True, help='Send one batch and exit.')
+@with_appcontext
+def send_mail(once):
+    """Deliver queued mail from the outbox."""
+    if once:
+        click.echo(f'{outbox.send_pending()} mail(s) handled')
+    else:
+        outbox.run()
+
+
+def _hot_queries():
+    """The lookups routes run on every request, with placeholder values."""
+    return {
+        'shelf entry': UsersBooks.query.filter_by(user_id=1, books_id=1),
+        'shelf page': UsersBooks.query.filter_by(user_id=1, list='DN').
+        order_by(desc(UsersBooks.data_added), desc(UsersBooks.id)).limit(20),
+        'book ratings': db.session.query(UsersBooks.rate).filter_by(books_id=1),
+        'book reviews': Reviews.query.filter_by(books_id=1).
+        order_by(desc(Reviews.data_added), desc(Reviews.id)).limit(20),
+        'user review': Reviews.query.filter_by(user_id=1, books_id=1),
+        'book notes': Notes.query.filter_by(books_id=1, user_id=1).
+        order_by(desc(Notes.data_added), desc(Notes.id)).limit(20),
+        'user tokens': Tokens.query.filter_by(user_id=1),
+        'user stats': Stats.query.filter_by(user_id=1),
+        'top rated': Books.query.order_by(desc(Books.rate), Books.id).limit(20),
+        'by author': Books.query.filter_by(author='a').order_by(desc(Books.rate), Books.id).limit(20),
+        'by genre': Books.query.filter_by(genre='g').order_by(desc(Books.rate), Books.id).limit(20),
+        'reading range': ReadingRollup.query.filter(ReadingRollup.user_id == 1,
+                                                    ReadingRollup.day >= '2020-01-01'),
+    }
+
+
+def _scanned_tables(dialect, sql):
+    """Tables the plan of ``sql`` reads without an index."""
+    if dialect == 'postgresql':
+        plan = db.session.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+        nodes = [plan[0]['Plan']]
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan':
+                yield node['Relation Name']
+            nodes.extend(node.get('Plans', ()))
+    else:
+        for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}')):
+            detail = row[-1]
+            if detail.startswith('SCAN ') and 'INDEX' not in detail:
+                yield detail.split()[1]
+
+
+@click.command('check-plans')
+@with_appcontext
+def check_plans():
+    """EXPLAIN the hot lookups and fail if any of them scans a whole table."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        # tiny development tables are cheaper to scan; ask whether an index *can* serve the query
+        db.session.execute(text('SET LOCAL enable_seqscan = off'))
+    failed = 0
+    for name, query in _hot_queries().items():
+        sql = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True})
+        scanned = sorted(set(_scanned_tables(dialect, sql)))
+        if scanned:
+            failed += 1
+            click.echo(f'{name}: full scan of {", ".join(scanned)}')
+        else:
+            click.echo(f'{name}: ok')
+    db.session.rollback()
+    if failed:
+        raise SystemExit(1)
+
+
+@click.command('profile-header')
+@click.argument('user_id', type=int)
+@with_appcontext
+def profile_header(user_id):
+    """Print the header that has an admin's requests profiled."""
+    role = db.session.query(User.role).filter_by(id=user_id).scalar()
+    if role is not RolesChoices.admin:
+        raise click.ClickException(f'user {user_id} is not an admin')
+    click.echo(f'{current_app.config["PROFILE_HEADER"]}: {profiling.header_value(user_id)}')
+
+
+_COMMANDS = (check_ratings, check_shelves, compact_reading, build_similar, build_content_similar,
+             build_suggest, build_fuzzy, build_recommendations, send_mail, check_plans, profile_header)
+
+
+def init_app(app):
+    for command in _COMMANDS:
+        app.cli.add_command(command)
@@ -0,0 +1,160 @@
+import fcntl
+import hashlib
+import os
+import threading
+from collections import namedtuple
+from functools import wraps
+
+from flask import current_app, g, request
+from flask_restful import Resource
+
+from bookspace.core.app import db
+from bookspace.core.cache import LRUCache
+from bookspace.models import User, Tokens
+
+_UNAUTHORIZED = {'message': 'Unauthorized', 'status': 401}
+
+AuthUser = namedtuple('AuthUser', ['id', 'username', 'role'])
+
+# digest of the token -> AuthUser, kept no longer than the token itself is valid; sized by init_app
+_tokens = LRUCache()
+
+# inode and read offset of AUTH_REVOKED_FILE as far as this process has applied it
+_revoked = {'inode': None, 'offset': 0}
+_revoked_lock = threading.Lock()
+
+
+def init_app(app):
+    _tokens.maxsize = app.config['AUTH_CACHE_SIZE']
+    _tokens.ttl = app.config['AUTH_CACHE_TTL']
+
+
+def get_token():
+    auth = request.headers.get('Authorization')
+    if not auth:
+        return None
+    return auth.split(' ')[-1] or None
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+
+
+def _apply(lines):
+    users = set()
+    for line in lines:
+        kind, _, value = line.partition(':')
+        if kind == 't':
+            _tokens.pop(value)
+        elif kind == 'u' and value.isdigit():
+            users.add(int(value))
+    if users:
+        _tokens.discard(lambda digest, user: user.id in users)
+
+
+def _follow():
+    """Apply what other processes appended to AUTH_REVOKED_FILE since the last call.
+
+    A ``stat`` when nothing changed. When the file was started over, what
+    went into the old one after the last call is lost, so the whole cache
+    goes and the new file is read from the start.
+    """
+    path = current_app.config['AUTH_REVOKED_FILE']
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return
+    if _revoked['inode'] == stat.st_ino and _revoked['offset'] == stat.st_size:
+        return
+    with _revoked_lock:
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            if _revoked['inode'] != stat.st_ino or stat.st_size < _revoked['offset']:
+                if _revoked['inode'] is not None:
+                    _tokens.clear()
+                _revoked.update(inode=stat.st_ino, offset=0)
+            file.seek(_revoked['offset'])
+            data = file.read(stat.st_size - _revoked['offset'])
+        complete = data.rfind(b'\n') + 1
+        _revoked['offset'] += complete
+        _apply(data[:complete].decode('ascii').split())
+
+
+def _revoke(line):
+    """Apply ``line`` here and append it for the other processes.
+
+    Appends are serialized with ``flock``; past AUTH_REVOKED_MAX_BYTES
+    the file is replaced by an empty one, which every reader notices by
+    its inode. A writer that waited on the old file tries again.
+    """
+    _apply([line])
+    path = current_app.config['AUTH_REVOKED_FILE']
+    while True:
+        with open(path, 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                rotated = os.stat(path).st_ino != os.fstat(file.fileno()).st_ino
+            except FileNotFoundError:
+                rotated = True
+            if rotated:
+                continue
+            if file.tell() >= current_app.config['AUTH_REVOKED_MAX_BYTES']:
+                open(f'{path}.{os.getpid()}.tmp', 'w').close()
+                os.replace(f'{path}.{os.getpid()}.tmp', path)
+                continue
+            file.write(line + '\n')
+            return
+
+
+def resolve_token(token):
+    """Return the ``AuthUser`` the token belongs to, or None.
+
+    The signature check and the user lookup only run on a cache miss;
+    a hit is only trusted once the revocations of every other worker
+    have been applied.
+    """
+    _follow()
+    digest = _digest(token)
+    user = _tokens.get(digest)
+    if user is not None:
+        return user
+    data = User.verify_auth_token(token)
+    if data is None:
+        return None
+    row = db.session.query(User.id, User.username, User.role). \
+        join(Tokens, Tokens.user_id == User.id). \
+        filter(Tokens.token == token). \
+        filter(User.id == data['user_id']). \
+        first()
+    if row is None:
+        return None
+    user = AuthUser(*row)
+    _tokens.set(digest, user, expires=data['expires'])
+    return user
+
+
+def invalidate_token(token):
+    """Forget ``token`` in every worker of this host."""
+    _revoke(f't:{_digest(token)}')
+
+
+def invalidate_user(user_id):
+    """Forget every token of the user in every worker of this host."""
+    _revoke(f'u:{user_id}')
+
+
+def login_required(func):
+    """Resolve the request's bearer token once and expose it as ``g.user``."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = get_token()
+        user = resolve_token(token) if token else None
+        if user is None:
+            return _UNAUTHORIZED
+        g.user = user
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class AuthResource(Resource):
+    method_decorators = [login_required]
@@ -0,0 +1,69 @@
+import base64
+import binascii
+import io
+
+from PIL import Image, ImageOps
+
+# base64 is decoded this many characters at a time (a multiple of 4)
+_CHUNK = 64 * 1024
+
+_CONTENT_TYPES = {'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def decode_base64(payload, max_bytes):
+    """Decode ``payload`` chunk by chunk, giving up as soon as it exceeds ``max_bytes``."""
+    payload = ''.join(payload.split())
+    if len(payload) // 4 * 3 > max_bytes + 2:
+        raise ImageTooLarge(max_bytes)
+    out = io.BytesIO()
+    try:
+        for start in range(0, len(payload), _CHUNK):
+            out.write(base64.b64decode(payload[start:start + _CHUNK], validate=True))
+            if out.tell() > max_bytes:
+                raise ImageTooLarge(max_bytes)
+    except binascii.Error as e:
+        raise ValueError('invalid base64') from e
+    return out.getvalue()
+
+
+def probe(data, max_pixels):
+    """(format, width, height) read from the image header only; raises ValueError."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            image_format = image.format
+    except (IOError, Image.DecompressionBombError) as e:
+        raise ValueError('not an image') from e
+    if width * height > max_pixels:
+        raise ImageTooLarge(max_pixels)
+    return image_format, width, height
+
+
+def content_type(image_format):
+    image_format = image_format.upper()
+    return _CONTENT_TYPES.get(image_format) or Image.MIME.get(image_format, 'application/octet-stream')
+
+
+def render_variants(data, sizes, image_format='WEBP'):
+    """Square crops of ``data`` for every size as (size, bytes) pairs.
+
+    Runs in a worker process, so it only takes and returns plain values.
+    """
+    variants = []
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA')
+        for size in sorted(sizes, reverse=True):
+            # downscale from the previous (larger) variant, it is much cheaper than the original
+            image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            out = io.BytesIO()
+            if image_format.upper() == 'WEBP':
+                image.save(out, 'WEBP', quality=85, method=4)
+            else:
+                image.save(out, 'PNG', optimize=True)
+            variants.append((size, out.getvalue()))
+    return variants
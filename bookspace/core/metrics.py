@@ -0,0 +1,218 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, request, current_app, Response
+from flask_restful.representations.json import output_json
+
+from bookspace.core.app import api
+
+# used bytes, doubles per series
+_HEADER = struct.Struct('<QQ')
+_KEY_LENGTH = struct.Struct('<Q')
+_INITIAL_SIZE = 64 * 1024
+_SEPARATOR = '\x1f'
+# the doubles of a series: counters, then one count per latency bucket and +Inf
+_COUNT, _SECONDS, _DB_SECONDS, _DB_QUERIES, _BYTES, _BUCKETS = range(6)
+
+_stores = {'pid': None, 'store': None}
+_stores_lock = threading.Lock()
+
+
+class _Store(object):
+    """The series of one process in a memory mapped file of its own.
+
+    The file is a header and then (key length, key, values) entries, each
+    padded to whole doubles. Entries are only ever appended and the used
+    size is written after the entry, so a reader never sees half of one.
+    A file left by an earlier process with the same pid is added onto.
+    """
+
+    def __init__(self, path, width):
+        self.width = width
+        self.offsets = {}
+        self.lock = threading.Lock()
+        self.file = open(path, 'a+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if size >= _HEADER.size:
+            self.file.seek(0)
+            _, stored_width = _HEADER.unpack(self.file.read(_HEADER.size))
+            if stored_width != width:
+                self.file.truncate(0)
+                size = 0
+        if size < _INITIAL_SIZE:
+            self.file.truncate(_INITIAL_SIZE)
+        self._map()
+        self.used, _ = _HEADER.unpack_from(self.map)
+        if not self.used:
+            self.used = _HEADER.size
+            _HEADER.pack_into(self.map, 0, self.used, width)
+        for key, offset, _ in _entries(self.map, self.used, width):
+            self.offsets[key] = offset // 8
+
+    def _map(self):
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.values = memoryview(self.map).cast('d')
+
+    def _append(self, key):
+        encoded = key.encode('utf-8')
+        start = self.used + _KEY_LENGTH.size
+        offset = start + (len(encoded) + 7) // 8 * 8
+        end = offset + self.width * 8
+        if end > len(self.map):
+            size = max(end, 2 * len(self.map))
+            self.values.release()
+            self.map.close()
+            self.file.truncate(size)
+            self._map()
+        _KEY_LENGTH.pack_into(self.map, self.used, len(encoded))
+        self.map[start:start + len(encoded)] = encoded
+        self.used = end
+        _HEADER.pack_into(self.map, 0, self.used, self.width)
+        self.offsets[key] = offset // 8
+        return offset // 8
+
+    def observe(self, key, seconds, db_seconds, db_queries, size, bucket):
+        with self.lock:
+            base = self.offsets.get(key)
+            if base is None:
+                base = self._append(key)
+            values = self.values
+            values[base + _COUNT] += 1
+            values[base + _SECONDS] += seconds
+            values[base + _DB_SECONDS] += db_seconds
+            values[base + _DB_QUERIES] += db_queries
+            values[base + _BYTES] += size
+            values[base + _BUCKETS + bucket] += 1
+
+
+def _entries(data, used, width):
+    """(key, byte offset of the values, values) of every entry up to ``used``."""
+    position = _HEADER.size
+    while position < used:
+        length, = _KEY_LENGTH.unpack_from(data, position)
+        start = position + _KEY_LENGTH.size
+        offset = start + (length + 7) // 8 * 8
+        key = bytes(data[start:start + length]).decode('utf-8')
+        yield key, offset, struct.unpack_from(f'<{width}d', data, offset)
+        position = offset + width * 8
+
+
+def _width(buckets):
+    return _BUCKETS + len(buckets) + 1
+
+
+def _store():
+    """Store of this process; a forked worker opens its own file instead of sharing its parent's."""
+    with _stores_lock:
+        if _stores['pid'] != os.getpid():
+            directory = current_app.config['METRICS_DIR']
+            os.makedirs(directory, exist_ok=True)
+            _stores['store'] = _Store(os.path.join(directory, f'{os.getpid()}.metrics'),
+                                      _width(current_app.config['METRICS_BUCKETS']))
+            _stores['pid'] = os.getpid()
+        return _stores['store']
+
+
+def collect(directory, buckets):
+    """Series of every process writing to ``directory`` summed up, by key."""
+    width = _width(buckets)
+    totals = defaultdict(lambda: [0.0] * width)
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.metrics'):
+            continue
+        with open(entry.path, 'rb') as file:
+            data = file.read()
+        if len(data) < _HEADER.size:
+            continue
+        used, stored_width = _HEADER.unpack_from(data)
+        if stored_width != width:
+            continue
+        for key, _, values in _entries(data, min(used, len(data)), width):
+            series = totals[key]
+            for i, value in enumerate(values):
+                series[i] += value
+    return totals
+
+
+def _output_json(data, code, headers=None):
+    # resources answer 200 and put the status in the body; count that one
+    if isinstance(data, dict) and 'status' in data:
+        g.response_status = data['status']
+    return output_json(data, code, headers)
+
+
+def _start():
+    g.metrics_started = time.perf_counter()
+
+
+def _record(response):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return response
+    seconds = time.perf_counter() - started
+    stats = g.get('query_stats')
+    status = g.pop('response_status', None) or response.status_code
+    key = f'{request.endpoint}{_SEPARATOR}{request.method}{_SEPARATOR}{status}'
+    _store().observe(key, seconds, stats.duration if stats else 0.0, stats.count if stats else 0,
+                     response.content_length or 0,
+                     bisect.bisect_left(current_app.config['METRICS_BUCKETS'], seconds))
+    return response
+
+
+def _number(value):
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(key):
+    endpoint, method, status = key.split(_SEPARATOR)
+    endpoint = endpoint.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'endpoint="{endpoint}",method="{method}",status="{status}"'
+
+
+_COUNTERS = [
+    ('bookspace_requests_total', 'Requests handled.', _COUNT),
+    ('bookspace_db_seconds_total', 'Time spent in database queries.', _DB_SECONDS),
+    ('bookspace_db_queries_total', 'Database queries run.', _DB_QUERIES),
+    ('bookspace_response_bytes_total', 'Response body bytes sent.', _BYTES),
+]
+
+
+def export():
+    """Every series in the Prometheus text format."""
+    buckets = current_app.config['METRICS_BUCKETS']
+    directory = current_app.config['METRICS_DIR']
+    totals = sorted(collect(directory, buckets).items()) if os.path.isdir(directory) else []
+    lines = []
+    for name, description, index in _COUNTERS:
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+        lines += [f'{name}{{{_labels(key)}}} {_number(values[index])}' for key, values in totals]
+    name = 'bookspace_request_duration_seconds'
+    lines += [f'# HELP {name} Time to handle a request.', f'# TYPE {name} histogram']
+    for key, values in totals:
+        labels = _labels(key)
+        cumulative = 0.0
+        for bound, count in zip(list(buckets) + ['+Inf'], values[_BUCKETS:]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {_number(cumulative)}')
+        lines.append(f'{name}_sum{{{labels}}} {_number(values[_SECONDS])}')
+        lines.append(f'{name}_count{{{labels}}} {_number(values[_COUNT])}')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Count every request per endpoint, method and status into METRICS_DIR and serve /metrics.
+
+    Every process writes a file of its own, /metrics sums them up, so the
+    numbers cover all gunicorn workers whichever of them answers. Must be
+    registered after ``querystats``: after_request functions run in reverse
+    order, so the query stats of the request are still there.
+    """
+    api.representations['application/json'] = _output_json
+    app.before_request(_start)
+    app.after_request(_record)
+    app.add_url_rule('/metrics', 'metrics', export)
@@ -0,0 +1,101 @@
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+# magic, books, neighbours per book, stamp of the data it was built from
+_HEADER = struct.Struct('<4sIIq')
+_MAGIC = b'BSN1'
+
+_files = {}
+_lock = threading.Lock()
+
+
+class Neighbours(object):
+    """Top-k neighbours of every book as flat arrays over a (memory mapped) buffer.
+
+    ``ids`` is sorted; row ``i`` of ``neighbours`` and ``scores`` belongs to
+    ``ids[i]``, best first, padded with id 0.
+    """
+
+    def __init__(self, buffer):
+        magic, count, k, self.stamp = _HEADER.unpack_from(buffer)
+        if magic != _MAGIC:
+            raise ValueError('not a neighbour file')
+        offset = _HEADER.size
+        self.ids = np.frombuffer(buffer, np.int32, count, offset)
+        offset += 4 * count
+        self.neighbours = np.frombuffer(buffer, np.int32, count * k, offset).reshape(count, k)
+        offset += 4 * count * k
+        self.scores = np.frombuffer(buffer, np.float32, count * k, offset).reshape(count, k)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, book_ids):
+        """(positions in ``book_ids``, rows) of the books that have neighbours."""
+        book_ids = np.asarray(book_ids, np.int32)
+        rows = np.searchsorted(self.ids, book_ids)
+        rows[rows == len(self.ids)] = 0
+        found = np.flatnonzero(self.ids[rows] == book_ids) if len(self.ids) else np.empty(0, np.intp)
+        return found, rows[found]
+
+    def of(self, book_id):
+        """[(neighbour id, score)] of one book, best first."""
+        _, rows = self.rows([book_id])
+        if not len(rows):
+            return []
+        neighbours, scores = self.neighbours[rows[0]], self.scores[rows[0]]
+        return [(int(n), float(s)) for n, s in zip(neighbours, scores) if n]
+
+
+def write(path, ids, neighbours, scores, stamp=0):
+    """Replace the file at ``path`` with these rows; readers switch over on their next lookup."""
+    ids = np.asarray(ids, np.int32)
+    order = np.argsort(ids, kind='stable')
+    neighbours = np.asarray(neighbours, np.int32)[order]
+    scores = np.asarray(scores, np.float32)[order]
+    count, k = neighbours.shape if neighbours.ndim == 2 else (len(ids), 0)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(_HEADER.pack(_MAGIC, count, k, stamp))
+        for part in (ids[order], neighbours, scores):
+            file.write(np.ascontiguousarray(part).tobytes())
+    os.replace(tmp, path)
+    return count
+
+
+def merge(old, ids, neighbours, scores):
+    """Rows of ``old`` with those of ``ids`` replaced or added, as (ids, neighbours, scores)."""
+    ids = np.asarray(ids, np.int32)
+    if old is None or not len(old):
+        return ids, neighbours, scores
+    k = max(old.neighbours.shape[1], neighbours.shape[1])
+    keep = ~np.isin(old.ids, ids)
+
+    def widen(rows, dtype):
+        padded = np.zeros((len(rows), k), dtype)
+        padded[:, :rows.shape[1]] = rows
+        return padded
+
+    return (np.concatenate([old.ids[keep], ids]),
+            np.concatenate([widen(old.neighbours[keep], np.int32), widen(neighbours, np.int32)]),
+            np.concatenate([widen(old.scores[keep], np.float32), widen(scores, np.float32)]))
+
+
+def load(path):
+    """The file at ``path``, remapped whenever another process replaced it; None if there is none."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _files.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _lock:
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        _files[path] = (mtime, Neighbours(buffer))
+        return _files[path][1]
@@ -0,0 +1,86 @@
+import smtplib
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy.exc import SQLAlchemyError
+
+from bookspace.core.app import db, mail
+from bookspace.models import Outbox, MailStatus
+
+# the server refused this one message, the connection itself is still usable
+_REJECTED = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def enqueue(recipient, subject, body):
+    """Queue a mail for the sender; it is stored with the caller's next commit."""
+    db.session.add(Outbox(recipient=recipient, subject=subject, body=body))
+
+
+def _due(batch_size):
+    """Lock the next batch of due mail; concurrent senders skip rows another one holds."""
+    return Outbox.query. \
+        filter(Outbox.status == MailStatus.pending, Outbox.next_attempt <= datetime.utcnow()). \
+        order_by(Outbox.next_attempt, Outbox.id). \
+        limit(batch_size). \
+        with_for_update(skip_locked=True). \
+        all()
+
+
+def _retry(item, error):
+    config = current_app.config
+    item.attempts += 1
+    item.last_error = str(error)[:512]
+    if item.attempts >= config['OUTBOX_MAX_ATTEMPTS']:
+        item.status = MailStatus.failed
+        item.body = None
+    else:
+        delay = config['OUTBOX_RETRY_DELAY'] * 2 ** (item.attempts - 1)
+        item.next_attempt = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def send_pending(batch_size=None):
+    """Deliver one batch of due mail over a single SMTP connection.
+
+    Returns the number of mails handled. Delivery is at least once: a crash
+    between sending and the commit sends the batch again. The body of a sent
+    or failed mail is dropped with the same commit, only the log stays.
+    """
+    batch = _due(batch_size or current_app.config['OUTBOX_BATCH_SIZE'])
+    if not batch:
+        db.session.rollback()
+        return 0
+    handled = 0
+    try:
+        with mail.connect() as connection:
+            for item in batch:
+                try:
+                    connection.send(Message(item.subject, recipients=[item.recipient], body=item.body))
+                except _REJECTED as e:
+                    _retry(item, e)
+                else:
+                    item.status = MailStatus.sent
+                    item.sent = datetime.utcnow()
+                    item.last_error = None
+                    item.body = None
+                handled += 1
+    except (smtplib.SMTPException, OSError) as e:
+        current_app.logger.warning('smtp connection failed: %s', e)
+        for item in batch[handled:]:
+            _retry(item, e)
+    try:
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    return len(batch)
+
+
+def run(poll_interval=None):
+    """Drain the outbox forever, sleeping only when there was nothing left to send."""
+    poll_interval = poll_interval or current_app.config['OUTBOX_POLL_INTERVAL']
+    batch_size = current_app.config['OUTBOX_BATCH_SIZE']
+    while True:
+        if send_pending(batch_size) < batch_size:
+            time.sleep(poll_interval)
@@ -0,0 +1,56 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app
+from flask_restful import inputs
+from sqlalchemy import and_, or_
+
+
+def page_limit(limit):
+    """Clamp a client supplied ``limit`` to ``1..MAX_PAGE_SIZE``."""
+    if limit is None:
+        return current_app.config['PAGE_SIZE']
+    return max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+
+
+def encode_cursor(*values):
+    """Opaque ``next`` token carrying the keyset of the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Values packed by ``encode_cursor``, or None if the cursor is malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def add_page_arguments(parser):
+    """``limit``, ``cursor`` and the opt-in ``total`` query arguments."""
+    parser.add_argument('limit', type=int, location='args')
+    parser.add_argument('cursor', location='args')
+    parser.add_argument('total', type=inputs.boolean, location='args')
+
+
+def encode_keyset(timestamp, row_id):
+    """Cursor continuing after a row in (data_added, id) descending order."""
+    return encode_cursor(timestamp.isoformat(), row_id)
+
+
+def decode_keyset(cursor):
+    """The (data_added, id) packed by ``encode_keyset``, or None."""
+    values = decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(values[0]), int(values[1])
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def keyset_filter(time_column, id_column, keyset):
+    """Rows strictly after ``keyset`` when ordered by (time, id) descending."""
+    timestamp, row_id = keyset
+    return or_(time_column < timestamp,
+               and_(time_column == timestamp, id_column < row_id))
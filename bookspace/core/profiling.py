@@ -0,0 +1,106 @@
+import cProfile
+import os
+import random
+import re
+import time
+import uuid
+
+from flask import g, request, current_app
+from itsdangerous import TimestampSigner, BadSignature
+
+from bookspace.core import auth
+from bookspace.models import RolesChoices
+
+_SALT = 'bookspace-profile'
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _signer():
+    return TimestampSigner(current_app.config['SECRET_KEY'], salt=_SALT)
+
+
+def header_value(user_id):
+    """Value of the profiling header for an admin; it expires after PROFILE_HEADER_MAX_AGE."""
+    return _signer().sign(str(user_id)).decode('ascii')
+
+
+def _admin_asked():
+    value = request.headers.get(current_app.config['PROFILE_HEADER'])
+    if not value:
+        return False
+    try:
+        user_id = _signer().unsign(value, max_age=current_app.config['PROFILE_HEADER_MAX_AGE'])
+    except BadSignature:
+        return False
+    token = auth.get_token()
+    user = auth.resolve_token(token) if token else None
+    return user is not None and user.role is RolesChoices.admin and str(user.id) == user_id.decode()
+
+
+def _start():
+    rate = current_app.config['PROFILE_RATE']
+    if (rate and random.random() < rate) or \
+            (current_app.config['PROFILE_ADMIN_HEADER'] and _admin_asked()):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _tag(response):
+    if 'profiler' in g:
+        g.profile_file = _file_name()
+        response.headers['X-Profile-File'] = g.profile_file
+    return response
+
+
+def _finish(exception=None):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    profiler.disable()
+    directory = current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, g.pop('profile_file', None) or _file_name()))
+    _rotate(directory, current_app.config['PROFILE_MAX_FILES'], current_app.config['PROFILE_MAX_BYTES'])
+
+
+def _file_name():
+    """<time>-<endpoint>-<request id>.prof, the request id coming from the router when it sends one."""
+    request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+    endpoint = request.endpoint or 'unknown'
+    return _UNSAFE.sub('_', f'{time.time_ns()}-{endpoint}-{request_id}')[:200] + '.prof'
+
+
+def _rotate(directory, max_files, max_bytes):
+    """Delete the oldest dumps until at most ``max_files`` of at most ``max_bytes`` in total are left."""
+    dumps = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.prof'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            dumps.append((stat.st_mtime_ns, entry.path, stat.st_size))
+    dumps.sort(reverse=True)
+    total = 0
+    for count, (_, path, size) in enumerate(dumps, 1):
+        total += size
+        if count > max_files or total > max_bytes:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another worker rotated it already
+                pass
+
+
+def init_app(app):
+    """Profile a sampled share of requests, and the ones an admin asks for, into PROFILE_DIR.
+
+    Nothing is registered when both are turned off, so requests pay nothing
+    for it. The dumps are regular cProfile files: ``python -m pstats``,
+    snakeviz or flameprof read them.
+    """
+    if not app.config['PROFILE_RATE'] and not app.config['PROFILE_ADMIN_HEADER']:
+        return
+    app.before_request(_start)
+    app.after_request(_tag)
+    app.teardown_request(_finish)
@@ -0,0 +1,137 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_SPACES = re.compile(r'\s+')
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+# an IN list of any length: (?, ?), (%(id_1)s, %(id_2)s), (:a, :b)
+_PLACEHOLDERS = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+
+_listeners = []
+
+
+def shape(statement):
+    """The statement with literals and IN lists folded, so repeats of one query compare equal."""
+    statement = _SPACES.sub(' ', statement).strip()
+    statement = _STRINGS.sub('?', statement)
+    statement = _NUMBERS.sub('?', statement)
+    return _PLACEHOLDERS.sub('(...)', statement)
+
+
+class QueryStats(object):
+    """Queries run while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[shape(statement)] += 1
+
+    @property
+    def max_repeats(self):
+        return max(self.shapes.values(), default=0)
+
+    def top(self, n=3):
+        """The ``n`` most repeated statement shapes as (count, shape)."""
+        return [(count, statement) for statement, count in self.shapes.most_common(n)]
+
+
+def _current():
+    return g.get('query_stats') if has_app_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = _current()
+    if stats is not None:
+        stats.add(statement, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed(context):
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def _start():
+    g.query_stats = QueryStats()
+
+
+def _finish(response):
+    stats = g.pop('query_stats', None)
+    if stats is None:
+        return response
+    milliseconds = round(stats.duration * 1000, 2)
+    if current_app.debug:
+        response.headers['X-DB-Queries'] = str(stats.count)
+        response.headers['X-DB-Time'] = str(milliseconds)
+        response.headers['X-DB-Max-Repeats'] = str(stats.max_repeats)
+        response.headers['Server-Timing'] = f'db;dur={milliseconds};desc="{stats.count} queries"'
+    config = current_app.config
+    if stats.count > config['QUERY_LOG_COUNT'] or milliseconds > config['QUERY_LOG_TIME'] or \
+            stats.max_repeats > config['QUERY_LOG_REPEATS']:
+        current_app.logger.warning('%s %s: %s queries in %s ms, most repeated: %s',
+                                   request.method, request.path, stats.count, milliseconds, stats.top())
+    for listener in _listeners:
+        listener(request.method, request.path, stats)
+    return response
+
+
+def init_app(app):
+    app.before_request(_start)
+    app.after_request(_finish)
+
+
+@contextmanager
+def recording():
+    """Collect the (method, path, QueryStats) of every request finished inside the block."""
+    seen = []
+
+    def listener(method, path, stats):
+        seen.append((method, path, stats))
+
+    _listeners.append(listener)
+    try:
+        yield seen
+    finally:
+        _listeners.remove(listener)
+
+
+@contextmanager
+def query_budget(max_queries, max_repeats=None):
+    """Fail with ``AssertionError`` if a request made inside the block goes over budget.
+
+    ``max_repeats`` caps how often one statement shape may run per request,
+    which is how an N+1 loop shows up. Yields the list of
+    (method, path, QueryStats) of every request seen::
+
+        with query_budget(10, max_repeats=2):
+            client.get('/books/read')
+
+    In the test suite the ``query_budget`` mark puts a whole test under one.
+    """
+    with recording() as seen:
+        yield seen
+    for method, path, stats in seen:
+        assert stats.count <= max_queries, \
+            f'{method} {path} ran {stats.count} queries, budget is {max_queries}: {stats.top()}'
+        if max_repeats is not None:
+            assert stats.max_repeats <= max_repeats, \
+                f'{method} {path} repeated a statement {stats.max_repeats} times, ' \
+                f'budget is {max_repeats}: {stats.top(1)}'
@@ -0,0 +1,11 @@
+import re
+import unicodedata
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(value):
+    """Lower case, accent free, single spaced words."""
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return ' '.join(_WORD.findall(value.lower()))
@@ -0,0 +1,205 @@
+import bisect
+import heapq
+import math
+import os
+import struct
+from array import array
+from collections import Counter
+
+from bookspace.core.text import normalize
+
+# magic, documents, trigrams, size of the field blob, size of the trigram blob
+_HEADER = struct.Struct('<4sIIII')
+_MAGIC = b'BST1'
+_EMPTY = array('i')
+
+
+def trigrams(text):
+    """pg_trgm style trigrams: every word padded with two spaces in front, one behind."""
+    grams = set()
+    for word in text.split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def bounded_distance(a, b, bound):
+    """Levenshtein distance of ``a`` and ``b``, or ``bound + 1`` once it exceeds ``bound``."""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char != other)))
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return previous[-1]
+
+
+class TrigramIndex(object):
+    """Inverted trigram index for typo tolerant lookups over short text fields.
+
+    Documents are numbered in insertion order and every posting list is an
+    ``array('i')`` of those numbers, so lists stay sorted and compact. The
+    normalized fields of a document are a slice of one text blob.
+    """
+
+    def __init__(self, min_overlap=0.4, min_similarity=0.6, max_candidates=5000, max_rerank=100):
+        self.min_overlap = min_overlap
+        self.min_similarity = min_similarity
+        self.max_candidates = max_candidates
+        self.max_rerank = max_rerank
+        self.ids = array('i')
+        self.rates = array('f')
+        self.field_offsets = array('I', [0])
+        self.texts = bytearray()
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, doc_id, rate, *fields):
+        doc = len(self.ids)
+        fields = [normalize(field) for field in fields if field]
+        self.ids.append(doc_id)
+        self.rates.append(rate or 0)
+        self.texts += '\n'.join(fields).encode('utf-8')
+        self.field_offsets.append(len(self.texts))
+        for gram in trigrams(' '.join(fields)):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('i')
+            posting.append(doc)
+
+    def fields(self, doc):
+        text = bytes(self.texts[self.field_offsets[doc]:self.field_offsets[doc + 1]]).decode('utf-8')
+        return text.split('\n') if text else []
+
+    def posting(self, gram):
+        return self.postings.get(gram, _EMPTY)
+
+    def write(self, path):
+        """Replace the file at ``path`` with this index, for ``MappedTrigramIndex`` to read."""
+        grams = sorted((gram.encode('utf-8'), posting) for gram, posting in self.postings.items())
+        key_offsets, posting_offsets = array('I', [0]), array('I', [0])
+        keys, postings = bytearray(), array('i')
+        for key, posting in grams:
+            keys += key
+            postings.extend(posting)
+            key_offsets.append(len(keys))
+            posting_offsets.append(len(postings))
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, len(self.ids), len(grams), len(self.texts), len(keys)))
+            for part in (self.ids, self.rates, self.field_offsets, key_offsets, posting_offsets, postings):
+                part.tofile(file)
+            file.write(self.texts)
+            file.write(keys)
+        os.replace(tmp, path)
+        return len(self.ids)
+
+    def _candidates(self, grams):
+        """(shared trigrams, document) for documents sharing ``min_overlap`` of the query.
+
+        A document with ``m`` of ``t`` trigrams must appear in one of the
+        ``t - m + 1`` rarest posting lists, so only those are scanned; the
+        rest are checked by binary search.
+        """
+        needed = max(1, math.ceil(len(grams) * self.min_overlap))
+        lists = sorted((self.posting(gram) for gram in grams), key=len)
+        probe, rest = lists[:len(lists) - needed + 1], lists[len(lists) - needed + 1:]
+        hits = Counter()
+        for posting in probe:
+            hits.update(posting)
+        for doc, count in hits.most_common(self.max_candidates):
+            for posting in rest:
+                i = bisect.bisect_left(posting, doc)
+                count += i < len(posting) and posting[i] == doc
+            if count >= needed:
+                yield count, doc
+
+    def _similarity(self, query, doc):
+        """Best similarity of the query to any same-length word window of the document."""
+        words = query.split()
+        best = 0.0
+        for field in self.fields(doc):
+            field_words = field.split()
+            for start in range(max(1, len(field_words) - len(words) + 1)):
+                window = ' '.join(field_words[start:start + len(words)])
+                longest = max(len(query), len(window))
+                bound = int(longest * (1 - max(best, self.min_similarity)))
+                distance = bounded_distance(query, window, bound)
+                if distance <= bound:
+                    best = max(best, 1 - distance / longest)
+        return best
+
+    def search(self, text, limit):
+        """Up to ``limit`` (doc_id, similarity) pairs, most similar and best rated first."""
+        query = normalize(text)
+        grams = trigrams(query)
+        if not grams:
+            return []
+        # only the candidates sharing the most trigrams pay for an edit distance
+        scored = []
+        best = heapq.nlargest(self.max_rerank, self._candidates(grams),
+                              key=lambda item: (item[0], self.rates[item[1]]))
+        for _, doc in best:
+            similarity = self._similarity(query, doc)
+            if similarity >= self.min_similarity:
+                scored.append((similarity, self.rates[doc], self.ids[doc]))
+        scored.sort(reverse=True)
+        return [(doc_id, round(similarity, 3)) for similarity, _, doc_id in scored[:limit]]
+
+
+class _Keys(object):
+    """The sorted trigrams of a mapped index as a sequence ``bisect`` can search."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+
+class MappedTrigramIndex(TrigramIndex):
+    """A written ``TrigramIndex`` over a (memory mapped) buffer; searched in place, never added to."""
+
+    def __init__(self, buffer, **options):
+        super().__init__(**options)
+        magic, count, gram_count, text_size, key_size = _HEADER.unpack_from(buffer)
+        if magic != _MAGIC:
+            raise ValueError('not a trigram index')
+        view = memoryview(buffer)
+        pos = _HEADER.size
+
+        def take(size, fmt=None):
+            nonlocal pos
+            part = view[pos:pos + size]
+            pos += size
+            return part.cast(fmt) if fmt else part
+
+        self.ids = take(4 * count, 'i')
+        self.rates = take(4 * count, 'f')
+        self.field_offsets = take(4 * (count + 1), 'I')
+        key_offsets = take(4 * (gram_count + 1), 'I')
+        self.posting_offsets = take(4 * (gram_count + 1), 'I')
+        self.posting_data = take(4 * self.posting_offsets[-1], 'i')
+        self.texts = take(text_size)
+        self.keys = _Keys(key_offsets, take(key_size))
+
+    def add(self, doc_id, rate, *fields):
+        raise TypeError('a mapped trigram index is read only')
+
+    def posting(self, gram):
+        key = gram.encode('utf-8')
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return _EMPTY
+        return self.posting_data[self.posting_offsets[i]:self.posting_offsets[i + 1]]
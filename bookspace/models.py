@@ -1,11 +1,13 @@
 import enum
 from datetime import datetime
-from bookspace.core.app import db, app
+from flask import current_app
+
+from bookspace.core.app import db
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from itsdangerous import (TimedJSONWebSignatureSerializer
                           as Serializer, BadSignature, SignatureExpired)
-from hashlib import md5
+from hashlib import md5, sha256
 
 
 class ListChoices(enum.Enum):
@@ -19,6 +21,12 @@ class RolesChoices(enum.Enum):
     user = 'user'
 
 
+class MailStatus(enum.Enum):
+    pending = 'pending'
+    sent = 'sent'
+    failed = 'failed'
+
+
 class User(db.Model):
 
     __tablename__ = 'user'
@@ -27,7 +35,7 @@ class User(db.Model):
     email = db.Column(db.String(64), index=True, unique=True)
     username = db.Column(db.String(64), index=True, unique=False)
     password = db.Column(db.String(128))
-    image = db.Column(db.LargeBinary)
+    image_hash = db.Column(db.String(64), db.ForeignKey('images.hash'), nullable=True)
     role = db.Column(db.Enum(RolesChoices), server_default=RolesChoices.user.value)
     quote = db.Column(db.String(128), nullable=True)
 
@@ -52,7 +60,7 @@ class User(db.Model):
         return f'<User {self.email}>'
 
     def generate_auth_token(self, expiration=None):
-        s = Serializer(app.config['SECRET_KEY'], expires_in=expiration)
+        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
         return s.dumps({'id': self.id, 'username': self.username})
 
     def avatar(self, size=100):
@@ -62,16 +70,53 @@ class User(db.Model):
 
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(app.config['SECRET_KEY'])
+        s = Serializer(current_app.config['SECRET_KEY'])
         try:
-            data = s.loads(token)
+            data, header = s.loads(token, return_header=True)
         except SignatureExpired:
             return None  # valid token, but expired
         except BadSignature:
             return None  # invalid token
         user_id = data['id']
         username = data['username']
-        return {'user_id': user_id, 'username': username}
+        return {'user_id': user_id, 'username': username,
+                'expires': header.get('exp')}
+
+
+class Images(db.Model):
+    """Content addressed image store; rows are shared by every user with the same image."""
+
+    __tablename__ = 'images'
+
+    hash = db.Column(db.String(64), primary_key=True)
+    content_type = db.Column(db.String(32), default='image/png')
+    size = db.Column(db.Integer)
+    data = db.deferred(db.Column(db.LargeBinary))
+
+    def repr(self):
+        return f'<Images {self.hash}>'
+
+    @staticmethod
+    def store(data, content_type='image/png'):
+        """Add ``data`` unless an identical image is stored already; returns its hash."""
+        digest = sha256(data).hexdigest()
+        if db.session.query(Images.hash).filter_by(hash=digest).first() is None:
+            db.session.add(Images(hash=digest, content_type=content_type,
+                                  size=len(data), data=data))
+        return digest
+
+
+class ImageVariants(db.Model):
+    """Resized renditions of an uploaded avatar, keyed by the hash of the largest one."""
+
+    __tablename__ = 'image_variants'
+
+    image_hash = db.Column(db.String(64), db.ForeignKey('images.hash'), primary_key=True)
+    size = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    variant_hash = db.Column(db.String(64), db.ForeignKey('images.hash'), nullable=False)
+
+    def repr(self):
+        return f'<ImageVariants {self.image_hash} {self.size}>'
 
 
 class Books(db.Model):
@@ -84,14 +129,90 @@ class Books(db.Model):
     genre = db.Column(db.String(64))
     pages = db.Column(db.Integer)
     rate = db.Column(db.Float(), default=0)
+    rate_sum = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rate_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    stars_1 = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    stars_2 = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    stars_3 = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    stars_4 = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    stars_5 = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    reviews_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     def repr(self):
         return f'<Books {self.title}>'
 
+    @staticmethod
+    def star_column(rate):
+        return getattr(Books, f'stars_{rate}')
+
+    @staticmethod
+    def apply_rating(book_id, old_rate, new_rate):
+        """Move one user's rating of a book from ``old_rate`` to ``new_rate``.
+
+        Rates are 1-5, 0 meaning "not rated". The aggregates and the average
+        are updated by a single UPDATE relative to the stored values, so the
+        cost doesn't depend on the number of ratings and concurrent raters
+        don't overwrite each other.
+        """
+        old_rate, new_rate = old_rate or 0, new_rate or 0
+        if old_rate == new_rate:
+            return
+        rate_sum = Books.rate_sum + (new_rate - old_rate)
+        rate_count = Books.rate_count + (int(new_rate > 0) - int(old_rate > 0))
+        values = {
+            Books.rate_sum: rate_sum,
+            Books.rate_count: rate_count,
+            Books.rate: db.case(
+                [(rate_count > 0,
+                  db.func.round(db.cast(rate_sum, db.Float) * 100 / rate_count) / 100)],
+                else_=0),
+        }
+        if 1 <= old_rate <= 5:
+            values[Books.star_column(old_rate)] = Books.star_column(old_rate) - 1
+        if 1 <= new_rate <= 5:
+            values[Books.star_column(new_rate)] = Books.star_column(new_rate) + 1
+        Books.query.filter_by(id=book_id).update(values, synchronize_session=False)
+
+
+# rankings order by rate descending with the id as tie breaker, overall and per author/genre
+db.Index('ix_books_rate_id', Books.rate.desc(), Books.id)
+db.Index('ix_books_author_rate_id', Books.author, Books.rate.desc(), Books.id)
+db.Index('ix_books_genre_rate_id', Books.genre, Books.rate.desc(), Books.id)
+
+
+class BookSimilar(db.Model):
+
+    __tablename__ = 'book_similar'
+
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True)
+    position = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    similar_id = db.Column(db.Integer, db.ForeignKey('books.id'), index=True)
+
+    def repr(self):
+        return f'<BookSimilar {self.book_id} #{self.position}>'
+
+
+class BookSimilarChanges(db.Model):
+    """Books whose rate, author or genre changed since ``flask build-similar --refresh`` last ran.
+
+    Writes only ever append, so concurrent changes of one book never collide.
+    """
+
+    __tablename__ = 'book_similar_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
+
+    def repr(self):
+        return f'<BookSimilarChanges {self.book_id}>'
+
 
 class Notes(db.Model):
 
     __tablename__ = 'notes'
+    __table_args__ = (
+        db.Index('ix_notes_books_id_user_id_data_added', 'books_id', 'user_id', 'data_added', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -107,6 +228,10 @@ class Notes(db.Model):
 class Reviews(db.Model):
 
     __tablename__ = 'reviews'
+    __table_args__ = (
+        db.Index('ix_reviews_books_id_data_added', 'books_id', 'data_added', 'id'),
+        db.Index('uq_reviews_user_id_books_id', 'user_id', 'books_id', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -126,6 +251,12 @@ class Reviews(db.Model):
 class UsersBooks(db.Model):
 
     __tablename__ = 'user_books'
+    __table_args__ = (
+        db.Index('ix_user_books_user_id_data_added', 'user_id', 'data_added', 'id'),
+        db.Index('ix_user_books_user_id_list_data_added', 'user_id', 'list', 'data_added', 'id'),
+        db.Index('uq_user_books_user_id_books_id', 'user_id', 'books_id', unique=True),
+        db.Index('ix_user_books_books_id', 'books_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -141,21 +272,122 @@ class UsersBooks(db.Model):
 class Stats(db.Model):
 
     __tablename__ = 'stats'
+    __table_args__ = (
+        db.Index('ix_stats_user_id', 'user_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     week = db.Column(db.Integer, default=0)
     month = db.Column(db.Integer, default=0)
     year = db.Column(db.Integer, default=0)
+    done_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    progress_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    future_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    pages_read = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     def repr(self):
         return f'<Stats of {self.user_id} user>'
 
+    @staticmethod
+    def shelf_column(shelf):
+        """Counter column of a shelf given as ``ListChoices`` or its name."""
+        if isinstance(shelf, str):
+            shelf = ListChoices[shelf]
+        return {ListChoices.DN: Stats.done_count,
+                ListChoices.IP: Stats.progress_count,
+                ListChoices.WR: Stats.future_count}[shelf]
+
+    @staticmethod
+    def move_shelf(user_id, old_shelf, new_shelf, pages=None):
+        """Move one book between the user's shelf counters; None means no shelf.
+
+        ``pages`` of the book are added to ``pages_read`` when it lands on the
+        done shelf and taken back when it leaves it.
+        """
+        values = {}
+        if old_shelf is not None:
+            values[Stats.shelf_column(old_shelf)] = Stats.shelf_column(old_shelf) - 1
+        if new_shelf is not None:
+            column = Stats.shelf_column(new_shelf)
+            values[column] = values.get(column, column) + 1
+        done = Stats.shelf_column(ListChoices.DN)
+        read = (new_shelf is not None and Stats.shelf_column(new_shelf) is done) - \
+            (old_shelf is not None and Stats.shelf_column(old_shelf) is done)
+        if read and pages:
+            values[Stats.pages_read] = Stats.pages_read + read * pages
+        if values:
+            Stats.query.filter_by(user_id=user_id).update(values, synchronize_session=False)
+
+
+class ReadingRollup(db.Model):
+    """Books finished per user, day, author and genre.
+
+    Writes only ever append +1/-1 rows; ``flask compact-reading`` folds
+    the rows of each key together, so a range is answered from a handful
+    of rows per day no matter how long the user's history is.
+    """
+
+    __tablename__ = 'reading_rollup'
+    __table_args__ = (
+        db.Index('ix_reading_rollup_user_id_day', 'user_id', 'day'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    author = db.Column(db.String(128))
+    genre = db.Column(db.String(64))
+    books = db.Column(db.Integer, nullable=False)
+    pages = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    def repr(self):
+        return f'<ReadingRollup of {self.user_id} user on {self.day}>'
+
+    @staticmethod
+    def record(user_id, added, book, old_shelf, new_shelf):
+        """Count ``book`` in or out of the day it was added once it enters or leaves the done shelf."""
+        delta = (new_shelf in ('DN', ListChoices.DN)) - (old_shelf in ('DN', ListChoices.DN))
+        if delta:
+            day = (added or datetime.utcnow()).date()
+            db.session.add(ReadingRollup(user_id=user_id, day=day, author=book.author, genre=book.genre,
+                                         books=delta, pages=delta * (book.pages or 0)))
+
 
 class Tokens(db.Model):
 
     __tablename__ = 'tokens'
+    __table_args__ = (
+        db.Index('ix_tokens_user_id', 'user_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String, unique=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+
+class Outbox(db.Model):
+    """Mail waiting for the background sender, kept afterwards as a delivery log.
+
+    ``body`` is cleared once the mail is sent or given up on, it may hold a password.
+    """
+
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        db.Index('ix_outbox_status_next_attempt', 'status', 'next_attempt'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(128), nullable=False)
+    subject = db.Column(db.String(256), nullable=False)
+    body = db.Column(db.Text)
+    status = db.Column(db.Enum(MailStatus), nullable=False, default=MailStatus.pending,
+                       server_default=MailStatus.pending.value)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.String(512))
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    sent = db.Column(db.DateTime)
+
+    def repr(self):
+        return f'<Outbox {self.id} {self.status.name}>'
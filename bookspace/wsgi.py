@@ -0,0 +1,3 @@
+from bookspace.core.app import create_app
+
+app = create_app()
@@ -1,12 +1,97 @@
+import os
+import tempfile
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
 class Config(object):
     DEBUG = True
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     TESTING = False
     CSRF_ENABLED = False
-    SECRET_KEY = 'very-secret-key-ur-welcome'
-    MAIL_SERVER = 'smtp.gmail.com'
-    MAIL_PORT = 587
-    MAIL_USE_TLS = True
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'very-secret-key-ur-welcome')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+                                             'sqlite:///' + os.path.join(basedir, 'bookspace.db'))
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+    # milliseconds, postgres only; 0 turns it off
+    DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 30000))
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '1') == '1'
     MAIL_USE_SSL = False
-    MAIL_USERNAME = 'bookspaceadm@gmail.com'
-    MAIL_PASSWORD = 'pfavtmxfwnuyntcn'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME', 'bookspaceadm@gmail.com')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD', 'pfavtmxfwnuyntcn')
     MAIL_DEFAULT_SENDER = "bookspace@admin.com"
+    AUTH_CACHE_SIZE = 4096
+    AUTH_CACHE_TTL = 300
+    # logouts every worker of the host reads before trusting its token cache; one file per host
+    AUTH_REVOKED_FILE = os.environ.get('AUTH_REVOKED_FILE', os.path.join(tempfile.gettempdir(), 'bookspace-revoked'))
+    AUTH_REVOKED_MAX_BYTES = 1 << 20
+    SIMILAR_BOOKS_TOP = 5
+    LEADERBOARD_SIZE = 20
+    LEADERBOARD_MAX_AGE = 60
+    LEADERBOARD_VERSION_FILE = os.path.join(tempfile.gettempdir(), 'bookspace-leaderboard.version')
+    PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    SEARCH_COUNT_CAP = 1000
+    # best matches a search pages through; every match is scored, only these are kept
+    SEARCH_CANDIDATES = 1000
+    # a shorter last search term matches whole words only, not every word it starts
+    SEARCH_MIN_PREFIX = 3
+    SUGGEST_SNAPSHOT = os.path.join(tempfile.gettempdir(), 'bookspace-suggest.idx')
+    SUGGEST_LIMIT = 10
+    FUZZY_INDEX_FILE = os.path.join(tempfile.gettempdir(), 'bookspace-fuzzy.idx')
+    USERNAME_CACHE_SIZE = 10000
+    USERNAME_CACHE_TTL = 300
+    AVATAR_MAX_AGE = 0
+    AVATAR_SIZES = (64, 128, 512)
+    AVATAR_FORMAT = 'WEBP'
+    AVATAR_MAX_BYTES = 5 * 1024 * 1024
+    AVATAR_MAX_PIXELS = 40000000
+    AVATAR_WORKERS = 2
+    # base64 of the largest avatar plus some room for the rest of the form
+    MAX_CONTENT_LENGTH = 8 * 1024 * 1024
+    OUTBOX_BATCH_SIZE = 50
+    OUTBOX_POLL_INTERVAL = 5
+    OUTBOX_MAX_ATTEMPTS = 8
+    # first retry after this many seconds, doubling with every further attempt
+    OUTBOX_RETRY_DELAY = 30
+    TIMELINE_MAX_BUCKETS = 1000
+    # requests going over any of these are logged with their most repeated statements
+    QUERY_LOG_COUNT = 30
+    QUERY_LOG_TIME = 500
+    QUERY_LOG_REPEATS = 5
+    # share of requests run under cProfile, 0-1; admins can ask for one with a
+    # header from ``flask profile-header`` when PROFILE_ADMIN_HEADER is on
+    PROFILE_RATE = float(os.environ.get('PROFILE_RATE', 0))
+    PROFILE_ADMIN_HEADER = os.environ.get('PROFILE_ADMIN_HEADER', '0') == '1'
+    PROFILE_HEADER = 'X-Profile'
+    PROFILE_HEADER_MAX_AGE = 3600
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'bookspace-profiles'))
+    # the oldest dumps are deleted beyond either limit
+    PROFILE_MAX_FILES = 200
+    PROFILE_MAX_BYTES = 100 * 1024 * 1024
+    # every worker process writes its request metrics here, /metrics adds them up
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'bookspace-metrics'))
+    # upper bounds of the latency histogram buckets, seconds
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    # item-to-item neighbours of /home/rec, written by ``flask build-recommendations``
+    REC_NEIGHBOURS_FILE = os.environ.get('REC_NEIGHBOURS_FILE',
+                                         os.path.join(tempfile.gettempdir(), 'bookspace-rec.nbr'))
+    REC_TOP_K = 50
+    # 0.5 is the cosine; lower lets popular books rank higher as neighbours
+    REC_ALPHA = 0.2
+    # books whose similarities are computed at once; bounds the memory of a build
+    REC_BLOCK_SIZE = 1024
+    REC_LIMIT = 20
+    # title/author/genre neighbours of a book, written by ``flask build-content-similar``
+    CONTENT_NEIGHBOURS_FILE = os.environ.get('CONTENT_NEIGHBOURS_FILE',
+                                             os.path.join(tempfile.gettempdir(), 'bookspace-content.nbr'))
+    CONTENT_TOP_K = 10
+    # books compared per feature of a book; more finds neighbours closer to the exact ones
+    CONTENT_CANDIDATES = 500
+    CONTENT_BLOCK_SIZE = 256
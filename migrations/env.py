@@ -32,6 +32,14 @@ target_metadata = current_app.extensions['migrate'].db.metadata
 # ... etc.
 
 
+# full text search objects maintained by hand in migrations, not by the models
+_UNMANAGED = ('search_vector', 'ix_books_search_vector', 'books_fts')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return not (reflected and name and name.startswith(_UNMANAGED))
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -46,7 +54,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -82,6 +91,9 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
+            # a migration may build indexes outside its transaction, everything before it must be committed
+            transaction_per_migration=True,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,31 @@
+"""image variants
+
+Revision ID: 00e728d22938
+Revises: b9cd861be3b4
+Create Date: 2026-10-18 18:02:11.513370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '00e728d22938'
+down_revision = 'b9cd861be3b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image_variants',
+    sa.Column('image_hash', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('variant_hash', sa.String(length=64), nullable=False),
+    sa.ForeignKeyConstraint(['image_hash'], ['images.hash'], ),
+    sa.ForeignKeyConstraint(['variant_hash'], ['images.hash'], ),
+    sa.PrimaryKeyConstraint('image_hash', 'size')
+    )
+
+
+def downgrade():
+    op.drop_table('image_variants')
@@ -0,0 +1,82 @@
+"""books full text search
+
+Revision ID: 0d433f7acad3
+Revises: bc603fb68360
+Create Date: 2026-10-18 12:40:53.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d433f7acad3'
+down_revision = 'bc603fb68360'
+branch_labels = None
+depends_on = None
+
+_PG_VECTOR = """
+    setweight(to_tsvector('simple', coalesce({0}title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce({0}author, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce({0}genre, '')), 'C')
+"""
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('ALTER TABLE books ADD COLUMN search_vector tsvector')
+        op.execute('UPDATE books SET search_vector = ' + _PG_VECTOR.format(''))
+        op.execute('CREATE INDEX ix_books_search_vector ON books USING GIN (search_vector)')
+        op.execute("""
+            CREATE FUNCTION books_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := """ + _PG_VECTOR.format('NEW.') + """;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        op.execute("""
+            CREATE TRIGGER books_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF title, author, genre ON books
+            FOR EACH ROW EXECUTE PROCEDURE books_search_vector_update()
+        """)
+    elif dialect == 'sqlite':
+        op.execute("""
+            CREATE VIRTUAL TABLE books_fts USING fts5(
+                title, author, genre, content='books', content_rowid='id')
+        """)
+        op.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+        op.execute("""
+            CREATE TRIGGER books_fts_insert AFTER INSERT ON books BEGIN
+                INSERT INTO books_fts(rowid, title, author, genre)
+                VALUES (new.id, new.title, new.author, new.genre);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER books_fts_delete AFTER DELETE ON books BEGIN
+                INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+                VALUES ('delete', old.id, old.title, old.author, old.genre);
+            END
+        """)
+        op.execute("""
+            CREATE TRIGGER books_fts_update AFTER UPDATE OF title, author, genre ON books BEGIN
+                INSERT INTO books_fts(books_fts, rowid, title, author, genre)
+                VALUES ('delete', old.id, old.title, old.author, old.genre);
+                INSERT INTO books_fts(rowid, title, author, genre)
+                VALUES (new.id, new.title, new.author, new.genre);
+            END
+        """)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP TRIGGER books_search_vector_trigger ON books')
+        op.execute('DROP FUNCTION books_search_vector_update()')
+        op.execute('DROP INDEX ix_books_search_vector')
+        op.execute('ALTER TABLE books DROP COLUMN search_vector')
+    elif dialect == 'sqlite':
+        for trigger in ('books_fts_insert', 'books_fts_delete', 'books_fts_update'):
+            op.execute(f'DROP TRIGGER {trigger}')
+        op.execute('DROP TABLE books_fts')
@@ -0,0 +1,41 @@
+"""mail outbox
+
+Revision ID: 120f5d92f2ba
+Revises: 00e728d22938
+Create Date: 2026-10-18 18:47:30.220861
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '120f5d92f2ba'
+down_revision = '00e728d22938'
+branch_labels = None
+depends_on = None
+
+mail_status = sa.Enum('pending', 'sent', 'failed', name='mailstatus')
+
+
+def upgrade():
+    op.create_table('outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipient', sa.String(length=128), nullable=False),
+    sa.Column('subject', sa.String(length=256), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('status', mail_status, server_default='pending', nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('next_attempt', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.String(length=512), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=True),
+    sa.Column('sent', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_outbox_status_next_attempt', 'outbox', ['status', 'next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_outbox_status_next_attempt', table_name='outbox')
+    op.drop_table('outbox')
+    mail_status.drop(op.get_bind(), checkfirst=True)
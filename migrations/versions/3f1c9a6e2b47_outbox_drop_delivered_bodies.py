@@ -0,0 +1,30 @@
+"""outbox drop delivered bodies
+
+Revision ID: 3f1c9a6e2b47
+Revises: 6b8a8f1adbc3
+Create Date: 2026-10-18 21:02:16.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a6e2b47'
+down_revision = '6b8a8f1adbc3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # batch mode so sqlite, which can't ALTER a column, gets the table rebuilt
+    with op.batch_alter_table('outbox') as batch_op:
+        batch_op.alter_column('body', existing_type=sa.Text(), nullable=True)
+    # bodies carry plaintext passwords; keep only the delivery log of handled mail
+    op.execute("UPDATE outbox SET body = NULL WHERE status != 'pending'")
+
+
+def downgrade():
+    op.execute("UPDATE outbox SET body = '' WHERE body IS NULL")
+    with op.batch_alter_table('outbox') as batch_op:
+        batch_op.alter_column('body', existing_type=sa.Text(), nullable=False)
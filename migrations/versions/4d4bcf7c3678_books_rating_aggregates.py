@@ -0,0 +1,47 @@
+"""books rating aggregates
+
+Revision ID: 4d4bcf7c3678
+Revises: d800277ba954
+Create Date: 2026-10-18 10:12:41.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d4bcf7c3678'
+down_revision = 'd800277ba954'
+branch_labels = None
+depends_on = None
+
+_COLUMNS = ['rate_sum', 'rate_count', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5']
+
+
+def upgrade():
+    for column in _COLUMNS:
+        op.add_column('books', sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+
+    # backfill from the existing ratings; 0 means "shelved but not rated"
+    op.execute("""
+        UPDATE books SET
+            rate_sum = (SELECT COALESCE(SUM(ub.rate), 0) FROM user_books ub
+                        WHERE ub.books_id = books.id AND ub.rate > 0),
+            rate_count = (SELECT COUNT(*) FROM user_books ub
+                          WHERE ub.books_id = books.id AND ub.rate > 0),
+            stars_1 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 1),
+            stars_2 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 2),
+            stars_3 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 3),
+            stars_4 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 4),
+            stars_5 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 5)
+    """)
+    op.execute("""
+        UPDATE books SET rate = CASE WHEN rate_count > 0
+            THEN ROUND(CAST(rate_sum AS FLOAT) * 100 / rate_count) / 100
+            ELSE 0 END
+    """)
+
+
+def downgrade():
+    for column in reversed(_COLUMNS):
+        op.drop_column('books', column)
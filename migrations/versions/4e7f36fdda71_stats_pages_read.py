@@ -0,0 +1,30 @@
+"""stats pages read
+
+Revision ID: 4e7f36fdda71
+Revises: 120f5d92f2ba
+Create Date: 2026-10-18 19:12:54.601392
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7f36fdda71'
+down_revision = '120f5d92f2ba'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('stats', sa.Column('pages_read', sa.Integer(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE stats SET pages_read =
+            (SELECT COALESCE(SUM(books.pages), 0) FROM user_books
+             JOIN books ON books.id = user_books.books_id
+             WHERE user_books.user_id = stats.user_id AND user_books.list = 'DN')
+    """)
+
+
+def downgrade():
+    op.drop_column('stats', 'pages_read')
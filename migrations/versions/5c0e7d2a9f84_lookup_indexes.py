@@ -0,0 +1,63 @@
+"""lookup indexes
+
+Built with CREATE INDEX CONCURRENTLY on postgres so the release phase
+doesn't lock the tables for writes. That refuses to run in a transaction
+block, so the indexes are built on an autocommit connection of their own;
+env.py commits every migration separately, so the earlier ones are done.
+A rerun after a failed build drops the INVALID index it leaves behind.
+
+Revision ID: 5c0e7d2a9f84
+Revises: 9d2e4b7c1a05
+Create Date: 2026-10-18 22:41:07.385219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c0e7d2a9f84'
+down_revision = '9d2e4b7c1a05'
+branch_labels = None
+depends_on = None
+
+# name, table, columns, unique
+_INDEXES = [
+    ('uq_user_books_user_id_books_id', 'user_books', 'user_id, books_id', True),
+    ('uq_reviews_user_id_books_id', 'reviews', 'user_id, books_id', True),
+    ('ix_user_books_books_id', 'user_books', 'books_id', False),
+    ('ix_tokens_user_id', 'tokens', 'user_id', False),
+    ('ix_stats_user_id', 'stats', 'user_id', False),
+    ('ix_books_rate_id', 'books', 'rate DESC, id', False),
+    ('ix_books_author_rate_id', 'books', 'author, rate DESC, id', False),
+    ('ix_books_genre_rate_id', 'books', 'genre, rate DESC, id', False),
+]
+
+_INVALID = sa.text("""
+    SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+    WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+""")
+
+
+def _create(execute, concurrently):
+    for name, table, columns, unique in _INDEXES:
+        execute(f'CREATE {"UNIQUE " if unique else ""}INDEX {"CONCURRENTLY " if concurrently else ""}'
+                f'IF NOT EXISTS {name} ON {table} ({columns})')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        _create(op.execute, concurrently=False)
+        return
+    with bind.engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        for name, _, _, _ in _INDEXES:
+            if connection.execute(_INVALID, name=name).first() is not None:
+                connection.execute(f'DROP INDEX CONCURRENTLY {name}')
+        _create(connection.execute, concurrently=True)
+
+
+def downgrade():
+    for name, table, _, _ in reversed(_INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,115 @@
+"""unique user/book pairs
+
+Drops the duplicated pairs the unique indexes of 5c0e7d2a9f84 would not
+build over; the indexes are built there, outside a transaction.
+
+Revision ID: 6b8a8f1adbc3
+Revises: e79b9f127630
+Create Date: 2026-10-18 20:05:43.390128
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b8a8f1adbc3'
+down_revision = 'e79b9f127630'
+branch_labels = None
+depends_on = None
+
+_SHELVES = [('done_count', 'DN'), ('progress_count', 'IP'), ('future_count', 'WR')]
+_CHUNK = 500
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), _CHUNK):
+        yield {'ids': ids[start:start + _CHUNK]}
+
+
+def _execute(sql, ids):
+    """Run ``sql`` once per chunk of ``ids``, bound to its ``:ids`` list."""
+    statement = sa.text(sql).bindparams(sa.bindparam('ids', expanding=True))
+    for params in _chunks(ids):
+        op.get_bind().execute(statement, **params)
+
+
+def _recount(users, books):
+    """Recompute what the deleted user_books rows were still counted in.
+
+    The same backfills as the migrations that added these aggregates,
+    limited to the users and books that had duplicated pairs.
+    """
+    _execute("""
+        UPDATE books SET
+            rate_sum = (SELECT COALESCE(SUM(ub.rate), 0) FROM user_books ub
+                        WHERE ub.books_id = books.id AND ub.rate > 0),
+            rate_count = (SELECT COUNT(*) FROM user_books ub
+                          WHERE ub.books_id = books.id AND ub.rate > 0),
+            stars_1 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 1),
+            stars_2 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 2),
+            stars_3 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 3),
+            stars_4 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 4),
+            stars_5 = (SELECT COUNT(*) FROM user_books ub WHERE ub.books_id = books.id AND ub.rate = 5)
+        WHERE id IN :ids
+    """, books)
+    _execute("""
+        UPDATE books SET rate = CASE WHEN rate_count > 0
+            THEN ROUND(CAST(rate_sum AS FLOAT) * 100 / rate_count) / 100
+            ELSE 0 END
+        WHERE id IN :ids
+    """, books)
+    for column, shelf in _SHELVES:
+        _execute(f"""
+            UPDATE stats SET {column} =
+                (SELECT COUNT(*) FROM user_books
+                 WHERE user_books.user_id = stats.user_id AND user_books.list = '{shelf}')
+            WHERE user_id IN :ids
+        """, users)
+    _execute("""
+        UPDATE stats SET pages_read =
+            (SELECT COALESCE(SUM(books.pages), 0) FROM user_books
+             JOIN books ON books.id = user_books.books_id
+             WHERE user_books.user_id = stats.user_id AND user_books.list = 'DN')
+        WHERE user_id IN :ids
+    """, users)
+    # rebuilt already compacted, like the migration that created the rollup
+    _execute('DELETE FROM reading_rollup WHERE user_id IN :ids', users)
+    _execute("""
+        INSERT INTO reading_rollup (user_id, day, author, genre, books, pages)
+        SELECT user_books.user_id, DATE(user_books.data_added), books.author, books.genre,
+               COUNT(*), COALESCE(SUM(books.pages), 0)
+        FROM user_books JOIN books ON books.id = user_books.books_id
+        WHERE user_books.list = 'DN' AND user_books.data_added IS NOT NULL
+              AND user_books.user_id IN :ids
+        GROUP BY user_books.user_id, DATE(user_books.data_added), books.author, books.genre
+    """, users)
+
+
+def upgrade():
+    duplicated = op.get_bind().execute(sa.text("""
+        SELECT user_id, books_id FROM user_books
+        WHERE user_id IS NOT NULL AND books_id IS NOT NULL
+        GROUP BY user_id, books_id HAVING COUNT(*) > 1
+    """)).fetchall()
+
+    # keep the newest row of every duplicated pair, the unique indexes would not build otherwise
+    for table in ('user_books', 'reviews'):
+        op.execute(f"""
+            DELETE FROM {table}
+            WHERE user_id IS NOT NULL AND books_id IS NOT NULL AND id NOT IN
+                (SELECT MAX(id) FROM {table}
+                 WHERE user_id IS NOT NULL AND books_id IS NOT NULL
+                 GROUP BY user_id, books_id)
+        """)
+    if duplicated:
+        _recount({user_id for user_id, _ in duplicated}, {books_id for _, books_id in duplicated})
+    op.execute("""
+        UPDATE books SET reviews_count =
+            (SELECT COUNT(*) FROM reviews WHERE reviews.books_id = books.id)
+    """)
+
+
+def downgrade():
+    pass
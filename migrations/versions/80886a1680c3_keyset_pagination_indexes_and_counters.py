@@ -0,0 +1,54 @@
+"""keyset pagination indexes and counters
+
+Revision ID: 80886a1680c3
+Revises: 0d433f7acad3
+Create Date: 2026-10-18 15:48:06.327410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '80886a1680c3'
+down_revision = '0d433f7acad3'
+branch_labels = None
+depends_on = None
+
+_SHELVES = [('done_count', 'DN'), ('progress_count', 'IP'), ('future_count', 'WR')]
+
+
+def upgrade():
+    op.create_index('ix_user_books_user_id_data_added', 'user_books',
+                    ['user_id', 'data_added', 'id'], unique=False)
+    op.create_index('ix_user_books_user_id_list_data_added', 'user_books',
+                    ['user_id', 'list', 'data_added', 'id'], unique=False)
+    op.create_index('ix_reviews_books_id_data_added', 'reviews',
+                    ['books_id', 'data_added', 'id'], unique=False)
+    op.create_index('ix_notes_books_id_user_id_data_added', 'notes',
+                    ['books_id', 'user_id', 'data_added', 'id'], unique=False)
+
+    op.add_column('books', sa.Column('reviews_count', sa.Integer(), server_default='0', nullable=False))
+    for column, _ in _SHELVES:
+        op.add_column('stats', sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+
+    op.execute("""
+        UPDATE books SET reviews_count =
+            (SELECT COUNT(*) FROM reviews WHERE reviews.books_id = books.id)
+    """)
+    for column, shelf in _SHELVES:
+        op.execute(f"""
+            UPDATE stats SET {column} =
+                (SELECT COUNT(*) FROM user_books
+                 WHERE user_books.user_id = stats.user_id AND user_books.list = '{shelf}')
+        """)
+
+
+def downgrade():
+    for column, _ in reversed(_SHELVES):
+        op.drop_column('stats', column)
+    op.drop_column('books', 'reviews_count')
+    op.drop_index('ix_notes_books_id_user_id_data_added', table_name='notes')
+    op.drop_index('ix_reviews_books_id_data_added', table_name='reviews')
+    op.drop_index('ix_user_books_user_id_list_data_added', table_name='user_books')
+    op.drop_index('ix_user_books_user_id_data_added', table_name='user_books')
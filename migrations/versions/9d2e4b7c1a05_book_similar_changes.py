@@ -0,0 +1,29 @@
+"""book similar changes
+
+Revision ID: 9d2e4b7c1a05
+Revises: 3f1c9a6e2b47
+Create Date: 2026-10-18 22:14:51.602318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e4b7c1a05'
+down_revision = '3f1c9a6e2b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('book_similar_changes',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['book_id'], ['books.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('book_similar_changes')
@@ -0,0 +1,84 @@
+"""move avatars to images
+
+Revision ID: b9cd861be3b4
+Revises: 80886a1680c3
+Create Date: 2026-10-18 16:21:37.904158
+
+"""
+import sys
+from hashlib import sha256
+
+from alembic import op
+import sqlalchemy as sa
+
+from bookspace.core import imaging
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9cd861be3b4'
+down_revision = '80886a1680c3'
+branch_labels = None
+depends_on = None
+
+_BATCH = 500
+
+
+def _content_type(data):
+    """Type of an old upload, read from its header like new uploads; any image was accepted then."""
+    try:
+        image_format, _, _ = imaging.probe(data, sys.maxsize)
+    except ValueError:
+        return 'application/octet-stream'
+    return imaging.content_type(image_format)
+
+
+def upgrade():
+    op.create_table('images',
+    sa.Column('hash', sa.String(length=64), nullable=False),
+    sa.Column('content_type', sa.String(length=32), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('data', sa.LargeBinary(), nullable=True),
+    sa.PrimaryKeyConstraint('hash')
+    )
+    # batch mode so sqlite, which can't ALTER constraints, gets the table rebuilt
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('image_hash', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('user_image_hash_fkey', 'images', ['image_hash'], ['hash'])
+
+    # move the blobs over in id order, a batch at a time, storing each distinct image once
+    connection = op.get_bind()
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('image', sa.LargeBinary),
+                    sa.column('image_hash', sa.String))
+    images = sa.table('images', sa.column('hash', sa.String), sa.column('content_type', sa.String),
+                      sa.column('size', sa.Integer), sa.column('data', sa.LargeBinary))
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([user.c.id, user.c.image]).
+            where(sa.and_(user.c.id > last_id, user.c.image.isnot(None))).
+            order_by(user.c.id).limit(_BATCH)).fetchall()
+        if not rows:
+            break
+        for user_id, data in rows:
+            digest = sha256(data).hexdigest()
+            exists = connection.execute(
+                sa.select([images.c.hash]).where(images.c.hash == digest)).first()
+            if exists is None:
+                connection.execute(images.insert().values(
+                    hash=digest, content_type=_content_type(data), size=len(data), data=data))
+            connection.execute(user.update().where(user.c.id == user_id).values(image_hash=digest))
+        last_id = rows[-1][0]
+
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('image')
+
+
+def downgrade():
+    op.add_column('user', sa.Column('image', sa.LargeBinary(), nullable=True))
+    op.execute("""
+        UPDATE "user" SET image = (SELECT data FROM images WHERE images.hash = "user".image_hash)
+    """)
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_constraint('user_image_hash_fkey', type_='foreignkey')
+        batch_op.drop_column('image_hash')
+    op.drop_table('images')
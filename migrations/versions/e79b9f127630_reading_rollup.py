@@ -0,0 +1,46 @@
+"""reading rollup
+
+Revision ID: e79b9f127630
+Revises: 4e7f36fdda71
+Create Date: 2026-10-18 19:40:08.117463
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e79b9f127630'
+down_revision = '4e7f36fdda71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('reading_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('author', sa.String(length=128), nullable=True),
+    sa.Column('genre', sa.String(length=64), nullable=True),
+    sa.Column('books', sa.Integer(), nullable=False),
+    sa.Column('pages', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_reading_rollup_user_id_day', 'reading_rollup', ['user_id', 'day'], unique=False)
+
+    # already compacted: one row per user, day, author and genre
+    op.execute("""
+        INSERT INTO reading_rollup (user_id, day, author, genre, books, pages)
+        SELECT user_books.user_id, DATE(user_books.data_added), books.author, books.genre,
+               COUNT(*), COALESCE(SUM(books.pages), 0)
+        FROM user_books JOIN books ON books.id = user_books.books_id
+        WHERE user_books.list = 'DN' AND user_books.data_added IS NOT NULL
+        GROUP BY user_books.user_id, DATE(user_books.data_added), books.author, books.genre
+    """)
+
+
+def downgrade():
+    op.drop_index('ix_reading_rollup_user_id_day', table_name='reading_rollup')
+    op.drop_table('reading_rollup')
@@ -1,7 +1,7 @@
 """empty message
 
 Revision ID: e85343e0c5e3
-Revises: 
+Revises: 60c6f85bc9c6
 Create Date: 2019-10-20 22:24:14.110499
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = 'e85343e0c5e3'
-down_revision = None
+down_revision = '60c6f85bc9c6'
 branch_labels = None
 depends_on = None
 
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+from sqlalchemy import func
+
+from benchmarks import dataset
+from bookspace.core import querystats
+from bookspace.core.app import create_app, db
+from bookspace.models import Notes, Reviews, UsersBooks
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'query_budget(max_queries, max_repeats=None): '
+                                       'fail when a request of the test goes over this budget')
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """The app over a migrated sqlite database seeded with a small synthetic catalog."""
+    tmp = tmp_path_factory.mktemp('bookspace')
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp / "bookspace.db"}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+        'AUTH_REVOKED_FILE': str(tmp / 'revoked'),
+        'LEADERBOARD_VERSION_FILE': str(tmp / 'leaderboard.version'),
+        'SUGGEST_SNAPSHOT': str(tmp / 'suggest.idx'),
+        'FUZZY_INDEX_FILE': str(tmp / 'fuzzy.idx'),
+        'REC_NEIGHBOURS_FILE': str(tmp / 'rec.nbr'),
+        'CONTENT_NEIGHBOURS_FILE': str(tmp / 'content.nbr'),
+        'METRICS_DIR': str(tmp / 'metrics'),
+        'PROFILE_DIR': str(tmp / 'profiles'),
+        'PROFILE_RATE': 0,
+    })
+    with app.app_context():
+        dataset.seed(users=60, books=300, per_user=30, idle=2)
+        runner = app.test_cli_runner()
+        for command in ('build-recommendations', 'build-content-similar --workers 1'):
+            result = runner.invoke(args=command.split())
+            assert result.exit_code == 0, result.output
+    yield app
+    for name in os.listdir(tmp):
+        if name.endswith('.tmp'):
+            os.remove(tmp / name)
+
+
+@pytest.fixture
+def client(app):
+    with app.app_context():
+        yield app.test_client()
+
+
+@pytest.fixture(scope='session')
+def headers(app):
+    """user id -> Authorization header of every seeded reader."""
+    with app.app_context():
+        return {user_id: {'Authorization': f'Bearer {token}'}
+                for user_id, _, token in dataset.Dataset().readers}
+
+
+@pytest.fixture(scope='session')
+def reader(app):
+    """Id of the reader with the most shelved books."""
+    with app.app_context():
+        return db.session.query(UsersBooks.user_id).group_by(UsersBooks.user_id). \
+            order_by(func.count(UsersBooks.id).desc(), UsersBooks.user_id).first()[0]
+
+
+@pytest.fixture(scope='session')
+def reviewed(app):
+    """Id of the book with the most reviews."""
+    with app.app_context():
+        return db.session.query(Reviews.books_id).group_by(Reviews.books_id). \
+            order_by(func.count(Reviews.id).desc(), Reviews.books_id).first()[0]
+
+
+@pytest.fixture(scope='session')
+def noted(app):
+    """(user id, book id) of the reader and book with the most notes."""
+    with app.app_context():
+        return tuple(db.session.query(Notes.user_id, Notes.books_id).
+                     group_by(Notes.user_id, Notes.books_id).
+                     order_by(func.count(Notes.id).desc(), Notes.user_id, Notes.books_id).first())
+
+
+@pytest.fixture(autouse=True)
+def query_budget(request):
+    """Fail a test marked ``query_budget`` when one of its requests goes over the budget.
+
+    Yields the (method, path, QueryStats) of every request the test made.
+    """
+    marker = request.node.get_closest_marker('query_budget')
+    if marker is None:
+        yield None
+        return
+    with querystats.query_budget(*marker.args, **marker.kwargs) as seen:
+        yield seen
+    assert seen, 'no request was made under the query budget'
@@ -0,0 +1,35 @@
+import pytest
+
+
+@pytest.fixture
+def avatar(client, headers, reader):
+    response = client.get('/profile/image/raw', headers=headers[reader])
+    assert response.status_code == 200
+    return response
+
+
+def _get(client, headers, reader, **extra):
+    return client.get('/profile/image/raw', headers=dict(headers[reader], **extra))
+
+
+def test_revalidation(client, headers, reader, avatar):
+    response = _get(client, headers, reader, **{'If-None-Match': avatar.headers['ETag']})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == avatar.headers['ETag']
+
+
+def test_range(client, headers, reader, avatar):
+    response = _get(client, headers, reader, Range='bytes=0-9')
+    assert response.status_code == 206
+    assert response.data == avatar.data[:10]
+    assert response.headers['Content-Range'] == f'bytes 0-9/{len(avatar.data)}'
+
+
+def test_if_range(client, headers, reader, avatar):
+    response = _get(client, headers, reader, Range='bytes=10-19', **{'If-Range': avatar.headers['ETag']})
+    assert response.status_code == 206
+    assert response.data == avatar.data[10:20]
+
+    response = _get(client, headers, reader, Range='bytes=10-19', **{'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == avatar.data
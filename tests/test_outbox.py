@@ -0,0 +1,109 @@
+"""The mail sender against a local stand-in SMTP server."""
+import asyncore
+import smtpd
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from bookspace.core import outbox
+from bookspace.core.app import db
+from bookspace.models import MailStatus, Outbox
+
+
+class _Server(smtpd.SMTPServer):
+    """Accepts every mail except the ones to a ``reject@`` address."""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), None, decode_data=True)
+        self.received = []
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        if any(rcpt.startswith('reject@') for rcpt in rcpttos):
+            return '550 mailbox unavailable'
+        self.received.append((rcpttos, data))
+
+
+@pytest.fixture
+def smtp(app, monkeypatch):
+    server = _Server()
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05, 'map': server._map})
+    thread.start()
+    state = app.extensions['mail']
+    for name, value in {'server': '127.0.0.1', 'port': server.socket.getsockname()[1], 'use_tls': False,
+                        'use_ssl': False, 'username': None, 'suppress': False}.items():
+        monkeypatch.setattr(state, name, value)
+    with app.app_context():
+        yield server
+        Outbox.query.delete()
+        db.session.commit()
+    server.close()
+    thread.join()
+
+
+def _queue(*recipients):
+    for recipient in recipients:
+        outbox.enqueue(recipient, 'BookSpace register', f'password for {recipient}')
+    db.session.commit()
+    return {item.recipient: item.id for item in Outbox.query}
+
+
+def _due_now():
+    Outbox.query.update({Outbox.next_attempt: datetime.utcnow()})
+    db.session.commit()
+
+
+def test_sent_and_rejected(app, smtp):
+    ids = _queue('reader@example.com', 'reject@example.com')
+    before = datetime.utcnow()
+    assert outbox.send_pending() == 2
+
+    assert [rcpts for rcpts, _ in smtp.received] == [['reader@example.com']]
+    assert 'password for reader@example.com' in smtp.received[0][1]
+    sent = Outbox.query.get(ids['reader@example.com'])
+    assert (sent.status, sent.body, sent.attempts) == (MailStatus.sent, None, 0)
+    assert sent.sent >= before and sent.subject == 'BookSpace register'
+
+    rejected = Outbox.query.get(ids['reject@example.com'])
+    assert (rejected.status, rejected.attempts) == (MailStatus.pending, 1)
+    assert rejected.body == 'password for reject@example.com'
+    assert '550' in rejected.last_error
+    assert rejected.next_attempt >= before + timedelta(seconds=app.config['OUTBOX_RETRY_DELAY'])
+    # not due yet
+    assert outbox.send_pending() == 0
+
+
+def test_backoff_then_failed(app, smtp, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTBOX_MAX_ATTEMPTS', 3)
+    delay = app.config['OUTBOX_RETRY_DELAY']
+    item_id = _queue('reject@example.com')['reject@example.com']
+    for attempt, backoff in ((1, delay), (2, 2 * delay)):
+        before = datetime.utcnow()
+        assert outbox.send_pending() == 1
+        item = Outbox.query.get(item_id)
+        assert (item.status, item.attempts) == (MailStatus.pending, attempt)
+        assert before + timedelta(seconds=backoff) <= item.next_attempt <= \
+            datetime.utcnow() + timedelta(seconds=backoff)
+        _due_now()
+
+    assert outbox.send_pending() == 1
+    item = Outbox.query.get(item_id)
+    assert (item.status, item.attempts, item.body) == (MailStatus.failed, 3, None)
+    assert item.recipient == 'reject@example.com' and item.last_error
+    _due_now()
+    assert outbox.send_pending() == 0
+    assert smtp.received == []
+
+
+def test_connection_refused(app, smtp, monkeypatch):
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+    monkeypatch.setattr(app.extensions['mail'], 'port', port)
+    ids = _queue('one@example.com', 'two@example.com')
+    assert outbox.send_pending() == 2
+    for item_id in ids.values():
+        item = Outbox.query.get(item_id)
+        assert (item.status, item.attempts) == (MailStatus.pending, 1)
+        assert item.body is not None and item.last_error
@@ -0,0 +1,23 @@
+"""Plans of the hot lookups against the migrated schema, see ``flask check-plans``."""
+import pytest
+
+from bookspace import commands
+from bookspace.core.app import db
+
+
+@pytest.fixture
+def hot_queries(app):
+    with app.app_context():
+        yield commands._hot_queries()
+        db.session.rollback()
+
+
+def test_no_full_scans(hot_queries):
+    dialect = db.engine.dialect
+    scans = {}
+    for name, query in hot_queries.items():
+        sql = query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+        scanned = sorted(set(commands._scanned_tables(dialect.name, sql)))
+        if scanned:
+            scans[name] = scanned
+    assert not scans
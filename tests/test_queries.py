@@ -0,0 +1,56 @@
+"""Query budgets of the routes that used to run a query per listed row.
+
+Every list below holds several rows, so a per-row query shows up as a
+statement repeated more than once.
+"""
+import pytest
+
+budget = pytest.mark.query_budget
+
+
+@pytest.mark.parametrize('path, key', [
+    pytest.param('/books/read', 'info', marks=budget(2, max_repeats=1)),
+    pytest.param('/books/progress', 'info', marks=budget(2, max_repeats=1)),
+    pytest.param('/books/future?total=1', 'info', marks=budget(3, max_repeats=1)),
+    pytest.param('/books/recent', 'books', marks=budget(2, max_repeats=1)),
+    pytest.param('/home/top', 'books', marks=budget(3, max_repeats=1)),
+    pytest.param('/home/rec', 'books', marks=budget(3, max_repeats=1)),
+])
+def test_reader_lists(client, headers, reader, path, key):
+    body = client.get(path, headers=headers[reader]).get_json()
+    assert body['status'] == 200
+    assert len(body[key]) > 1
+
+
+@budget(4, max_repeats=1)
+def test_book_page(client, headers, reader, reviewed):
+    body = client.get(f'/books/{reviewed}', headers=headers[reader]).get_json()
+    assert body['status'] == 200
+    assert len(body['book']['recs']) > 1
+
+
+@budget(4, max_repeats=1)
+def test_reviews(client, headers, reader, reviewed):
+    body = client.get(f'/books/{reviewed}/reviews', headers=headers[reader]).get_json()
+    assert body['status'] == 200
+    assert len({review['username'] for review in body['info']}) > 1
+
+
+@budget(3, max_repeats=1)
+def test_notes(client, headers, noted):
+    user_id, book_id = noted
+    body = client.get(f'/books/{book_id}/notes', headers=headers[user_id]).get_json()
+    assert body['status'] == 200
+    assert len(body['notes']) > 1
+
+
+@budget(3, max_repeats=1)
+def test_profile_and_stats(client, headers, reader):
+    for path in ('/profile', '/stats?range=year', '/stats/timeline?unit=week'):
+        assert client.get(path, headers=headers[reader]).get_json()['status'] == 200
+
+
+@budget(7, max_repeats=2)
+def test_rating(client, headers, reader, reviewed):
+    body = client.post(f'/books/{reviewed}', headers=headers[reader], json={'rate': '4'}).get_json()
+    assert body['status'] == 200
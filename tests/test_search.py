@@ -0,0 +1,21 @@
+from sqlalchemy import func
+
+from bookspace.core.app import db
+from bookspace.models import Books
+
+
+def test_best_rated_match_first(app, client, headers, reader):
+    genre, = db.session.query(Books.genre).group_by(Books.genre).order_by(func.count(Books.id).desc()).first()
+    best = Books.query.filter_by(genre=genre).order_by(Books.rate.desc(), Books.id.desc()).first()
+    app.config['SEARCH_CANDIDATES'] = 5
+    try:
+        body = client.post('/books/search', headers=headers[reader], json={'search': genre, 'limit': 3}).get_json()
+        assert body['ranked'] == 5 < body['total']
+        ids = [book['id'] for book in body['books']]
+        body = client.post('/books/search', headers=headers[reader],
+                           json={'search': genre, 'limit': 3, 'cursor': body['next']}).get_json()
+        ids += [book['id'] for book in body['books']]
+    finally:
+        app.config['SEARCH_CANDIDATES'] = 1000
+    assert len(ids) == len(set(ids)) == 5
+    assert best.id in ids
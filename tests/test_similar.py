@@ -0,0 +1,36 @@
+from bookspace.applications.books import similar
+from bookspace.core.app import db
+from bookspace.models import Books, BookSimilar, BookSimilarChanges
+
+
+def _stored(book_id):
+    return [row[0] for row in db.session.query(BookSimilar.similar_id).
+            filter_by(book_id=book_id).order_by(BookSimilar.position)]
+
+
+def test_unbuilt_book_is_not_written(client):
+    book = Books.query.order_by(Books.id).first()
+    stored = _stored(book.id)
+    BookSimilar.query.filter_by(book_id=book.id).delete()
+    db.session.commit()
+    try:
+        assert [row.id for row in similar.similar_books(book)] == stored
+        assert not db.session.new and not db.session.dirty
+        assert _stored(book.id) == []
+    finally:
+        similar.rebuild([book])
+        db.session.commit()
+
+
+def test_rating_is_refreshed_later(client, headers, reader):
+    # an unrated book of a genre with full lists; five stars put it on top of them
+    book = Books.query.filter(Books.rate_count == 0, Books.genre.isnot(None)).order_by(Books.id).first()
+    assert book.id not in _stored(book.id)
+    assert client.post(f'/books/{book.id}', headers=headers[reader], json={'rate': '5'}).get_json()['status'] == 200
+    assert BookSimilarChanges.query.filter_by(book_id=book.id).count() == 1
+    same_genre = Books.query.filter(Books.genre == book.genre, Books.id != book.id).order_by(Books.id).first()
+    assert book.id not in _stored(same_genre.id)
+
+    assert similar.refresh() > 1
+    assert book.id in _stored(same_genre.id)
+    assert BookSimilarChanges.query.count() == 0
@@ -0,0 +1,19 @@
+import datetime
+
+import pytest
+
+from bookspace.applications.users import reading
+
+
+@pytest.mark.parametrize('unit', reading.UNITS)
+def test_bucket_count(unit):
+    start = datetime.date(2023, 12, 25)
+    for days in range(0, 800, 13):
+        end = start + datetime.timedelta(days=days)
+        assert reading.bucket_count(start, end, unit) == sum(1 for _ in reading.buckets(start, end, unit))
+
+
+def test_window_too_large(client, headers, reader):
+    body = client.get('/stats/timeline?from=0001-01-01&to=9999-12-31&unit=day',
+                      headers=headers[reader]).get_json()
+    assert body['status'] == 400